@@ -5,8 +5,11 @@ from airflow.decorators import dag
 from airflow.operators.python import PythonOperator
 
 # 导入语句已更新，因为所有相关脚本现在都在同一个 dags 目录中
+from refresh_assignments import main as assignment_main
 from run_all_metrics import main as snapshot_main
 from summary_cache import main as aggregate_main
+from warm_cache import main as warm_main
+from purge_cache import main as purge_main
 
 
 @dag(
@@ -28,6 +31,12 @@ def ab_testing_pipeline():
     This DAG runs the daily snapshot and aggregation tasks for A/B testing.
     """
 
+    # 物化分组表（建表 + 增量刷新）：后面生成快照的 fetcher 都读它
+    task_refresh_assignments = PythonOperator(
+        task_id='refresh_assignments',
+        python_callable=assignment_main,
+    )
+
     task_generate_snapshot = PythonOperator(
         task_id='generate_metric_snapshots',
         python_callable=snapshot_main,
@@ -38,7 +47,20 @@ def ab_testing_pipeline():
         python_callable=aggregate_main,
     )
 
-    task_generate_snapshot >> task_aggregate_and_cache
+    # 新数据落地、缓存 generation 已 bump：让 web 服务把运行中实验的缓存预先算好
+    task_warm_cache = PythonOperator(
+        task_id='warm_cache',
+        python_callable=warm_main,
+    )
+
+    # 删掉过期 / 长期没人看的缓存行，按字节预算淘汰最久没访问的
+    task_purge_cache = PythonOperator(
+        task_id='purge_cache',
+        python_callable=purge_main,
+    )
+
+    task_refresh_assignments >> task_generate_snapshot >> task_aggregate_and_cache >> task_warm_cache
+    task_aggregate_and_cache >> task_purge_cache
 
 
 # 实例化 DAG
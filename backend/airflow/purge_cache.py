@@ -0,0 +1,26 @@
+import sys
+import os
+import logging
+
+# 自动将项目根目录加入 sys.path，保证绝对导入
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from backend.utils.engine_utils import get_db_connection
+from backend.utils.cache_housekeeping import run_housekeeping
+
+logger = logging.getLogger("airflow.task")
+logger.setLevel(logging.INFO)
+
+def main():
+    # 缓存表和数仓在同一个库上，和 summary_cache 一样用 get_db_connection
+    stats = run_housekeeping(get_db_connection())
+    logger.info(
+        f"缓存清理完成: 扫描 {stats['scanned']} 行，删除过期 / 长期未用 {stats['purged']} 行，"
+        f"按容量淘汰 {stats['evicted']} 行，{stats['bytes_before']} -> {stats['bytes_after']} 字节"
+        f"（预算 {stats['max_bytes']}）"
+    )
+
+if __name__ == "__main__":
+    main()
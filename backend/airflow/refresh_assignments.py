@@ -0,0 +1,38 @@
+import sys
+import os
+import logging
+
+# 自动将项目根目录加入 sys.path，保证绝对导入
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from backend.utils.engine_utils import get_db_connection
+from backend.airflow.experiment_filter import get_valid_experiments
+from backend.sql_jobs.assignment import USE_ASSIGNMENT_TABLE, create_assignment_tables, refresh_assignment_table
+
+logger = logging.getLogger("airflow.task")
+logger.setLevel(logging.INFO)
+
+def main():
+    # 物化分组表的建表和刷新只在流水线里做，web 请求只读（见 sql_jobs/assignment.py）
+    if not USE_ASSIGNMENT_TABLE:
+        logger.info("USE_ASSIGNMENT_TABLE 未开启，跳过物化分组刷新")
+        return
+    engine = get_db_connection()
+    create_assignment_tables(engine)
+    experiments = get_valid_experiments()
+    logger.info(f"开始刷新 {len(experiments)} 个实验的物化分组")
+    failed = 0
+    for exp in experiments:
+        experiment_name = exp["experiment_name"]
+        try:
+            refresh_assignment_table(experiment_name, engine)
+        except Exception as e:
+            # 单个实验失败时该实验的 fetcher 仍能用旧的物化表 + watermark 之后的增量，不影响其它实验
+            failed += 1
+            logger.error(f"Refreshing assignment table failed for '{experiment_name}': {e}", exc_info=True)
+    logger.info(f"物化分组刷新完成，失败 {failed} 个")
+
+if __name__ == "__main__":
+    main()
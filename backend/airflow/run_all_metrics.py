@@ -3,44 +3,21 @@ import json
 from collections import defaultdict
 from datetime import datetime
 from inspect import signature
+from itertools import chain
 import pandas as pd
 from sqlalchemy.sql import text
 
 # 确保以下导入路径根据您的项目结构是正确的
 from backend.service.config import INDICATOR_CONFIG
 from backend.utils.engine_utils import get_db_connection
+from backend.utils.fetch_utils import stream_kwargs
 from backend.airflow.experiment_filter import get_valid_experiments
+from backend.utils.snapshot_utils import (
+    supports_incremental, open_days_for, get_snapshot_rows, plan_fetch_ranges
+)
 
-# 【新增】从您另一个脚本中导入缓存写入函数，如果它在不同位置，请调整路径
-try:
-    from backend.airflow.summary_cache import write_to_query_cache
-except ImportError:
-    # 如果无法导入，提供一个本地的备用定义
-    def write_to_query_cache(engine_or_conn, query_type, experiment_name, metric, category, start_date, end_date,
-                             result_json):
-        sql = """
-        INSERT INTO abtest_query_cache
-        (query_type, experiment_name, metric, category, start_date, end_date, updated_at, result_json)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE
-        updated_at = VALUES(updated_at),
-        result_json = VALUES(result_json)
-        """
-        # 兼容传入的是 engine 还是 connection
-        if hasattr(engine_or_conn, 'execute'):
-            conn = engine_or_conn
-            conn.execute(sql, (
-                query_type, experiment_name, metric, category,
-                start_date, end_date, datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                json.dumps(result_json, default=str)
-            ))
-        else:  # Assumes it's an engine
-            with engine_or_conn.begin() as conn:
-                conn.execute(sql, (
-                    query_type, experiment_name, metric, category,
-                    start_date, end_date, datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    json.dumps(result_json, default=str)
-                ))
+# 缓存写入和 summary_cache / 在线接口共用同一条 upsert
+from backend.airflow.summary_cache import write_to_query_cache
 
 logger = logging.getLogger("airflow.task")
 logger.setLevel(logging.INFO)
@@ -93,6 +70,7 @@ def run_all_metrics(experiment_name, start_date, end_date, engine=None):
     if engine is None:
         engine = get_db_connection()
 
+    # 物化分组表由上游的 refresh_assignments 任务刷新，这里所有指标直接复用
     with engine.begin() as conn:
         for metric, cfg in INDICATOR_CONFIG.items():
             logger.info("=" * 60)
@@ -139,22 +117,41 @@ def run_all_metrics(experiment_name, start_date, end_date, engine=None):
 
             # --- 旧逻辑：处理普通趋势图指标 ---
             logger.info(f"Processing as TREND: {metric}")
+
+            # 增量：只取快照里缺失的日期 + 末尾仍在变化的 open days
+            fetch_ranges = [(start_date, end_date)]
+            if supports_incremental(cfg):
+                try:
+                    existing_dates = {
+                        r["event_date"] for r in get_snapshot_rows(conn, experiment_name, metric, start_date, end_date)
+                    }
+                    fetch_ranges = plan_fetch_ranges(start_date, end_date, existing_dates, open_days_for(cfg))
+                except Exception as e:
+                    logger.error(f"Reading snapshot for '{metric}' failed, falling back to full range: {e}", exc_info=True)
+                if not fetch_ranges:
+                    logger.info(f"Snapshot for '{metric}' is complete, skipping.")
+                    continue
+                logger.info(f"Incremental ranges for '{metric}': {fetch_ranges}")
+
             try:
                 # （此处的翻页逻辑保持不变）
                 sig = signature(fetch_func)
                 supports_chunk = 'limit' in sig.parameters and 'offset' in sig.parameters
-                if supports_chunk:
-                    rows = []
-                    offset = 0
-                    chunk_size = 10000
-                    while True:
-                        chunk = call_fetch_func_compatible(fetch_func, experiment_name, start_date, end_date, conn,
-                                                           limit=chunk_size, offset=offset)
-                        if not chunk: break
-                        rows.extend(chunk)
-                        offset += chunk_size
-                else:
-                    rows = call_fetch_func_compatible(fetch_func, experiment_name, start_date, end_date, conn)
+                # 每个区间一个行来源；流式 fetcher 返回生成器，下面写快照参数时边读边转换
+                row_sources = []
+                for range_start, range_end in fetch_ranges:
+                    if supports_chunk:
+                        offset = 0
+                        chunk_size = 10000
+                        while True:
+                            chunk = call_fetch_func_compatible(fetch_func, experiment_name, range_start, range_end, conn,
+                                                               limit=chunk_size, offset=offset)
+                            if not chunk: break
+                            row_sources.append(chunk)
+                            offset += chunk_size
+                    else:
+                        row_sources.append(call_fetch_func_compatible(fetch_func, experiment_name, range_start, range_end,
+                                                                      conn, **stream_kwargs(fetch_func)))
             except Exception as e:
                 logger.error(f"Error fetching data for trend metric '{metric}': {e}", exc_info=True)
                 continue
@@ -168,32 +165,52 @@ def run_all_metrics(experiment_name, start_date, end_date, engine=None):
             category = cfg.get("category", "")
             params_to_insert = []
 
-            for row in rows:
-                row_dict = dict(row)  # 转换为字典以便于getval处理
-                variation_id = getval(row_dict, variation_field) or "default"
-                value = getval(row_dict, value_field)
-                revenue = getval(row_dict, revenue_field)
-                order = getval(row_dict, order_field)
-                event_date = getval(row_dict, date_field)
-                if event_date and hasattr(event_date, 'strftime'):
-                    event_date_str = event_date.strftime("%Y-%m-%d")
-                elif event_date:
-                    event_date_str = str(event_date)[:10]
-                else:
-                    event_date_str = None
-
-                params_to_insert.append((
-                    "trend", experiment_name, metric, category, str(variation_id),
-                    event_date_str, start_date, end_date,
-                    float(value) if value is not None else None,
-                    float(revenue) if revenue is not None else None,
-                    int(order) if order is not None else None,
-                    datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    json.dumps(row_dict, default=str)
-                ))
+            try:
+                for row in chain.from_iterable(row_sources):
+                    row_dict = dict(row)  # 转换为字典以便于getval处理
+                    variation_id = getval(row_dict, variation_field) or "default"
+                    value = getval(row_dict, value_field)
+                    revenue = getval(row_dict, revenue_field)
+                    order = getval(row_dict, order_field)
+                    event_date = getval(row_dict, date_field)
+                    if event_date and hasattr(event_date, 'strftime'):
+                        event_date_str = event_date.strftime("%Y-%m-%d")
+                    elif event_date:
+                        event_date_str = str(event_date)[:10]
+                    else:
+                        event_date_str = None
+
+                    params_to_insert.append((
+                        "trend", experiment_name, metric, category, str(variation_id),
+                        event_date_str, start_date, end_date,
+                        float(value) if value is not None else None,
+                        float(revenue) if revenue is not None else None,
+                        int(order) if order is not None else None,
+                        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        json.dumps(row_dict, default=str)
+                    ))
+            except Exception as e:
+                # 流式取数时 SQL 错误会在这里才抛出
+                logger.error(f"Error fetching data for trend metric '{metric}': {e}", exc_info=True)
+                continue
 
             if params_to_insert:
                 try:
+                    # 重取的日期先删掉旧快照行，再写入新结果，避免同一天出现多条
+                    conn.execute(
+                        text("""
+                            DELETE FROM abtest_metric_snapshot
+                            WHERE query_type = 'trend'
+                              AND experiment_name = :experiment_name
+                              AND metric = :metric
+                              AND event_date BETWEEN :range_start AND :range_end
+                        """),
+                        [
+                            {"experiment_name": experiment_name, "metric": metric,
+                             "range_start": range_start, "range_end": range_end}
+                            for range_start, range_end in fetch_ranges
+                        ]
+                    )
                     insert_sql = """
                         INSERT INTO abtest_metric_snapshot
                         (query_type, experiment_name, metric, category, variation_id, event_date, start_date, end_date, value, revenue, orders, updated_at, result_json)
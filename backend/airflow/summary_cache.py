@@ -1,9 +1,6 @@
 import sys
 import os
-import json
 import logging
-from collections import defaultdict
-from datetime import datetime
 import numpy as np
 
 # 自动将项目根目录加入 sys.path，保证绝对导入
@@ -12,6 +9,9 @@ if PROJECT_ROOT not in sys.path:
     sys.path.append(PROJECT_ROOT)
 
 from backend.utils.engine_utils import get_db_connection
+from backend.utils.cache_utils import encode_result, upsert_query_cache
+from backend.utils.cache_generation import next_generation, bump_generations
+from backend.utils.columnar import rows_to_columns, group_by_variation, pivot_by_date, to_list
 from backend.service.config import INDICATOR_CONFIG
 from backend.airflow.experiment_filter import get_valid_experiments
 
@@ -19,18 +19,6 @@ from backend.airflow.experiment_filter import get_valid_experiments
 logger = logging.getLogger("airflow.task")
 logger.setLevel(logging.INFO)
 
-def safe_float(val):
-    try:
-        return float(val)
-    except Exception:
-        return None
-
-def safe_int(val):
-    try:
-        return int(val)
-    except Exception:
-        return None
-
 def bayesian_summary(samples):
     samples = np.array(samples)
     mean = np.mean(samples) if len(samples) > 0 else 0.0
@@ -59,27 +47,19 @@ def calc_bayesian_from_snapshot(engine, experiment_name, metric, category, start
     """
     with engine.begin() as conn:
         rows = conn.execute(sql, (experiment_name, metric, category, start_date, end_date)).fetchall()
-    group_value = defaultdict(list)
-    group_revenue = defaultdict(float)
-    group_order = defaultdict(int)
-    for row in rows:
-        v_id = str(row['variation_id'])
-        v = row['value']
-        revenue = row.get('revenue', 0) if isinstance(row, dict) else row[2] if len(row) > 2 else 0
-        order = row.get('orders', 0) if isinstance(row, dict) else row[3] if len(row) > 3 else 0
-        if v is not None:
-            group_value[v_id].append(safe_float(v))
-            group_revenue[v_id] += safe_float(revenue) if revenue is not None else 0.0
-            group_order[v_id] += safe_int(order) if order is not None else 0
+    columns = rows_to_columns(rows, {
+        "variation_field": 0, "date_field": None, "value_field": 1, "revenue_field": 2, "order_field": 3
+    })
     result = {
         "groups": [],
-        "distribution": {str(k): [safe_float(x) for x in v] for k, v in group_value.items()}
+        "distribution": {}
     }
-    for v_id, values in group_value.items():
+    for v_id, values, revenue_sum, order_sum in group_by_variation(columns, variation_label=str):
+        result["distribution"][v_id] = values.tolist()
         summary = bayesian_summary(values)
         summary["group"] = v_id
-        summary["total_revenue"] = safe_float(group_revenue[v_id])
-        summary["total_order"] = safe_int(group_order[v_id])
+        summary["total_revenue"] = revenue_sum
+        summary["total_order"] = order_sum
         result["groups"].append(summary)
     return result
 
@@ -93,46 +73,33 @@ def calc_trend_from_snapshot(engine, experiment_name, metric, category, start_da
     """
     with engine.begin() as conn:
         rows = conn.execute(sql, (experiment_name, metric, category, start_date, end_date)).fetchall()
-    date_set = set()
-    group_value = defaultdict(dict)
-    group_revenue = defaultdict(dict)
-    group_order = defaultdict(dict)
-    for row in rows:
-        v_id = str(row['variation_id'])
-        d = str(row['event_date'])[:10]
-        value = row['value']
-        revenue = row.get('revenue', 0) if isinstance(row, dict) else row[3] if len(row) > 3 else 0
-        order = row.get('orders', 0) if isinstance(row, dict) else row[4] if len(row) > 4 else 0
-        date_set.add(d)
-        group_value[v_id][d] = safe_float(value) if value is not None else None
-        group_revenue[v_id][d] = safe_float(revenue) if revenue is not None else None
-        group_order[v_id][d] = safe_int(order) if order is not None else None
-    dates = sorted(list(date_set))
+    columns = rows_to_columns(rows, {
+        "variation_field": 0, "date_field": 1, "value_field": 2, "revenue_field": 3, "order_field": 4
+    })
+    pivot = pivot_by_date(columns, variation_label=str)
     series = []
-    for v_id in group_value:
-        data = [group_value[v_id].get(date, None) for date in dates]
-        revenue = [group_revenue[v_id].get(date, None) for date in dates]
-        order = [group_order[v_id].get(date, None) for date in dates]
+    for i, v_id in enumerate(pivot["variations"]):
         series.append({
             "variation": v_id,
-            "data": data,
-            "revenue": revenue,
-            "order": order
+            "data": to_list(pivot["value"][i]),
+            "revenue": to_list(pivot["revenue"][i]),
+            "order": to_list(pivot["order"][i], as_int=True)
         })
-    return {"dates": dates, "series": series}
+    return {"dates": pivot["dates"], "series": series}
 
 def write_to_query_cache(engine, query_type, experiment_name, metric, category, start_date, end_date, result_json):
-    sql = """
-    INSERT INTO abtest_query_cache
-    (query_type, experiment_name, metric, category, start_date, end_date, updated_at, result_json)
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-    """
-    with engine.begin() as conn:
-        conn.execute(sql, (
-            query_type, experiment_name, metric, category,
-            start_date, end_date, datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            json.dumps(result_json, default=str)
-        ))
+    # 和在线接口同一条 upsert（唯一键覆盖完整缓存 key），重复跑不会堆出重复行
+    # 流水线写的行记本轮的 generation，main 跑完 bump 之后这些行就是最新的一代
+    upsert_query_cache(engine, [{
+        "query_type": query_type,
+        "experiment_name": experiment_name,
+        "metric": metric,
+        "category": category,
+        "start_date": start_date,
+        "end_date": end_date,
+        "result_json": encode_result(result_json),
+        "generation": next_generation(engine, experiment_name),
+    }])
 
 def persist_all_results_for_experiment(engine, experiment, metrics_config):
     experiment_name = experiment["experiment_name"]
@@ -160,6 +127,9 @@ def main():
     logger.info(f"\n共获取到 {len(experiments)} 个实验，依次处理...\n")
     for exp in experiments:
         persist_all_results_for_experiment(engine, exp, INDICATOR_CONFIG)
+    # 新数据已落地：这些实验在线接口写的旧缓存全部过期，下次访问时刷新
+    bump_generations(engine, [exp["experiment_name"] for exp in experiments])
+    logger.info(f"已更新 {len(experiments)} 个实验的缓存 generation")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,19 @@
+import os
+import logging
+import requests
+
+# 预热在 web 服务里跑（计算代码和缓存都在那边，airflow 镜像里也没有 flask），这里只负责触发
+CACHE_WARMER_URL = os.environ.get("CACHE_WARMER_URL", "http://backend:8080/api/cache_warmer")
+
+logger = logging.getLogger("airflow.task")
+logger.setLevel(logging.INFO)
+
+def main():
+    response = requests.post(CACHE_WARMER_URL, timeout=30)
+    response.raise_for_status()
+    job = response.json()
+    logger.info(f"已触发缓存预热: job_id={job.get('job_id')}, status={job.get('status')}")
+    logger.info(f"进度查询: GET {CACHE_WARMER_URL}")
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,13 @@ from backend.service.all import all_bp
 from backend.service.all_in_one import bp as all_in_one_bp
 from backend.growthbook_fetch.experiment_data import bp as growthbook_bp
 from backend.service.cohort import bp_cohort
+from backend.service.warmer import start_warm_job, start_background_warmer, warmer_status
+from backend.utils.admission import AdmissionRejected, admission_stats
+from backend.utils.engine_utils import pool_stats, get_local_cache_engine
+from backend.utils.jobs import get_job, submit_job
+from backend.utils.cache_housekeeping import cache_size_report, run_housekeeping
+from backend.utils.local_cache import local_cache_stats
+from backend.utils.single_flight import single_flight_stats
 
 app = Flask(__name__)
 app.register_blueprint(bp_cohort)
@@ -15,6 +22,47 @@ app.register_blueprint(bp_cohort)
 def healthz():
     return {"status": "ok"}
 
+# 数仓准入 / 连接池 / 进程内缓存的运行状态（按 worker 进程统计），用来调并发参数
+@app.get("/api/warehouse_stats")
+def warehouse_stats():
+    return {
+        "admission": admission_stats(),
+        "pools": pool_stats(),
+        "local_cache": local_cache_stats(),
+        "single_flight": single_flight_stats(),
+    }
+
+# 预估过贵、转后台计算的请求用 job_id 查进度（只记在当前 worker，查不到时直接重新请求原接口）
+@app.get("/api/jobs/<job_id>")
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return {"error": "任务不存在或不在当前 worker"}, 404
+    return job
+
+# 缓存预热：POST 触发一轮（ab_testing_pipeline 跑完后调），GET 查当前 worker 上的进度
+@app.post("/api/cache_warmer")
+def trigger_cache_warmer():
+    return start_warm_job(), 202
+
+@app.get("/api/cache_warmer")
+def cache_warmer_status():
+    return warmer_status()
+
+# 缓存表容量：按实验 / query_type 汇总；POST 手动触发一次清理（平时由 ab_testing_pipeline 每天跑）
+@app.get("/api/cache_report")
+def cache_report():
+    return cache_size_report(get_local_cache_engine())
+
+@app.post("/api/cache_housekeeping")
+def trigger_cache_housekeeping():
+    return submit_job(("cache_housekeeping",), run_housekeeping, get_local_cache_engine(), pool="maintenance"), 202
+
+@app.errorhandler(AdmissionRejected)
+def handle_admission_rejected(e):
+    # 数仓排队满 / 超时：让前端稍后重试，而不是当成 500
+    return {"error": "数仓繁忙", "msg": str(e)}, 503, {"Retry-After": "5"}
+
 @app.before_request
 def log_request_info():
     print(f"[全局请求] {request.method} {request.path} args={dict(request.args)}", flush=True)
@@ -28,6 +76,7 @@ app.register_blueprint(growthbook_bp)
 app.register_blueprint(all_bp)
 app.register_blueprint(all_in_one_bp)
 register_indicator_routes(app, INDICATOR_CONFIG)
+start_background_warmer()
 
 print('路由注册完成', flush=True)
 for rule in app.url_map.iter_rules():
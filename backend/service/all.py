@@ -4,8 +4,17 @@ from .config import INDICATOR_CONFIG
 from functools import lru_cache
 
 from .service import bayesian_summary
-from ..utils.cache_utils import get_abtest_cache, set_abtest_cache
+from ..utils.cache_utils import (
+    cache_key, get_abtest_cache, lookup_metric_caches, set_abtest_cache, set_abtest_cache_many,
+    mark_stale, refresh_in_background
+)
+from ..utils.single_flight import single_flight
+from ..utils.response_body import cached_response, combine_etags, object_body, result_of
 from ..utils.engine_utils import get_local_cache_engine, get_db_connection
+from ..utils.admission import AdmissionRejected
+from ..utils.columnar import rows_to_columns, fetch_columns, group_by_variation, pivot_by_date, to_list
+from ..utils.snapshot_utils import fetch_with_snapshot
+from ..sql_jobs.query_planner import fetch_planned
 
 all_bp = Blueprint("all", __name__)
 
@@ -21,17 +30,82 @@ def get_metrics_by_category():
 def get_metric_names(category):
     return get_metrics_by_category().get(category, [])
 
-def getval(row, field):
-    if isinstance(field, int):
-        try:
-            return row[field]
-        except Exception:
-            return None
-    elif isinstance(field, str):
-        if isinstance(row, dict):
-            return row.get(field)
-        return None
-    return None
+def compute_metric(metric_name, experiment_name, start_date, end_date, engine, rows=None):
+    """单个指标的贝叶斯结果：取数（rows 为合并查询已取好的行时直接用）→ 按组汇总。缓存由调用方写。"""
+    cfg = INDICATOR_CONFIG[metric_name]
+    if rows is not None:
+        columns = rows_to_columns(rows, cfg)
+    else:
+        columns = fetch_columns(cfg, experiment_name, start_date, end_date, engine)
+    metric_result = {
+        "groups": [],
+        "distribution": {}
+    }
+    for group, values, revenue_sum, order_sum in group_by_variation(columns):
+        metric_result["distribution"][str(group)] = values.tolist()
+        summary = bayesian_summary(values)
+        summary["group"] = group
+        summary["total_revenue"] = revenue_sum
+        summary["total_order"] = order_sum
+        metric_result["groups"].append(summary)
+    return metric_result
+
+def compute_metric_trend(metric_name, experiment_name, start_date, end_date, engine):
+    """单个指标的趋势结果（快照增量取数），缺失的 revenue / order 补 0。缓存由调用方写。"""
+    cfg = INDICATOR_CONFIG[metric_name]
+    rows = fetch_with_snapshot(cfg, metric_name, experiment_name, start_date, end_date, engine)
+    pivot = pivot_by_date(rows_to_columns(rows, cfg))
+    series = []
+    for i, group in enumerate(pivot["variations"]):
+        series.append({
+            "variation": group,
+            "data": to_list(pivot["value"][i]),
+            "revenue": to_list(pivot["revenue"][i], fill=0),
+            "order": to_list(pivot["order"][i], fill=0, as_int=True)
+        })
+    return {
+        "dates": pivot["dates"],
+        "series": series
+    }
+
+def refresh_metric_cache(query_type, metric_name, experiment_name, start_date, end_date):
+    """后台重算单个指标并写缓存（stale-while-revalidate 的刷新任务）；多个副本同时刷新同一个 key 时只算一次。"""
+    local_engine = get_local_cache_engine()
+    category = INDICATOR_CONFIG[metric_name].get("category", "") or ""
+
+    def refresh():
+        engine = get_db_connection()
+        if query_type == "trend":
+            result = compute_metric_trend(metric_name, experiment_name, start_date, end_date, engine)
+        else:
+            result = compute_metric(metric_name, experiment_name, start_date, end_date, engine)
+        set_abtest_cache(local_engine, query_type, experiment_name, metric_name, category, start_date, end_date, result)
+        return result
+
+    return single_flight(
+        cache_key(query_type, experiment_name, metric_name, category, start_date, end_date),
+        refresh,
+        engine=local_engine,
+        recheck=lambda: get_abtest_cache(
+            local_engine, query_type, experiment_name, metric_name, category, start_date, end_date
+        ),
+    )
+
+def rejected_result(query_type, e):
+    """数仓准入拒绝的指标：空结果 + error，不写缓存，其它指标照常返回（前端稍后重试这个指标）。"""
+    if query_type == "trend":
+        return {"dates": [], "series": [], "error": str(e), "retryable": True}
+    return {"groups": [], "distribution": {}, "error": str(e), "retryable": True}
+
+def serve_stale(all_results, stale_metrics, query_type, experiment_name, start_date, end_date):
+    """过期命中的指标加 stale 标记，并各自提交一个后台刷新任务。"""
+    for metric in stale_metrics:
+        all_results[metric] = mark_stale(result_of(all_results[metric]))
+        category = INDICATOR_CONFIG[metric].get("category", "") or ""
+        refresh_in_background(
+            (query_type, experiment_name, metric, category, start_date, end_date),
+            refresh_metric_cache, query_type, metric, experiment_name, start_date, end_date
+        )
 
 @all_bp.route('/api/all_trend', methods=['GET'])
 def all_trend():
@@ -53,63 +127,38 @@ def all_trend():
         engine = get_db_connection()
         all_results = {}
 
-        for metric in metric_names:
-            cfg = INDICATOR_CONFIG.get(metric)
-            if not cfg:
-                continue
+        # 查 metric 级别缓存（query_type="trend"，category=真实分类），所有指标一次查完；过期的先返回再后台刷新
+        stale_metrics = set()
+        cached, missing = lookup_metric_caches(
+            local_engine, "trend", experiment_name, metric_names, start_date, end_date, stale_metrics, entries=True
+        )
+        all_results.update(cached)
+        serve_stale(all_results, stale_metrics, "trend", experiment_name, start_date, end_date)
+        new_entries = []
+
+        for metric in missing:
+            cfg = INDICATOR_CONFIG[metric]
             true_category = cfg.get("category", "") or ""
-            # 查 metric 级别缓存（query_type="trend"，category=真实分类）
-            cache = get_abtest_cache(
-                local_engine, "trend", experiment_name, metric, true_category, start_date, end_date
-            )
-            if cache:
-                all_results[metric] = cache
-                continue
-
             try:
-                rows = cfg["fetch_func"](experiment_name, start_date, end_date, engine)
+                all_results[metric] = compute_metric_trend(metric, experiment_name, start_date, end_date, engine)
+            except AdmissionRejected as e:
+                print(f"[ADMISSION] [trend] [{metric}] {e}")
+                all_results[metric] = rejected_result("trend", e)
+                continue
             except Exception as e:
                 continue
-
-            date_set = set()
-            group_value = defaultdict(dict)
-            group_revenue = defaultdict(dict)
-            group_order = defaultdict(dict)
-            for row in rows:
-                variation_id = getval(row, cfg.get("variation_field", 0))
-                event_date = getval(row, cfg.get("date_field", 1))
-                revenue = getval(row, cfg["revenue_field"])
-                order = getval(row, cfg["order_field"])
-                value = getval(row, cfg["value_field"])
-                if event_date is None or variation_id is None:
-                    continue
-                date_str = str(event_date)
-                date_set.add(date_str)
-                group_value[variation_id][date_str] = float(value) if value is not None else None
-                group_revenue[variation_id][date_str] = float(revenue) if revenue is not None else 0
-                group_order[variation_id][date_str] = int(order) if order is not None else 0
-            dates = sorted(list(date_set))
-            series = []
-            for group in group_value:
-                data = [group_value[group].get(date, None) for date in dates]
-                revenue = [group_revenue[group].get(date, 0) for date in dates]
-                order = [group_order[group].get(date, 0) for date in dates]
-                series.append({
-                    "variation": group,
-                    "data": data,
-                    "revenue": revenue,
-                    "order": order
-                })
-            all_results[metric] = {
-                "dates": dates,
-                "series": series
-            }
-            # 单独缓存每个 metric
-            set_abtest_cache(
-                local_engine, "trend", experiment_name, metric, true_category, start_date, end_date, all_results[metric]
-            )
-
-        return jsonify(all_results)
+            # 每个 metric 单独一条缓存，最后一起写
+            new_entries.append((
+                cache_key("trend", experiment_name, metric, true_category, start_date, end_date), all_results[metric]
+            ))
+
+        written = set_abtest_cache_many(local_engine, new_entries)
+        all_results.update({key[2]: entry for key, entry in written.items()})
+        # 命中的指标直接拼缓存里的响应体；全部是新鲜缓存条目时带 ETag，前端没变化的重复请求返回 304
+        return cached_response(combine_etags(all_results), lambda: object_body(all_results))
+    except AdmissionRejected:
+        # 交给 main.py 的 errorhandler 返回 503
+        raise
     except Exception as e:
         import traceback
         print("接口整体报错:", e)
@@ -136,51 +185,40 @@ def all_bayesian():
         if not metric_names:
             return jsonify({"error": f"未知的类别: {category}"}), 400
 
-        for metric in metric_names:
-            cfg = INDICATOR_CONFIG.get(metric)
-            if not cfg:
-                continue
+        # 查 metric 级别缓存（query_type="bayesian"，category=真实分类），所有指标一次查完；过期的先返回再后台刷新
+        stale_metrics = set()
+        cached, missing = lookup_metric_caches(
+            local_engine, "bayesian", experiment_name, metric_names, start_date, end_date, stale_metrics, entries=True
+        )
+        all_results.update(cached)
+        serve_stale(all_results, stale_metrics, "bayesian", experiment_name, start_date, end_date)
+        new_entries = []
+
+        # 没命中缓存的指标里，共用底表的合并成一条 SQL 查
+        planned = fetch_planned(missing, experiment_name, start_date, end_date, engine)
+
+        for metric in missing:
+            cfg = INDICATOR_CONFIG[metric]
             true_category = cfg.get("category", "") or ""
-            # 查 metric 级别缓存（query_type="bayesian"，category=真实分类）
-            cache = get_abtest_cache(
-                local_engine, "bayesian", experiment_name, metric, true_category, start_date, end_date
-            )
-            if cache:
-                all_results[metric] = cache
+            try:
+                all_results[metric] = compute_metric(
+                    metric, experiment_name, start_date, end_date, engine, planned.get(metric)
+                )
+            except AdmissionRejected as e:
+                print(f"[ADMISSION] [bayesian] [{metric}] {e}")
+                all_results[metric] = rejected_result("bayesian", e)
                 continue
-
-            rows = cfg["fetch_func"](experiment_name, start_date, end_date, engine)
-            group_dict = defaultdict(list)
-            group_revenue = defaultdict(float)
-            group_order = defaultdict(int)
-            for row in rows:
-                variation_id = getval(row, cfg.get("variation_field", 0))
-                value = getval(row, cfg.get("value_field"))
-                revenue = getval(row, cfg.get("revenue_field"))
-                order = getval(row, cfg.get("order_field"))
-                if value is not None and variation_id is not None:
-                    group_dict[variation_id].append(float(value))
-                    group_revenue[variation_id] += float(revenue or 0)
-                    group_order[variation_id] += int(order or 0)
-            metric_groups_summary = []
-            for group, value_list in group_dict.items():
-                if not value_list:
-                    continue
-                summary = bayesian_summary(value_list)
-                summary["group"] = group
-                summary["total_revenue"] = group_revenue[group]
-                summary["total_order"] = group_order[group]
-                metric_groups_summary.append(summary)
-            all_results[metric] = {
-                "groups": metric_groups_summary,
-                "distribution": {str(k): v for k, v in group_dict.items()}
-            }
-            # 单独缓存每个 metric
-            set_abtest_cache(
-                local_engine, "bayesian", experiment_name, metric, true_category, start_date, end_date, all_results[metric]
-            )
-
-        return jsonify(all_results)
+            new_entries.append((
+                cache_key("bayesian", experiment_name, metric, true_category, start_date, end_date), all_results[metric]
+            ))
+
+        written = set_abtest_cache_many(local_engine, new_entries)
+        all_results.update({key[2]: entry for key, entry in written.items()})
+        # 命中的指标直接拼缓存里的响应体；全部是新鲜缓存条目时带 ETag，前端没变化的重复请求返回 304
+        return cached_response(combine_etags(all_results), lambda: object_body(all_results))
+    except AdmissionRejected:
+        # 交给 main.py 的 errorhandler 返回 503
+        raise
     except Exception as e:
         import traceback
         print("all_bayesian 报错:", e)
@@ -1,25 +1,86 @@
 from flask import Blueprint, request, jsonify
-from collections import defaultdict
 from ..service.config import INDICATOR_CONFIG
 import traceback
 
-from ..service.service import bayesian_summary
-from ..utils.cache_utils import set_abtest_cache, get_abtest_cache
+from ..service.all import compute_metric, rejected_result, serve_stale
+from ..utils.admission import AdmissionRejected
+from ..utils.cache_utils import cache_key, lookup_metric_caches, set_abtest_cache_many
 from ..utils.engine_utils import get_db_connection, get_local_cache_engine
+from ..utils.fanout import run_concurrently
+from ..utils.single_flight import single_flight
+from ..utils.response_body import cached_response, combine_etags, object_body
+from ..sql_jobs.query_planner import fetch_planned, plan
 
 bp = Blueprint("all_in_one", __name__)
 
-def getval(row, field):
-    if isinstance(field, int):
-        try:
-            return row[field]
-        except Exception:
-            return None
-    elif isinstance(field, str):
-        if isinstance(row, dict):
-            return row.get(field)
-        return None
-    return None
+
+def error_result(e):
+    return {
+        "groups": [],
+        "distribution": {},
+        "error": str(e),
+        "traceback": "".join(traceback.format_exception(type(e), e, e.__traceback__))
+    }
+
+
+def fill_missing(missing, experiment_name, start_date, end_date, engine, local_engine):
+    """未命中缓存的指标并发取数并批量写缓存，返回 {metric: 结果、rejected_result 或 error_result}。"""
+    # ---- 合并查询的组算一个调用，其余指标各一个调用 ----
+    planned_metrics = {m for _, hit in plan(missing) for m in hit}
+    args = (experiment_name, start_date, end_date, engine)
+    calls = [(m, compute_metric, (m,) + args) for m in missing if m not in planned_metrics]
+    if planned_metrics:
+        calls.append((
+            "__planned__", fetch_planned, (sorted(planned_metrics), experiment_name, start_date, end_date, engine)
+        ))
+    outcomes = run_concurrently(calls)
+
+    planned = outcomes.pop("__planned__", {})
+    if isinstance(planned, Exception):
+        print(f"[PLANNER] 合并查询失败，退回逐个指标查询: {planned}")
+        planned = {}
+    # 合并查询拿到的行只剩分组汇总；某组失败时该组指标退回逐个取数
+    if planned_metrics:
+        outcomes.update(run_concurrently([
+            (m, compute_metric, (m,) + args + (planned.get(m),)) for m in missing if m in planned_metrics
+        ]))
+
+    # 单个指标报错不影响其它指标；报错的不写缓存
+    results = {}
+    new_entries = []
+    for metric_name, cfg in INDICATOR_CONFIG.items():
+        if metric_name not in outcomes:
+            continue
+        outcome = outcomes[metric_name]
+        if isinstance(outcome, AdmissionRejected):
+            # 和 all_bayesian / all_trend 一样：被拒的指标标成可重试，不写缓存
+            print(f"[ADMISSION] [bayesian] [{metric_name}] {outcome}")
+            results[metric_name] = rejected_result("bayesian", outcome)
+            continue
+        if isinstance(outcome, Exception):
+            results[metric_name] = error_result(outcome)
+            continue
+        results[metric_name] = outcome
+        category = cfg.get("category", "") or ""
+        new_entries.append((cache_key("bayesian", experiment_name, metric_name, category, start_date, end_date), outcome))
+
+    # ---- 写入缓存（和单指标接口完全一致），一个事务写完 ----
+    try:
+        written = set_abtest_cache_many(local_engine, new_entries)
+        # 写好的条目带 ETag 和响应体，直接替换结构化结果
+        results.update({key[2]: entry for key, entry in written.items()})
+    except Exception as e:
+        print(f"abtest cache persist error: {e}")
+    return results
+
+
+def recheck_missing(missing, experiment_name, start_date, end_date, local_engine):
+    """拿到跨副本锁后再查一次：别的副本已经把这些指标全部算完时直接用缓存。"""
+    cached, still_missing = lookup_metric_caches(
+        local_engine, "bayesian", experiment_name, missing, start_date, end_date
+    )
+    return cached if not still_missing else None
+
 
 @bp.route('/api/all_category_all_metrics', methods=['GET'])
 def all_category_all_metrics():
@@ -33,71 +94,24 @@ def all_category_all_metrics():
     engine = get_db_connection()
     all_results = {}
 
-    for metric_name, cfg in INDICATOR_CONFIG.items():
-        # ---- 取 config 里的真实分类 ----
-        category = cfg.get("category", "") or ""
-        # ---- 优先查和单指标一致的缓存（query_type="bayesian"，category=真实分类） ----
-        cache = get_abtest_cache(
-            local_engine, "bayesian", experiment_name, metric_name, category, start_date, end_date
-        )
-        if cache:
-            all_results[metric_name] = cache
-            continue
+    # ---- 优先查和单指标一致的缓存（query_type="bayesian"，category=真实分类），所有指标一次查完 ----
+    # ---- 过期的缓存照样先返回（带 stale 标记），后台逐个刷新 ----
+    stale_metrics = set()
+    cached, missing = lookup_metric_caches(
+        local_engine, "bayesian", experiment_name, list(INDICATOR_CONFIG), start_date, end_date, stale_metrics,
+        entries=True
+    )
+    all_results.update(cached)
+    serve_stale(all_results, stale_metrics, "bayesian", experiment_name, start_date, end_date)
+
+    # ---- 没命中缓存的指标：同一实验 / 区间的并发请求（含其它副本）只算一次 ----
+    if missing:
+        all_results.update(single_flight(
+            ("all_category_all_metrics", experiment_name, start_date, end_date, tuple(missing)),
+            lambda: fill_missing(missing, experiment_name, start_date, end_date, engine, local_engine),
+            engine=local_engine,
+            recheck=lambda: recheck_missing(missing, experiment_name, start_date, end_date, local_engine),
+        ))
 
-        fetch_func = cfg["fetch_func"]
-        try:
-            rows = fetch_func(experiment_name, start_date, end_date, engine)
-            group_dict = defaultdict(list)
-            group_revenue = defaultdict(float)
-            group_order = defaultdict(int)
-
-            for row in rows:
-                v_idx = getval(row, cfg["variation_field"])
-                value = getval(row, cfg["value_field"])
-                revenue = getval(row, cfg["revenue_field"])
-                order = getval(row, cfg["order_field"])
-                if v_idx is None or value is None:
-                    continue
-                group_dict[v_idx].append(float(value))
-                group_revenue[v_idx] += float(revenue) if revenue is not None else 0
-                group_order[v_idx] += int(order) if order is not None else 0
-
-            metric_result = {
-                "groups": [],
-                "distribution": {str(k): v for k, v in group_dict.items()} if group_dict else {}
-            }
-            for group, value_list in group_dict.items():
-                if not value_list:
-                    continue
-                summary = bayesian_summary(value_list)
-                summary["group"] = group
-                summary["total_revenue"] = group_revenue[group]
-                summary["total_order"] = group_order[group]
-                metric_result["groups"].append(summary)
-
-            all_results[metric_name] = metric_result
-
-            # ---- 写入缓存（和单指标接口完全一致） ----
-            try:
-                set_abtest_cache(
-                    engine_local=local_engine,
-                    query_type="bayesian",
-                    experiment_name=experiment_name,
-                    metric=metric_name,
-                    category=category,
-                    start_date=start_date,
-                    end_date=end_date,
-                    result_json=metric_result,
-                )
-            except Exception as e:
-                print(f"abtest cache persist error for {metric_name}: {e}")
-
-        except Exception as e:
-            all_results[metric_name] = {
-                "groups": [],
-                "distribution": {},
-                "error": str(e),
-                "traceback": traceback.format_exc()
-            }
-
-    return jsonify(all_results)
+    # 命中的指标直接拼缓存里的响应体；全部是新鲜缓存条目时带 ETag，If-None-Match 对上返回 304
+    return cached_response(combine_etags(all_results), lambda: object_body(all_results))
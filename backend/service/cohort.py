@@ -2,40 +2,17 @@
 
 from flask import Blueprint, request, jsonify
 from ..service.config import INDICATOR_CONFIG
-from ..utils.cache_utils import get_abtest_cache, set_abtest_cache
+from ..utils.cache_utils import get_abtest_cache_entry, set_abtest_cache
+from ..utils.response_body import cached_response
 from ..utils.engine_utils import get_local_cache_engine, get_db_connection
 import pandas as pd
 from collections import defaultdict
 
 bp_cohort = Blueprint('cohort', __name__, url_prefix='/api/cohort')
 
-# ============= 通用趋势（累计指标）接口 =============
-def generic_cohort_trend_api(
-    fetch_func, value_field, revenue_field, order_field,
-    variation_field=None, date_field=None, metric_name=""
-):
-    experiment_name = request.args.get('experiment_name')
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    category = request.args.get('category', '')
-    mode = 'trend'
-
-    if not experiment_name or not start_date or not end_date:
-        return jsonify({"error": "缺少参数"}), 400
-
-    cache_engine = get_local_cache_engine()
-    cache = get_abtest_cache(
-        cache_engine, query_type=mode,
-        experiment_name=experiment_name,
-        metric=metric_name,
-        category=category or '',
-        start_date=start_date,
-        end_date=end_date
-    )
-    if cache:
-        return jsonify(cache)
-
-    engine = get_db_connection()
+# ============= 通用趋势（累计指标）计算 =============
+def compute_cohort_trend(fetch_func, value_field, revenue_field, order_field, variation_field, date_field,
+                         experiment_name, start_date, end_date, engine):
     rows = fetch_func(experiment_name, start_date, end_date, engine)
     date_set = set()
     group_value = defaultdict(dict)
@@ -64,20 +41,86 @@ def generic_cohort_trend_api(
             "revenue": revenue,
             "order": order
         })
-    result = {"dates": dates, "series": series}
-    set_abtest_cache(
+    return {"dates": dates, "series": series}
+
+# ============= 通用热力图（单日 cohort 指标）计算（宽表模式） =============
+def compute_cohort_heatmap(fetch_func, value_field, experiment_name, start_date, end_date, engine):
+    """没有数据时返回 []（不写缓存）；fetch_func 缺列时抛 ValueError。"""
+    rows = fetch_func(experiment_name, start_date, end_date, engine)
+    if not rows:
+        return []
+
+    df = pd.DataFrame(rows)
+
+    # 增加健壮性检查，防止因数据源问题导致崩溃
+    required_cols = ['variation_id', 'cohort_day', value_field]
+    if not all(col in df.columns for col in required_cols):
+        missing = [col for col in required_cols if col not in df.columns]
+        raise ValueError(f"Data from fetch_func is missing required columns for heatmap: {missing}")
+
+    # 1. 执行通用的 pivot 操作
+    pivoted_table = df.pivot_table(index='variation_id', columns='cohort_day', values=value_field)
+
+    # 2. TypeError 修复: 将所有数字列名强制转换为字符串
+    pivoted_table.columns = [str(col) for col in pivoted_table.columns]
+
+    result_df = pivoted_table.reset_index()
+
+    return result_df.fillna(0).to_dict(orient='records')
+
+def compute_cohort(mode, metric_name, experiment_name, start_date, end_date, engine):
+    """按 INDICATOR_CONFIG 计算 cohort 接口的结果（mode 为 "trend" 或 "heatmap"），缓存预热也用这里。"""
+    cfg = INDICATOR_CONFIG[metric_name]
+    if mode == 'heatmap':
+        return compute_cohort_heatmap(cfg["fetch_func"], cfg["value_field"], experiment_name, start_date, end_date, engine)
+    return compute_cohort_trend(
+        cfg["fetch_func"], cfg["value_field"], cfg["revenue_field"], cfg["order_field"],
+        cfg.get("variation_field"), cfg.get("date_field"), experiment_name, start_date, end_date, engine
+    )
+
+# ============= 通用趋势（累计指标）接口 =============
+def generic_cohort_trend_api(
+    fetch_func, value_field, revenue_field, order_field,
+    variation_field=None, date_field=None, metric_name=""
+):
+    experiment_name = request.args.get('experiment_name')
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    category = request.args.get('category', '')
+    mode = 'trend'
+
+    if not experiment_name or not start_date or not end_date:
+        return jsonify({"error": "缺少参数"}), 400
+
+    cache_engine = get_local_cache_engine()
+    entry, _ = get_abtest_cache_entry(
         cache_engine, query_type=mode,
         experiment_name=experiment_name,
         metric=metric_name,
         category=category or '',
         start_date=start_date,
         end_date=end_date,
-        result_json=result
+        allow_stale=False
     )
-    return jsonify(result)
+    if entry:
+        return cached_response(entry.etag, entry.body)
 
-# ============= 通用热力图（单日 cohort 指标）接口（宽表模式） =============
-# backend/service/cohort.py
+    engine = get_db_connection()
+    result = compute_cohort_trend(
+        fetch_func, value_field, revenue_field, order_field, variation_field, date_field,
+        experiment_name, start_date, end_date, engine
+    )
+    entry = set_abtest_cache(
+        cache_engine, query_type=mode,
+        experiment_name=experiment_name,
+        metric=metric_name,
+        category=category or '',
+        start_date=start_date,
+        end_date=end_date,
+        result_json=result
+    )
+    # 和命中时一样带 ETag，前端下次带 If-None-Match 回来可以直接 304
+    return cached_response(entry.etag, entry.body)
 
 # ============= 【最终修正版】通用热力图接口 =============
 def generic_cohort_heatmap_api(fetch_func, value_field, revenue_field, order_field,
@@ -92,47 +135,32 @@ def generic_cohort_heatmap_api(fetch_func, value_field, revenue_field, order_fie
 
     # 步骤1: 优先从缓存中读取预计算好的热力图结果
     cache_engine = get_local_cache_engine()
-    cache = get_abtest_cache(
+    entry, _ = get_abtest_cache_entry(
         cache_engine, query_type=mode,
         experiment_name=experiment_name, metric=metric_name, category=category or '',
-        start_date=start_date, end_date=end_date
+        start_date=start_date, end_date=end_date, allow_stale=False
     )
-    if cache:
+    if entry:
         print(f"HIT CACHE for heatmap: {metric_name}")
-        return jsonify(cache)
+        return cached_response(entry.etag, entry.body)
 
     # 步骤2: 如果缓存未命中，则执行实时计算
     print(f"MISS CACHE for heatmap: {metric_name}, calculating live.")
     engine = get_db_connection()
-    rows = fetch_func(experiment_name, start_date, end_date, engine)
-    if not rows:
+    try:
+        result = compute_cohort_heatmap(fetch_func, value_field, experiment_name, start_date, end_date, engine)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 500
+    if not result:
         return jsonify([])
 
-    df = pd.DataFrame(rows)
-
-    # 增加健壮性检查，防止因数据源问题导致崩溃
-    required_cols = ['variation_id', 'cohort_day', value_field]
-    if not all(col in df.columns for col in required_cols):
-        missing = [col for col in required_cols if col not in df.columns]
-        return jsonify({"error": f"Data from fetch_func is missing required columns for heatmap: {missing}"}), 500
-
-    # 1. 执行通用的 pivot 操作
-    pivoted_table = df.pivot_table(index='variation_id', columns='cohort_day', values=value_field)
-
-    # 2. TypeError 修复: 将所有数字列名强制转换为字符串
-    pivoted_table.columns = [str(col) for col in pivoted_table.columns]
-
-    result_df = pivoted_table.reset_index()
-
-    result = result_df.fillna(0).to_dict(orient='records')
-
     # 将实时计算的结果存入缓存，供下次使用
-    set_abtest_cache(
+    entry = set_abtest_cache(
         cache_engine, query_type=mode,
         experiment_name=experiment_name, metric=metric_name, category=category or '',
         start_date=start_date, end_date=end_date, result_json=result
     )
-    return jsonify(result)
+    return cached_response(entry.etag, entry.body)
 # ============= 路由注册函数 =============
 def make_cohort_trend_api(cfg, metric_name):
     def api_func():
@@ -148,6 +176,16 @@ def make_cohort_heatmap_api(cfg, metric_name, extra_field=None):
             cfg.get("variation_field"), cfg.get("date_field"), extra_field=cfg.get("extra_field"), metric_name=metric_name)
     return api_func
 
+# 前端 cohort 页面请求的指标（query_type, metric），缓存预热按这个列表算
+COHORT_METRICS = [
+    ("trend", "cumulative_retention"),
+    ("trend", "cumulative_ltv"),
+    ("trend", "cumulative_lt"),
+    ("heatmap", "cohort_arpu"),
+    ("heatmap", "cohort_retention_heatmap"),
+    ("heatmap", "cohort_time_spent_heatmap"),
+]
+
 def register_cohort_routes(bp, config):
     # --- 累计型趋势图 ---
     bp.add_url_rule(
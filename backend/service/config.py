@@ -23,8 +23,7 @@ from ..sql_jobs.Engagement.Regen import fetch_group_regen_samples
 from ..sql_jobs.Business.cancel_sub import fetch_group_cancel_sub_samples
 from ..sql_jobs.Business.subscribe_new import fetch_group_subscribe_new_samples
 from ..sql_jobs.Business.AOV_new import fetch_group_AOV_new_samples
-from ..sql_jobs.Retention.active_retention import fetch_active_user_retention
-from ..sql_jobs.Retention.new_retention import fetch_new_user_retention
+from ..sql_jobs.Retention.fused_retention import fetch_active_user_retention_fused, fetch_new_user_retention_fused
 from ..sql_jobs.Retention.cul_retention import fetch_group_cumulative_retained_users_daily
 from ..sql_jobs.Business.cul_ltv import fetch_group_cumulative_ltv_daily
 from ..sql_jobs.chat_behavior.cul_lt import fetch_group_cumulative_lt_daily
@@ -38,7 +37,8 @@ INDICATOR_CONFIG = {
         "value_field": 4,
         "revenue_field": 2,
         "order_field": 3,
-        "category": "business"
+        "category": "business",
+        "incremental": False,  # 分组用户按区间起止过滤，结果依赖整个区间
     },
     "arpu": {
         "fetch_func": fetch_group_arpu_samples,
@@ -74,7 +74,8 @@ INDICATOR_CONFIG = {
         "value_field": 4,
         "revenue_field": 3,
         "order_field": 2,
-        "category": "business"
+        "category": "business",
+        "incremental": False,  # 以 start_date 为基准，结果依赖区间起点
     },
     "aov_new_day": {
         "fetch_func": fetch_group_AOV_new_samples,
@@ -83,7 +84,8 @@ INDICATOR_CONFIG = {
         "value_field": "aov_day1",
         "revenue_field": "revenue_day1",
         "order_field": "order_cnt_day1",
-        "category": "business"
+        "category": "business",
+        "settle_days": 3,  # 统计当日之后 3 天内的行为
     },
     "cancel_sub_day": {
         "fetch_func": fetch_group_cancel_sub_samples,
@@ -92,7 +94,8 @@ INDICATOR_CONFIG = {
         "value_field": "unsub_rate_day3",
         "revenue_field": "unsub_in3d",
         "order_field": "total_subs",
-        "category": "business"
+        "category": "business",
+        "settle_days": 3,
     },
     "subscribe_new_day_aov": {
         "fetch_func": fetch_group_subscribe_new_samples,
@@ -101,7 +104,8 @@ INDICATOR_CONFIG = {
         "value_field": "aov_subscribe_day1",
         "revenue_field": "subscribe_revenue_day1",
         "order_field": "subscribe_order_cnt_day1",
-        "category": "business"
+        "category": "business",
+        "settle_days": 3,
     },
 
     # 2. chat_behavior相关指标 8个
@@ -233,78 +237,87 @@ INDICATOR_CONFIG = {
         "order_field": "unique_regen_users",
         "category": "engagement"
     },
-    # 4. 留存指标 8个（
+    # 4. 留存指标 8个（共用一次查询：fused_retention 把 D1/D3/D7/D15 一起算出来，各指标读自己的字段）
     "all_retention_d1": {
-        "fetch_func": lambda experiment_name, start_date, end_date, engine: fetch_active_user_retention(experiment_name, start_date, end_date, engine, day=1),
+        "fetch_func": fetch_active_user_retention_fused,
         "variation_field": "variation",         # 根据你的SQL返回的字段名设置
         "date_field": "active_date",
         "value_field": "d1_retention_rate",     # 字段名要和fetch返回dict一致
         "revenue_field": "d1_retained_users",   # 这里用实际人数字段名
         "order_field": "active_users",
-        "category": "retention"
+        "category": "retention",
+        # D15 留存要过 15 天才稳定；8 个指标共用一次查询，统一按最长的 15 天重取，增量区间一致才能命中同一结果
+        "settle_days": 15,
     },
     "all_retention_d3": {
-        "fetch_func": lambda experiment_name, start_date, end_date, engine: fetch_active_user_retention(experiment_name, start_date, end_date, engine, day=3),
+        "fetch_func": fetch_active_user_retention_fused,
         "variation_field": "variation",
         "date_field": "active_date",
         "value_field": "d3_retention_rate",
         "revenue_field": "d3_retained_users",
         "order_field": "active_users",
-        "category": "retention"
+        "category": "retention",
+        "settle_days": 15,
     },
     "all_retention_d7": {
-        "fetch_func": lambda experiment_name, start_date, end_date, engine: fetch_active_user_retention(experiment_name, start_date, end_date, engine, day=7),
+        "fetch_func": fetch_active_user_retention_fused,
         "variation_field": "variation",
         "date_field": "active_date",
         "value_field": "d7_retention_rate",
         "revenue_field": "d7_retained_users",
         "order_field": "active_users",
-        "category": "retention"
+        "category": "retention",
+        "settle_days": 15,
     },
     "all_retention_d15": {
-        "fetch_func": lambda experiment_name, start_date, end_date, engine: fetch_active_user_retention(experiment_name, start_date, end_date, engine, day=15),
+        "fetch_func": fetch_active_user_retention_fused,
         "variation_field": "variation",
         "date_field": "active_date",
         "value_field": "d15_retention_rate",
         "revenue_field": "d15_retained_users",
         "order_field": "active_users",
-        "category": "retention"
+        "category": "retention",
+        "settle_days": 15,
     },
     "new_retention_d1": {
-        "fetch_func": lambda experiment_name, start_date, end_date, engine: fetch_new_user_retention(experiment_name, start_date, end_date, engine, day=1),
+        "fetch_func": fetch_new_user_retention_fused,
         "variation_field": "variation",
         "date_field": "first_visit_date",
         "value_field": "d1_retention_rate",
         "revenue_field": "d1_retained_users",
         "order_field": "new_users",
-        "category": "retention"
+        "category": "retention",
+        "settle_days": 15,
     },
     "new_retention_d3": {
-        "fetch_func": lambda experiment_name, start_date, end_date, engine: fetch_new_user_retention(experiment_name, start_date, end_date, engine, day=3),
+        "fetch_func": fetch_new_user_retention_fused,
         "variation_field": "variation",
         "date_field": "first_visit_date",
         "value_field": "d3_retention_rate",
         "revenue_field": "d3_retained_users",
         "order_field": "new_users",
-        "category": "retention"
+        "category": "retention",
+        "settle_days": 15,
     },
     "new_retention_d7": {
-        "fetch_func": lambda experiment_name, start_date, end_date, engine: fetch_new_user_retention(experiment_name, start_date, end_date, engine, day=7),
+        "fetch_func": fetch_new_user_retention_fused,
         "variation_field": "variation",
         "date_field": "first_visit_date",
         "value_field": "d7_retention_rate",
         "revenue_field": "d7_retained_users",
         "order_field": "new_users",
-        "category": "retention"
+        "category": "retention",
+        "settle_days": 15,
     },
     "new_retention_d15": {
-        "fetch_func": lambda experiment_name, start_date, end_date, engine: fetch_new_user_retention(experiment_name, start_date, end_date, engine, day=15),
+        "fetch_func": fetch_new_user_retention_fused,
         "variation_field": "variation",
         "date_field": "first_visit_date",
         "value_field": "d15_retention_rate",
         "revenue_field": "d15_retained_users",
         "order_field": "new_users",
-        "category": "retention"
+        "category": "retention",
+        "settle_days": 15,
     },
     # --- Cumulative 累计指标 ---
     "cumulative_retention": {
@@ -314,7 +327,8 @@ INDICATOR_CONFIG = {
         "value_field": "cumulative_retention_rate",  # 返回的留存率
         "revenue_field": "cumulative_retained_users",  # 分子
         "order_field": "cumulative_registered_users",  # 分母
-        "category": "retention"
+        "category": "retention",
+        "incremental": False,  # 累计指标，依赖区间起点
     },
     "cumulative_ltv": {
         "fetch_func": fetch_group_cumulative_ltv_daily,
@@ -323,7 +337,8 @@ INDICATOR_CONFIG = {
         "value_field": "cumulative_ltv",  # 累计LTV
         "revenue_field": "cumulative_revenue",  # 总收入
         "order_field": "cumulative_users",  # 总活跃人数
-        "category": "business"
+        "category": "business",
+        "incremental": False,
     },
     "cumulative_lt": {
         "fetch_func": fetch_group_cumulative_lt_daily,
@@ -332,7 +347,8 @@ INDICATOR_CONFIG = {
         "value_field": "cumulative_lt",  # 累计LT
         "revenue_field": "cumulative_time_minutes",  # 总分钟数
         "order_field": "cumulative_users",  # 总活跃人数
-        "category": "engagement"
+        "category": "engagement",
+        "incremental": False,
     },
     # "cohort_arpu": {
     #     "fetch_func": fetch_cohort_arpu_heatmap,
@@ -3,26 +3,21 @@ from flask import Flask, request, jsonify
 from sqlalchemy import create_engine, text
 import os
 import urllib.parse
-import math
 
-from ..utils.cache_utils import get_abtest_cache, set_abtest_cache
+from ..utils.cache_utils import (
+    cache_key, get_abtest_cache_entry, set_abtest_cache, mark_stale, refresh_in_background
+)
+from ..utils.response_body import cached_response, replace_nan_inf
+from ..utils.single_flight import single_flight
 from ..utils.engine_utils import get_local_cache_engine, get_db_connection
+from ..utils.columnar import rows_to_columns, group_by_variation, pivot_by_date, to_list
+from ..utils.fetch_utils import iter_fetch
+from ..utils.snapshot_utils import fetch_with_snapshot
+from ..utils.preflight import estimate_cost, preview_range
+from ..utils.jobs import submit_job
 
 app = Flask(__name__)
 
-def replace_nan_inf(obj):
-    """递归替换所有 NaN, inf, -inf 为 None。"""
-    if isinstance(obj, float):
-        if math.isnan(obj) or math.isinf(obj):
-            return None
-        return obj
-    elif isinstance(obj, list):
-        return [replace_nan_inf(x) for x in obj]
-    elif isinstance(obj, dict):
-        return {k: replace_nan_inf(v) for k, v in obj.items()}
-    else:
-        return obj
-
 def bayesian_summary(samples):
     samples = np.array(samples)
     if len(samples) == 0 or np.isnan(samples).all():
@@ -53,6 +48,137 @@ def bayesian_summary(samples):
         ]
     }
 
+def _field_cfg(value_field, revenue_field, order_field, variation_field=None, date_field=None):
+    """把接口参数拼成 rows_to_columns 需要的字段配置，未指定的 variation/date 用默认下标 0/1。"""
+    cfg = {"value_field": value_field, "revenue_field": revenue_field, "order_field": order_field}
+    if variation_field is not None:
+        cfg["variation_field"] = variation_field
+    if date_field is not None:
+        cfg["date_field"] = date_field
+    return cfg
+
+def compute_bayesian(fetch_func, field_cfg, experiment_name, start_date, end_date, metric='', category=''):
+    """实时取数并按组做贝叶斯汇总，结果写入缓存，返回写好的 CachedResult。"""
+    mode = 'bayesian'
+    engine = get_db_connection()
+    # 流式 fetcher 返回生成器，边取边转成列，分组在 NumPy 里做
+    rows = iter_fetch(fetch_func, experiment_name, start_date, end_date, engine)
+    columns = rows_to_columns(rows, field_cfg)
+    print(f"实验 {experiment_name} 查询到 {len(columns['value_field'])} 条记录")
+    result = {
+        "groups": [],
+        "distribution": {}
+    }
+    for group, values, revenue_sum, order_sum in group_by_variation(columns):
+        result["distribution"][str(group)] = values.tolist()
+        summary = bayesian_summary(values)
+        summary["group"] = group
+        summary["total_revenue"] = revenue_sum
+        summary["total_order"] = order_sum
+        result["groups"].append(summary)
+    entry = set_abtest_cache(
+        get_local_cache_engine(), query_type=mode,
+        experiment_name=experiment_name,
+        metric=metric or '',
+        category=category or '',
+        start_date=start_date,
+        end_date=end_date,
+        result_json=result
+    )
+    print(f"[CACHE-SET] [{mode}] [{metric}] 实时计算完成，已写入缓存")
+    return entry
+
+def compute_trend(fetch_func, field_cfg, experiment_name, start_date, end_date, metric='', category=''):
+    """实时取数并按 variation × date 透视，结果写入缓存，返回写好的 CachedResult。"""
+    from backend.service.config import INDICATOR_CONFIG
+    mode = 'trend'
+    engine = get_db_connection()
+    cfg = INDICATOR_CONFIG.get(metric)
+    if cfg is not None and cfg["fetch_func"] is fetch_func:
+        # 快照里已有的日期直接复用，只查缺失 / 仍在变化的日期
+        rows = fetch_with_snapshot(cfg, metric, experiment_name, start_date, end_date, engine)
+    else:
+        rows = iter_fetch(fetch_func, experiment_name, start_date, end_date, engine)
+    columns = rows_to_columns(rows, field_cfg)
+    pivot = pivot_by_date(columns)
+    dates = pivot["dates"]
+    series = []
+    for i, group in enumerate(pivot["variations"]):
+        series.append({
+            "variation": group,
+            "data": to_list(pivot["value"][i]),
+            "revenue": to_list(pivot["revenue"][i]),
+            "order": to_list(pivot["order"][i], as_int=True)
+        })
+    result = {"dates": dates, "series": series}
+    entry = set_abtest_cache(
+        get_local_cache_engine(), query_type=mode,
+        experiment_name=experiment_name,
+        metric=metric or '',
+        category=category or '',   # 关键点
+        start_date=start_date,
+        end_date=end_date,
+        result_json=result
+    )
+    return entry
+
+def preflight_or_compute(compute, fetch_func, field_cfg, experiment_name, start_date, end_date, metric, category, mode):
+    """
+    先做成本预估：便宜的直接算全量返回 (CachedResult, 200)；
+    贵的把全量计算交给后台任务，返回最近几天的预览（有缓存时直接用），即 (预览 + preview 信息, 202)。
+    """
+    cost = estimate_cost(fetch_func, experiment_name, start_date, end_date, get_db_connection(), metric)
+    if not cost["expensive"]:
+        return compute(fetch_func, field_cfg, experiment_name, start_date, end_date, metric, category), 200
+
+    print(f"[PREFLIGHT] [{mode}] [{metric}] {cost['reason']}，转后台计算并返回预览")
+    job = submit_job(
+        (mode, experiment_name, metric, category, start_date, end_date),
+        compute, fetch_func, field_cfg, experiment_name, start_date, end_date, metric, category
+    )
+    preview_start, preview_end = preview_range(start_date, end_date)
+    # 预览就是预览区间本身的结果，compute 会按预览区间的 key 写缓存；
+    # 全量算完之前的重复请求直接读这份缓存，不再每次都重算预览
+    preview, _ = get_abtest_cache_entry(
+        get_local_cache_engine(), mode, experiment_name, metric or '', category or '', preview_start, preview_end,
+        allow_stale=False
+    )
+    if preview is None:
+        preview = compute(fetch_func, field_cfg, experiment_name, preview_start, preview_end, metric, category)
+    # 缓存里的对象是共享的，复制一份再加 preview 字段
+    result = dict(preview.result)
+    result["preview"] = {
+        "start_date": preview_start,
+        "end_date": preview_end,
+        "reason": cost["reason"],
+        "cost": cost,
+        "job_id": job["job_id"],
+        "job_status": job["status"],
+    }
+    return result, 202
+
+def coalesced_compute(compute, fetch_func, field_cfg, experiment_name, start_date, end_date, metric, category, mode):
+    """
+    preflight_or_compute 外面套一层 single-flight：同一缓存 key 的并发未命中（包括其它副本）只算一次，
+    拿到跨副本锁后先看缓存是否已被别人写好。
+    """
+    cache_engine = get_local_cache_engine()
+
+    def recheck():
+        entry, _ = get_abtest_cache_entry(
+            cache_engine, mode, experiment_name, metric or '', category or '', start_date, end_date, allow_stale=False
+        )
+        return (entry, 200) if entry is not None else None
+
+    return single_flight(
+        cache_key(mode, experiment_name, metric, category, start_date, end_date),
+        lambda: preflight_or_compute(
+            compute, fetch_func, field_cfg, experiment_name, start_date, end_date, metric, category, mode
+        ),
+        engine=cache_engine,
+        recheck=recheck,
+    )
+
 def generic_bayesian_api(fetch_func, value_field, revenue_field, order_field, variation_field=None, date_field=None):
     experiment_name = request.args.get('experiment_name')
     start_date = request.args.get('start_date')
@@ -63,8 +189,9 @@ def generic_bayesian_api(fetch_func, value_field, revenue_field, order_field, va
     if not experiment_name or not start_date or not end_date:
         return jsonify({"error": "请提供 experiment_name, start_date, end_date 参数"}), 400
 
+    field_cfg = _field_cfg(value_field, revenue_field, order_field, variation_field, date_field)
     cache_engine = get_local_cache_engine()
-    cache = get_abtest_cache(
+    entry, stale = get_abtest_cache_entry(
         cache_engine, query_type=mode,
         experiment_name=experiment_name,
         metric=metric or '',
@@ -72,50 +199,27 @@ def generic_bayesian_api(fetch_func, value_field, revenue_field, order_field, va
         start_date=start_date,
         end_date=end_date
     )
-    if cache:
+    if entry:
+        if stale:
+            # 过期条目先返回，后台重算（同一个 key 只有一个刷新任务）
+            print(f"[CACHE-STALE] [{mode}] [{metric}] 返回过期缓存，后台刷新")
+            refresh_in_background(
+                (mode, experiment_name, metric, category, start_date, end_date),
+                compute_bayesian, fetch_func, field_cfg, experiment_name, start_date, end_date, metric, category
+            )
+            return jsonify(replace_nan_inf(mark_stale(entry.result)))
         print(f"[CACHE-HIT] [{mode}] [{metric}] 命中缓存，直接返回")
-        return jsonify(replace_nan_inf(cache))
+        # 缓存里存的就是最终响应体，不再 replace_nan_inf / jsonify；If-None-Match 对上时 304
+        return cached_response(entry.etag, entry.body)
     print(f"[CACHE-MISS] [{mode}] [{metric}] 未命中缓存，开始实时计算...")
 
-    engine = get_db_connection()
-    rows = fetch_func(experiment_name, start_date, end_date, engine)
-    print(f"实验 {experiment_name} 查询到 {len(rows)} 条记录")
-    for row in rows:
-        print(row)
-    from collections import defaultdict
-    group_dict = defaultdict(list)
-    group_revenue = defaultdict(float)
-    group_order = defaultdict(int)
-    for row in rows:
-        variation_id = row[variation_field] if variation_field is not None else row[0]
-        value = row[value_field]
-        revenue = row[revenue_field]
-        order = row[order_field]
-        if value is not None:
-            group_dict[variation_id].append(float(value))
-            group_revenue[variation_id] += float(revenue)
-            group_order[variation_id] += int(order)
-    result = {
-        "groups": [],
-        "distribution": {str(k): v for k, v in group_dict.items()}
-    }
-    for group, value_list in group_dict.items():
-        summary = bayesian_summary(value_list)
-        summary["group"] = group
-        summary["total_revenue"] = group_revenue[group]
-        summary["total_order"] = group_order[group]
-        result["groups"].append(summary)
-    set_abtest_cache(
-        cache_engine, query_type=mode,
-        experiment_name=experiment_name,
-        metric=metric or '',
-        category=category or '',
-        start_date=start_date,
-        end_date=end_date,
-        result_json=result
+    result, status = coalesced_compute(
+        compute_bayesian, fetch_func, field_cfg, experiment_name, start_date, end_date, metric, category, mode
     )
-    print(f"[CACHE-SET] [{mode}] [{metric}] 实时计算完成，已写入缓存")
-    return jsonify(replace_nan_inf(result))
+    if status == 200:
+        # 刚写进缓存的条目，和命中时一样带 ETag 返回
+        return cached_response(result.etag, result.body)
+    return jsonify(replace_nan_inf(result)), status
 
 def generic_trend_api(fetch_func, value_field, revenue_field, order_field, variation_field=None, date_field=None):
     from backend.service.config import INDICATOR_CONFIG  # 自动查 category
@@ -133,8 +237,9 @@ def generic_trend_api(fetch_func, value_field, revenue_field, order_field, varia
         category = INDICATOR_CONFIG.get(metric, {}).get("category", "")
     # ------------------------------------------
 
+    field_cfg = _field_cfg(value_field, revenue_field, order_field, variation_field, date_field)
     cache_engine = get_local_cache_engine()
-    cache = get_abtest_cache(
+    entry, stale = get_abtest_cache_entry(
         cache_engine, query_type=mode,
         experiment_name=experiment_name,
         metric=metric or '',
@@ -142,50 +247,22 @@ def generic_trend_api(fetch_func, value_field, revenue_field, order_field, varia
         start_date=start_date,
         end_date=end_date
     )
-    if cache:
-        return jsonify(replace_nan_inf(cache))
+    if entry:
+        if stale:
+            refresh_in_background(
+                (mode, experiment_name, metric, category, start_date, end_date),
+                compute_trend, fetch_func, field_cfg, experiment_name, start_date, end_date, metric, category
+            )
+            return jsonify(replace_nan_inf(mark_stale(entry.result)))
+        return cached_response(entry.etag, entry.body)
 
-    engine = get_db_connection()
-    rows = fetch_func(experiment_name, start_date, end_date, engine)
-    from collections import defaultdict
-    date_set = set()
-    group_value = defaultdict(dict)
-    group_revenue = defaultdict(dict)
-    group_order = defaultdict(dict)
-    for row in rows:
-        variation_id = row[variation_field] if variation_field is not None else row[0]
-        event_date = row[date_field] if date_field is not None else row[1]
-        revenue = row[revenue_field]
-        order = row[order_field]
-        value = row[value_field]
-        date_str = str(event_date)
-        date_set.add(date_str)
-        group_value[variation_id][date_str] = float(value) if value is not None else None
-        group_revenue[variation_id][date_str] = float(revenue)
-        group_order[variation_id][date_str] = int(order)
-    dates = sorted(list(date_set))
-    series = []
-    for group in group_value:
-        data = [group_value[group].get(date, None) for date in dates]
-        revenue = [group_revenue[group].get(date, None) for date in dates]
-        order = [group_order[group].get(date, None) for date in dates]
-        series.append({
-            "variation": group,
-            "data": data,
-            "revenue": revenue,
-            "order": order
-        })
-    result = {"dates": dates, "series": series}
-    set_abtest_cache(
-        cache_engine, query_type=mode,
-        experiment_name=experiment_name,
-        metric=metric or '',
-        category=category or '',   # 关键点
-        start_date=start_date,
-        end_date=end_date,
-        result_json=result
+    result, status = coalesced_compute(
+        compute_trend, fetch_func, field_cfg, experiment_name, start_date, end_date, metric, category, mode
     )
-    return jsonify(replace_nan_inf(result))
+    if status == 200:
+        # 刚写进缓存的条目，和命中时一样带 ETag 返回
+        return cached_response(result.etag, result.body)
+    return jsonify(replace_nan_inf(result)), status
 
 def make_bayesian_api(cfg):
     def api_func():
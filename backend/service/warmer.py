@@ -0,0 +1,207 @@
+# backend/service/warmer.py
+"""
+运行中实验的缓存预热。
+
+缓存过期 / 流水线 bump generation 之后，第一个打开实验的人要等完整的数仓计算。
+这里对 experiment_filter.get_valid_experiments() 的每个实验（最后一个 phase 的起止日期，和 summary_cache 一致），
+按前端实际请求的缓存 key 预先算好：
+
+- all_category_all_metrics：每个指标的 ("bayesian", 真实分类)，和 all_in_one.fill_missing 同一套合并查询 / 批量写入；
+- all_trend：每个有分类的指标的 ("trend", 真实分类)；
+- cohort 页面：COHORT_METRICS 里的 ("trend" / "heatmap", category="")（前端不传 category）。
+
+result_type 为 heatmap 的指标在 bayesian / trend 接口上本来就算不出结果，不预热。
+已经新鲜的 key 跳过；每个 key 都走 single_flight，和同时到来的用户请求只算一次。
+最多 CACHE_WARMER_CONCURRENCY 个 key 同时在算（数仓侧还有准入控制兜底）。
+
+触发方式：
+- POST /api/cache_warmer（ab_testing_pipeline 里 summary_cache 之后的 warm_cache 任务会调）；
+- CACHE_WARMER_INTERVAL_MINUTES > 0 时，app 里起一个后台线程定时跑（多副本部署时只在一个副本上打开）。
+进度用 GET /api/cache_warmer 查（按 worker 进程记录）。
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .config import INDICATOR_CONFIG
+from .all import compute_metric_trend, get_metric_names, get_metrics_by_category
+from .all_in_one import fill_missing
+from .cohort import COHORT_METRICS, compute_cohort
+from ..utils.cache_utils import cache_key, get_abtest_cache, lookup_metric_caches, set_abtest_cache
+from ..utils.engine_utils import get_db_connection, get_local_cache_engine
+from ..utils.jobs import submit_job
+from ..utils.single_flight import single_flight
+
+CACHE_WARMER_CONCURRENCY = int(os.environ.get("CACHE_WARMER_CONCURRENCY", "2"))
+# 0 表示不起后台线程，只靠 DAG / 接口触发
+CACHE_WARMER_INTERVAL_MINUTES = float(os.environ.get("CACHE_WARMER_INTERVAL_MINUTES", "0"))
+
+_run_lock = threading.Lock()
+_status_lock = threading.Lock()
+_status = {
+    "state": "idle",
+    "started_at": None,
+    "finished_at": None,
+    "experiments_total": 0,
+    "experiments_done": 0,
+    "current": None,
+    "warmed": 0,
+    "skipped": 0,
+    "failed": 0,
+}
+
+
+def _update(**changes):
+    with _status_lock:
+        _status.update(changes)
+
+
+def _count(name, n=1):
+    with _status_lock:
+        _status[name] += n
+
+
+def warmer_status():
+    with _status_lock:
+        return dict(_status)
+
+
+def _warm_key(query_type, metric, category, experiment_name, start_date, end_date, compute):
+    """算一个 key 并写缓存；别的请求正在算同一个 key 时等它的结果。"""
+    local_engine = get_local_cache_engine()
+
+    def run():
+        result = compute(metric, experiment_name, start_date, end_date, get_db_connection())
+        if result:
+            set_abtest_cache(local_engine, query_type, experiment_name, metric, category, start_date, end_date, result)
+        return result
+
+    return single_flight(
+        cache_key(query_type, experiment_name, metric, category, start_date, end_date),
+        run,
+        engine=local_engine,
+        recheck=lambda: get_abtest_cache(
+            local_engine, query_type, experiment_name, metric, category, start_date, end_date
+        ),
+    )
+
+
+def _trend_metrics():
+    metrics = [m for category in get_metrics_by_category() for m in get_metric_names(category)]
+    return [m for m in metrics if INDICATOR_CONFIG[m].get("result_type") != "heatmap"]
+
+
+def warm_experiment(experiment_name, start_date, end_date):
+    """预热一个实验 / 区间，返回 {"warmed", "skipped", "failed"}。"""
+    local_engine = get_local_cache_engine()
+    stats = {"warmed": 0, "skipped": 0, "failed": 0}
+
+    # ---- bayesian：和 all_category_all_metrics 一样合并查询、批量写 ----
+    bayesian_metrics = [m for m, cfg in INDICATOR_CONFIG.items() if cfg.get("result_type") != "heatmap"]
+    _, missing = lookup_metric_caches(local_engine, "bayesian", experiment_name, bayesian_metrics, start_date, end_date)
+    stats["skipped"] += len(bayesian_metrics) - len(missing)
+    if missing:
+        results = single_flight(
+            ("all_category_all_metrics", experiment_name, start_date, end_date, tuple(missing)),
+            lambda: fill_missing(missing, experiment_name, start_date, end_date, get_db_connection(), local_engine),
+            engine=local_engine,
+        )
+        failed = sum(1 for m in missing if isinstance(results.get(m), dict) and "error" in results[m])
+        stats["failed"] += failed
+        stats["warmed"] += len(missing) - failed
+
+    # ---- trend + cohort：逐个 key，有界并发 ----
+    targets = []
+    trend_metrics = _trend_metrics()
+    _, missing = lookup_metric_caches(local_engine, "trend", experiment_name, trend_metrics, start_date, end_date)
+    stats["skipped"] += len(trend_metrics) - len(missing)
+    for metric in missing:
+        category = INDICATOR_CONFIG[metric].get("category", "") or ""
+        targets.append(("trend", metric, category, compute_metric_trend))
+    for query_type, metric in COHORT_METRICS:
+        if get_abtest_cache(local_engine, query_type, experiment_name, metric, "", start_date, end_date):
+            stats["skipped"] += 1
+            continue
+        compute = (lambda m, e, s, d, engine, mode=query_type: compute_cohort(mode, m, e, s, d, engine))
+        targets.append((query_type, metric, "", compute))
+
+    with ThreadPoolExecutor(max_workers=max(1, CACHE_WARMER_CONCURRENCY), thread_name_prefix="cache-warmer") as pool:
+        futures = {
+            pool.submit(_warm_key, query_type, metric, category, experiment_name, start_date, end_date, compute):
+                (query_type, metric)
+            for query_type, metric, category, compute in targets
+        }
+        for future in as_completed(futures):
+            query_type, metric = futures[future]
+            try:
+                future.result()
+                stats["warmed"] += 1
+            except Exception as e:
+                print(f"[WARMER] {experiment_name} [{query_type}] [{metric}] 预热失败: {e}")
+                stats["failed"] += 1
+    return stats
+
+
+def warm_experiments(experiments=None):
+    """
+    预热所有运行中的实验（experiments 为 get_valid_experiments() 格式的列表，默认现查）。
+    同一进程里同时只跑一轮，已经在跑时直接返回当前进度。
+    """
+    if not _run_lock.acquire(blocking=False):
+        return warmer_status()
+    try:
+        if experiments is None:
+            from ..airflow.experiment_filter import get_valid_experiments
+            experiments = get_valid_experiments()
+        _update(state="running", started_at=time.time(), finished_at=None, experiments_total=len(experiments),
+                experiments_done=0, current=None, warmed=0, skipped=0, failed=0)
+        print(f"[WARMER] 开始预热 {len(experiments)} 个实验")
+        for exp in experiments:
+            experiment_name = exp["experiment_name"]
+            start_date = exp["phase_start_time"][:10]
+            end_date = exp["phase_end_time"][:10]
+            _update(current=experiment_name)
+            try:
+                stats = warm_experiment(experiment_name, start_date, end_date)
+            except Exception as e:
+                print(f"[WARMER] {experiment_name} 预热失败: {e}")
+                stats = {"warmed": 0, "skipped": 0, "failed": 1}
+            for name, n in stats.items():
+                _count(name, n)
+            _count("experiments_done")
+            status = warmer_status()
+            print(
+                f"[WARMER] {status['experiments_done']}/{status['experiments_total']} {experiment_name} "
+                f"({start_date} ~ {end_date}): 预热 {stats['warmed']}，已是新鲜 {stats['skipped']}，失败 {stats['failed']}"
+            )
+        _update(state="idle", finished_at=time.time(), current=None)
+        return warmer_status()
+    except Exception:
+        _update(state="failed", finished_at=time.time(), current=None)
+        raise
+    finally:
+        _run_lock.release()
+
+
+def start_warm_job():
+    """后台跑一轮预热（单独的 warmer 线程池，不占用户请求的计算任务；同一时间只有一轮），返回任务信息。"""
+    return submit_job(("cache_warmer",), warm_experiments, pool="warmer")
+
+
+def _loop():
+    while True:
+        try:
+            warm_experiments()
+        except Exception as e:
+            print(f"[WARMER] 定时预热失败: {e}")
+        time.sleep(CACHE_WARMER_INTERVAL_MINUTES * 60)
+
+
+def start_background_warmer():
+    """CACHE_WARMER_INTERVAL_MINUTES > 0 时起一个守护线程定时预热。"""
+    if CACHE_WARMER_INTERVAL_MINUTES <= 0:
+        return None
+    thread = threading.Thread(target=_loop, name="cache-warmer-loop", daemon=True)
+    thread.start()
+    return thread
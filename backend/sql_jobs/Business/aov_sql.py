@@ -1,8 +1,8 @@
 import logging
-from sqlalchemy import text
+from ..sql_templates import run_template, stream_template
 
-def fetch_group_aov_samples(experiment_name, start_date, end_date, engine):
-    query = f'''
+def fetch_group_aov_samples(experiment_name, start_date, end_date, engine, stream=False):
+    query = '''
     SELECT
       variation_id,
       event_date,
@@ -21,11 +21,11 @@ def fetch_group_aov_samples(experiment_name, start_date, end_date, engine):
           CAST(variation_id AS CHAR) AS variation_id,
           MIN(timestamp_assigned) AS timestamp_assigned
         FROM flow_wide_info.tbl_wide_experiment_assignment_hi
-        WHERE experiment_id = '{experiment_name}'
-          AND timestamp_assigned BETWEEN '{start_date} 00:00:00' AND '{end_date} 23:59:59'
+        WHERE experiment_id = :experiment_name
+          AND timestamp_assigned BETWEEN :start_ts AND :end_ts
         GROUP BY user_id, variation_id
       ) eu ON o.user_id = eu.user_id
-      WHERE o.event_date BETWEEN '{start_date}' AND '{end_date}'
+      WHERE o.event_date BETWEEN :start_date AND :end_date
         AND o.event_date >= DATE(eu.timestamp_assigned)
       UNION ALL
       SELECT
@@ -39,17 +39,26 @@ def fetch_group_aov_samples(experiment_name, start_date, end_date, engine):
           CAST(variation_id AS CHAR) AS variation_id,
           MIN(timestamp_assigned) AS timestamp_assigned
         FROM flow_wide_info.tbl_wide_experiment_assignment_hi
-        WHERE experiment_id = '{experiment_name}'
-          AND timestamp_assigned BETWEEN '{start_date} 00:00:00' AND '{end_date} 23:59:59'
+        WHERE experiment_id = :experiment_name
+          AND timestamp_assigned BETWEEN :start_ts AND :end_ts
         GROUP BY user_id, variation_id
       ) eu ON o.user_id = eu.user_id
-      WHERE o.event_date BETWEEN '{start_date}' AND '{end_date}'
+      WHERE o.event_date BETWEEN :start_date AND :end_date
         AND o.event_date >= DATE(eu.timestamp_assigned)
     ) t
     GROUP BY variation_id, event_date
     ORDER BY variation_id, event_date;
     '''
+    params = {
+        "experiment_name": experiment_name,
+        "start_date": start_date,
+        "end_date": end_date,
+        "start_ts": f"{start_date} 00:00:00",
+        "end_ts": f"{end_date} 23:59:59",
+    }
+    if stream:
+        return stream_template(engine, "aov", query, params)
     with engine.connect() as conn:
-        df = conn.execute(text(query)).fetchall()
+        df = run_template(conn, "aov", query, params).fetchall()
     print(f"AOV: 实验 {experiment_name} 查询到 {len(df)} 条记录")
     return df 
\ No newline at end of file
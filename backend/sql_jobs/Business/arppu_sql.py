@@ -1,7 +1,7 @@
-from sqlalchemy import text
+from ..sql_templates import run_template, stream_template
 
-def fetch_group_arppu_samples(experiment_name, start_date, end_date, engine):
-    query = f'''
+def fetch_group_arppu_samples(experiment_name, start_date, end_date, engine, stream=False):
+    query = '''
     WITH 
         exp AS (
             SELECT user_id, variation_id
@@ -11,7 +11,7 @@ def fetch_group_arppu_samples(experiment_name, start_date, end_date, engine):
                     variation_id,
                     ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY event_date DESC) AS rn
                 FROM flow_wide_info.tbl_wide_experiment_assignment_hi
-                WHERE experiment_id = '{experiment_name}'
+                WHERE experiment_id = :experiment_name
             ) t
             WHERE rn = 1
         ),
@@ -23,7 +23,7 @@ def fetch_group_arppu_samples(experiment_name, start_date, end_date, engine):
                 FROM flow_event_info.tbl_app_event_subscribe s
                 FULL OUTER JOIN flow_event_info.tbl_app_event_currency_purchase o
                 ON s.user_id = o.user_id AND s.event_date = o.event_date
-                WHERE COALESCE(s.event_date, o.event_date) BETWEEN '{start_date}' AND '{end_date}'
+                WHERE COALESCE(s.event_date, o.event_date) BETWEEN :start_date AND :end_date
             ) c
             JOIN exp e ON c.user_id = e.user_id
             GROUP BY e.variation_id, c.event_date
@@ -31,13 +31,13 @@ def fetch_group_arppu_samples(experiment_name, start_date, end_date, engine):
         sub AS (
             SELECT user_id, event_date, SUM(revenue) AS sub_revenue
             FROM flow_event_info.tbl_app_event_subscribe
-            WHERE event_date BETWEEN '{start_date}' AND '{end_date}'
+            WHERE event_date BETWEEN :start_date AND :end_date
             GROUP BY user_id, event_date
         ),
         ord AS (
             SELECT user_id, event_date, SUM(revenue) AS order_revenue
             FROM flow_event_info.tbl_app_event_currency_purchase
-            WHERE event_date BETWEEN '{start_date}' AND '{end_date}'
+            WHERE event_date BETWEEN :start_date AND :end_date
             GROUP BY user_id, event_date
         ),
         combined AS (
@@ -74,8 +74,11 @@ def fetch_group_arppu_samples(experiment_name, start_date, end_date, engine):
     GROUP BY m.variation_id, m.event_date
     ORDER BY m.event_date ASC, m.variation_id ASC;
     '''
+    params = {"experiment_name": experiment_name, "start_date": start_date, "end_date": end_date}
+    if stream:
+        return stream_template(engine, "arppu", query, params)
     with engine.connect() as conn:
-        df = conn.execute(text(query)).fetchall()
+        df = run_template(conn, "arppu", query, params).fetchall()
     print(f"ARPPU: 实验 {experiment_name} 查询到 {len(df)} 条记录")
     return df
 # 后端返回的数据结构（建议 print 出来一条看看）
@@ -1,8 +1,8 @@
 import logging
-from sqlalchemy import text
+from ..sql_templates import run_template, stream_template
 
-def fetch_group_arpu_samples(experiment_name, start_date, end_date, engine):
-    query = f'''
+def fetch_group_arpu_samples(experiment_name, start_date, end_date, engine, stream=False):
+    query = '''
     WITH
         exp AS (
             SELECT user_id, variation_id, event_date
@@ -13,8 +13,8 @@ def fetch_group_arpu_samples(experiment_name, start_date, end_date, engine):
                     event_date,
                     ROW_NUMBER() OVER (PARTITION BY user_id, event_date ORDER BY event_date DESC) AS rn
                 FROM flow_wide_info.tbl_wide_experiment_assignment_hi
-                WHERE experiment_id = '{experiment_name}'
-                    AND event_date BETWEEN '{start_date}' AND '{end_date}'
+                WHERE experiment_id = :experiment_name
+                    AND event_date BETWEEN :start_date AND :end_date
             ) t
             WHERE rn = 1
         ),
@@ -30,13 +30,13 @@ def fetch_group_arpu_samples(experiment_name, start_date, end_date, engine):
         sub AS (
             SELECT user_id, event_date, SUM(revenue) AS sub_revenue
             FROM flow_event_info.tbl_app_event_subscribe
-            WHERE event_date BETWEEN '{start_date}' AND '{end_date}'
+            WHERE event_date BETWEEN :start_date AND :end_date
             GROUP BY user_id, event_date
         ),
         ord AS (
             SELECT user_id, event_date, SUM(revenue) AS order_revenue
             FROM flow_event_info.tbl_app_event_currency_purchase
-            WHERE event_date BETWEEN '{start_date}' AND '{end_date}'
+            WHERE event_date BETWEEN :start_date AND :end_date
             GROUP BY user_id, event_date
         ),
         user_revenue AS (
@@ -59,7 +59,7 @@ def fetch_group_arpu_samples(experiment_name, start_date, end_date, engine):
         daily_ad AS (
             SELECT event_date, SUM(ad_revenue) AS ad_revenue
             FROM flow_event_info.tbl_app_event_ads_impression
-            WHERE event_date BETWEEN '{start_date}' AND '{end_date}'
+            WHERE event_date BETWEEN :start_date AND :end_date
             GROUP BY event_date
         ),
         daily_total_active AS (
@@ -87,9 +87,12 @@ def fetch_group_arpu_samples(experiment_name, start_date, end_date, engine):
         ON da.event_date = dad.event_date
     LEFT JOIN daily_total_active dta
         ON da.event_date = dta.event_date
-    WHERE da.event_date >= '{start_date}' AND da.event_date <= '{end_date}';
+    WHERE da.event_date >= :start_date AND da.event_date <= :end_date;
     '''
+    params = {"experiment_name": experiment_name, "start_date": start_date, "end_date": end_date}
+    if stream:
+        return stream_template(engine, "arpu", query, params)
     with engine.connect() as conn:
-        df = conn.execute(text(query)).fetchall()
+        df = run_template(conn, "arpu", query, params).fetchall()
     print(f"ARPU: 实验 {experiment_name} 查询到 {len(df)} 条记录")
     return df 
\ No newline at end of file
@@ -1,20 +1,16 @@
-from sqlalchemy import text
-from datetime import datetime, timedelta
+from ..day_partition import execution_mode, run_day_partitions
+from ..sql_templates import run_template
 
-def fetch_group_cancel_sub_samples(experiment_name, start_date, end_date, engine):
+
+@execution_mode("partitioned")
+def fetch_group_cancel_sub_samples(experiment_name, start_date, end_date, engine, partition="day", max_workers=None):
     """
     多天合并查询，返回[start_date, end_date]区间内所有天的分组 chat round 数据，结构与 AOV 一致。
+    单日 SQL 依赖 DATE_ADD 偏移，按天/周分区后在有界线程池里并发执行，结果按日期顺序合并。
     """
-    all_results = []
-    start_dt = datetime.strptime(start_date, "%Y-%m-%d")
-    end_dt = datetime.strptime(end_date, "%Y-%m-%d")
-    delta = timedelta(days=1)
-    current_dt = start_dt
-
-    while current_dt <= end_dt:
-        current_date_str = current_dt.strftime("%Y-%m-%d")
+    def fetch_day(current_date_str):
         # 构造 SQL，传入 current_date
-        query = f'''
+        query = '''
 WITH union_events AS (
     SELECT user_id, order_id, country, DATE(sub_date) AS sub_date, notification_type, 'apple' AS store_type
     FROM flow_wide_info.tbl_wide_business_subscribe_apple_detail
@@ -31,7 +27,7 @@ exp_group AS (
       variation_id,
       ROW_NUMBER() OVER (PARTITION BY user_id, event_date ORDER BY event_date DESC) AS rn
     FROM flow_wide_info.tbl_wide_experiment_assignment_hi
-    WHERE experiment_id = '{experiment_name}'
+    WHERE experiment_id = :experiment_name
   ) t
   WHERE rn = 1
 ),
@@ -41,7 +37,7 @@ active_users AS (
         a.user_id,
         a.country
     FROM flow_event_info.tbl_wide_user_active_geo_daily a
-    WHERE a.event_date = '{current_date_str}'
+    WHERE a.event_date = :current_date
 ),
 new_subs AS (
   SELECT
@@ -62,7 +58,7 @@ new_subs AS (
       OR
       (e.store_type = 'google' AND e.notification_type IN ('2', '4'))
     )
-    AND e.sub_date = '{current_date_str}'
+    AND e.sub_date = :current_date
 ),
 cancel AS (
   SELECT 
@@ -82,7 +78,7 @@ cancel AS (
     )
 )
 SELECT
-  '{current_date_str}' AS event_date,
+  :current_date AS event_date,
   n.country,
   n.variation_id,
   COUNT(DISTINCT n.user_id) AS total_subs,
@@ -100,15 +96,19 @@ GROUP BY n.country, n.variation_id
 ORDER BY n.country, n.variation_id
 '''
         with engine.connect() as conn:
-            day_result = conn.execute(text(query)).fetchall()
+            day_result = run_template(conn, "cancel_sub_day", query, {"experiment_name": experiment_name, "current_date": current_date_str}).fetchall()
         # day_result 可能是 Row/tuple，转 dict
+        day_results = []
         for row in day_result:
             if hasattr(row, '_asdict'):
                 row_dict = row._asdict()
             else:
                 row_dict = dict(row)
-            all_results.append(row_dict)
-        current_dt += delta
+            day_results.append(row_dict)
+        return day_results
 
+    all_results = run_day_partitions(
+        fetch_day, start_date, end_date, partition=partition, max_workers=max_workers, experiment_name=experiment_name
+    )
     print(f"CLICK: 实验 {experiment_name} 多天合并查询到 {len(all_results)} 条记录")
     return all_results
\ No newline at end of file
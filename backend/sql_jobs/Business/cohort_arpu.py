@@ -1,4 +1,5 @@
-from sqlalchemy import text
+from ..assignment import first_assignment_source
+from ..sql_templates import run_template
 
 def fetch_cohort_arpu_heatmap(experiment_name, start_date, end_date, engine):
     """
@@ -14,19 +15,14 @@ def fetch_cohort_arpu_heatmap(experiment_name, start_date, end_date, engine):
     ]
     备注：register_date 恒等于 start_date，是 cohort 分析的“定基快照”模式
     """
-    query = """
+    assignment_sql = first_assignment_source(experiment_name, engine)
+    query = f"""
     WITH 
       -- 1. 所有 start_date 之前就进入实验的用户，作为“定基 cohort”
       experiment_users AS (
         SELECT user_id, variation_id
-        FROM (
-          SELECT user_id, variation_id,
-                 ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp_assigned ASC) AS rn
-          FROM flow_wide_info.tbl_wide_experiment_assignment_hi
-          WHERE experiment_id = :experiment_name
-            AND timestamp_assigned < DATE_ADD(:start_date, INTERVAL 1 DAY)
-        ) t
-        WHERE rn = 1
+        FROM ({assignment_sql}) t
+        WHERE first_assigned_at < DATE_ADD(:start_date, INTERVAL 1 DAY)
       ),
       -- 2. 每组 cohort 大小
       cohort_size AS (
@@ -86,7 +82,7 @@ def fetch_cohort_arpu_heatmap(experiment_name, start_date, end_date, engine):
         "end_date": end_date,
     }
     with engine.connect() as conn:
-        df = conn.execute(text(query), params).fetchall()
+        df = run_template(conn, "cohort_arpu_heatmap", query, params).fetchall()
     result = [dict(row._mapping) for row in df]
     print(f"[COHORT-CUMULATIVE-LTV-HEATMAP] 实验 {experiment_name} 查询到 {len(result)} 条记录")
     return result
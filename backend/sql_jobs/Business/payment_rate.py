@@ -1,6 +1,9 @@
-from sqlalchemy import text
 from datetime import datetime, timedelta
 
+from ..day_partition import execution_mode
+from ..sql_templates import run_template
+
+@execution_mode("serial")
 def fetch_group_payment_rate_samples(experiment_name, start_date, end_date, engine):
     """
     多天合并查询，返回[start_date, end_date]区间内所有天的分组 chat round 数据，结构与 AOV 一致。
@@ -14,7 +17,7 @@ def fetch_group_payment_rate_samples(experiment_name, start_date, end_date, engi
     while current_dt <= end_dt:
         current_date_str = current_dt.strftime("%Y-%m-%d")
         # 构造 SQL，传入 current_date
-        query = f'''
+        query = '''
         WITH 
         exp AS (
           SELECT user_id, variation_id, event_date
@@ -25,8 +28,8 @@ def fetch_group_payment_rate_samples(experiment_name, start_date, end_date, engi
               event_date,
               ROW_NUMBER() OVER (PARTITION BY user_id, event_date ORDER BY event_date DESC) AS rn
             FROM flow_wide_info.tbl_wide_experiment_assignment_hi
-            WHERE experiment_id = '{experiment_name}'
-              AND event_date = '{current_date_str}'
+            WHERE experiment_id = :experiment_name
+              AND event_date = :current_date
           ) t
           WHERE rn = 1
         ),
@@ -43,7 +46,7 @@ def fetch_group_payment_rate_samples(experiment_name, start_date, end_date, engi
           FROM exp e
           JOIN flow_event_info.tbl_app_event_all_purchase p
             ON e.user_id = p.user_id
-           AND p.event_date = '{current_date_str}'
+           AND p.event_date = :current_date
         ),
         purchase AS (
           SELECT
@@ -57,7 +60,7 @@ def fetch_group_payment_rate_samples(experiment_name, start_date, end_date, engi
           JOIN flow_event_info.tbl_app_event_all_purchase p
             ON e.user_id = p.user_id
            AND p.type IN ('subscription', 'currency')
-           AND p.event_date = '{current_date_str}'
+           AND p.event_date = :current_date
         ),
         final_purchase AS (
           SELECT DISTINCT user_id, variation_id, event_date, revenue, day_diff
@@ -71,7 +74,7 @@ def fetch_group_payment_rate_samples(experiment_name, start_date, end_date, engi
           a.variation_id,
           a.event_date,
           COUNT(DISTINCT p.user_id) AS paying_users,
-          COUNT(DISTINCT a.user_id) AS all_users，
+          COUNT(DISTINCT a.user_id) AS all_users,
           SUM(IFNULL(p.revenue, 0)) AS revenue,
           ROUND(SUM(CASE WHEN p.day_diff <= 7 THEN p.revenue ELSE 0 END) / NULLIF(COUNT(DISTINCT p.user_id), 0), 4) AS LTV7,
           ROUND(SUM(IFNULL(p.revenue, 0)) / NULLIF(COUNT(DISTINCT p.user_id), 0), 4) AS LTV_experiment,
@@ -83,7 +86,7 @@ def fetch_group_payment_rate_samples(experiment_name, start_date, end_date, engi
         GROUP BY a.variation_id, a.event_date; 
 '''
         with engine.connect() as conn:
-            day_result = conn.execute(text(query)).fetchall()
+            day_result = run_template(conn, "payment_rate", query, {"experiment_name": experiment_name, "current_date": current_date_str}).fetchall()
         # day_result 可能是 Row/tuple，转 dict
         for row in day_result:
             if hasattr(row, '_asdict'):
@@ -1,7 +1,7 @@
-from sqlalchemy import text
+from ..sql_templates import run_template, stream_template
 
-def fetch_group_payment_rate_all_samples(experiment_name, start_date, end_date, engine):
-    query = f'''
+def fetch_group_payment_rate_all_samples(experiment_name, start_date, end_date, engine, stream=False):
+    query = '''
     WITH 
         exp AS (
             SELECT user_id, variation_id, event_date
@@ -12,8 +12,8 @@ def fetch_group_payment_rate_all_samples(experiment_name, start_date, end_date,
                     event_date,
                     ROW_NUMBER() OVER (PARTITION BY user_id, event_date ORDER BY event_date DESC) AS rn
                 FROM flow_wide_info.tbl_wide_experiment_assignment_hi
-                WHERE experiment_id = '{experiment_name}'
-                  AND event_date BETWEEN '{start_date}' AND '{end_date}'
+                WHERE experiment_id = :experiment_name
+                  AND event_date BETWEEN :start_date AND :end_date
             ) t
             WHERE rn = 1
         ),
@@ -22,7 +22,7 @@ def fetch_group_payment_rate_all_samples(experiment_name, start_date, end_date,
                 a.event_date,
                 a.user_id
             FROM flow_event_info.tbl_app_session_info  a
-            WHERE a.event_date BETWEEN '{start_date}' AND '{end_date}'
+            WHERE a.event_date BETWEEN :start_date AND :end_date
         ),
         exp_active AS (
             SELECT 
@@ -39,7 +39,7 @@ def fetch_group_payment_rate_all_samples(experiment_name, start_date, end_date,
                 p.user_id
             FROM flow_event_info.tbl_app_event_all_purchase p
             WHERE p.type IN ('subscription', 'currency')
-              AND p.event_date BETWEEN '{start_date}' AND '{end_date}'
+              AND p.event_date BETWEEN :start_date AND :end_date
         ),
         exp_pay AS (
             SELECT
@@ -62,7 +62,10 @@ def fetch_group_payment_rate_all_samples(experiment_name, start_date, end_date,
     GROUP BY ea.event_date, ea.variation_id
     ORDER BY ea.event_date DESC, active_users DESC;
     '''
+    params = {"experiment_name": experiment_name, "start_date": start_date, "end_date": end_date}
+    if stream:
+        return stream_template(engine, "payment_rate_all", query, params)
     with engine.connect() as conn:
-        df = conn.execute(text(query)).fetchall()
+        df = run_template(conn, "payment_rate_all", query, params).fetchall()
     print(f"Payment Rate All: 实验 {experiment_name} 查询到 {len(df)} 条记录")
     return df 
\ No newline at end of file
@@ -1,10 +1,7 @@
-from sqlalchemy import text
+from ..sql_templates import run_template, stream_template
 
-def fetch_group_payment_rate_new_samples(experiment_name, start_date, end_date, engine):
-    # 只用 start_date 作为 event_date_str，end_date 可忽略或用于多天循环
-    event_date_str = start_date
-    day3_date = f"DATE_ADD('{start_date}', INTERVAL 3 DAY)"
-    query = f'''
+def fetch_group_payment_rate_new_samples(experiment_name, start_date, end_date, engine, stream=False):
+    query = '''
     WITH 
         cohort AS (
           SELECT
@@ -13,8 +10,8 @@ def fetch_group_payment_rate_new_samples(experiment_name, start_date, end_date,
             a.event_date,
             ROW_NUMBER() OVER (PARTITION BY a.user_id, a.variation_id, a.event_date) AS rn
           FROM flow_wide_info.tbl_wide_experiment_assignment_hi a
-          WHERE a.experiment_id = '{experiment_name}'
-            AND a.event_date BETWEEN '{start_date}' AND '{end_date}'
+          WHERE a.experiment_id = :experiment_name
+            AND a.event_date BETWEEN :start_date AND :end_date
         ),
         dnu AS (
           SELECT
@@ -34,7 +31,7 @@ def fetch_group_payment_rate_new_samples(experiment_name, start_date, end_date,
           JOIN flow_event_info.tbl_app_event_all_purchase p
             ON c.user_id = p.user_id AND c.event_date = p.event_date
           WHERE p.type IN ('subscription', 'currency')
-            AND p.event_date BETWEEN '{start_date}' AND DATE_ADD('{start_date}', INTERVAL 3 DAY)
+            AND p.event_date BETWEEN :start_date AND DATE_ADD(:start_date, INTERVAL 3 DAY)
         )
     SELECT
       d.event_date,
@@ -48,7 +45,10 @@ def fetch_group_payment_rate_new_samples(experiment_name, start_date, end_date,
     GROUP BY d.event_date, d.variation_id
     ORDER BY d.event_date DESC, d.variation_id;
     '''
+    params = {"experiment_name": experiment_name, "start_date": start_date, "end_date": end_date}
+    if stream:
+        return stream_template(engine, "payment_rate_new", query, params)
     with engine.connect() as conn:
-        df = conn.execute(text(query)).fetchall()
+        df = run_template(conn, "payment_rate_new", query, params).fetchall()
     print(f"Payment Rate New: 实验 {experiment_name} 查询到 {len(df)} 条记录")
     return df 
\ No newline at end of file
@@ -1,25 +1,21 @@
-from sqlalchemy import text
-from datetime import datetime, timedelta
+from ..day_partition import execution_mode, run_day_partitions
+from ..sql_templates import run_template
 
-def fetch_group_subscribe_new_samples(experiment_name, start_date, end_date, engine):
+
+@execution_mode("partitioned")
+def fetch_group_subscribe_new_samples(experiment_name, start_date, end_date, engine, partition="day", max_workers=None):
     """
     多天合并查询，返回[start_date, end_date]区间内所有天的分组 chat round 数据，结构与 AOV 一致。
+    单日 SQL 依赖 DATE_ADD 偏移，按天/周分区后在有界线程池里并发执行，结果按日期顺序合并。
     """
-    all_results = []
-    start_dt = datetime.strptime(start_date, "%Y-%m-%d")
-    end_dt = datetime.strptime(end_date, "%Y-%m-%d")
-    delta = timedelta(days=1)
-    current_dt = start_dt
-
-    while current_dt <= end_dt:
-        current_date_str = current_dt.strftime("%Y-%m-%d")
+    def fetch_day(current_date_str):
         # 构造 SQL，传入 current_date
-        query = f'''
+        query = '''
     WITH
     new_users AS (
         SELECT user_id
         FROM flow_wide_info.tbl_wide_user_first_visit_app_info
-        WHERE DATE(first_visit_date) = '{current_date_str}'
+        WHERE DATE(first_visit_date) = :current_date
     ),
     experiment_users AS (
         SELECT t.user_id, t.variation_id
@@ -30,8 +26,8 @@ def fetch_group_subscribe_new_samples(experiment_name, start_date, end_date, eng
                 event_date,
                 ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY event_date DESC) AS rn
             FROM flow_wide_info.tbl_wide_experiment_assignment_hi
-            WHERE experiment_id = '{experiment_name}'
-              AND event_date = '{current_date_str}'
+            WHERE experiment_id = :experiment_name
+              AND event_date = :current_date
         ) t
         WHERE rn = 1
     ),
@@ -48,18 +44,18 @@ def fetch_group_subscribe_new_samples(experiment_name, start_date, end_date, eng
         FROM new_exp_users n
         JOIN flow_event_info.tbl_app_event_subscribe o
             ON n.user_id = o.user_id
-        WHERE o.event_date >= '{current_date_str}'
-          AND o.event_date <= DATE_ADD('{current_date_str}', INTERVAL 3 DAY)
+        WHERE o.event_date >= :current_date
+          AND o.event_date <= DATE_ADD(:current_date, INTERVAL 3 DAY)
     )
     SELECT
-      '{current_date_str}' AS event_date,
+      :current_date AS event_date,
       variation_id,
       -- day1
-      SUM(CASE WHEN event_date <= DATE_ADD('{current_date_str}', INTERVAL 1 DAY) THEN revenue ELSE 0 END) AS subscribe_revenue_day1,
-      COUNT(CASE WHEN event_date <= DATE_ADD('{current_date_str}', INTERVAL 1 DAY) THEN 1 END) AS subscribe_order_cnt_day1,
+      SUM(CASE WHEN event_date <= DATE_ADD(:current_date, INTERVAL 1 DAY) THEN revenue ELSE 0 END) AS subscribe_revenue_day1,
+      COUNT(CASE WHEN event_date <= DATE_ADD(:current_date, INTERVAL 1 DAY) THEN 1 END) AS subscribe_order_cnt_day1,
       ROUND(
-        SUM(CASE WHEN event_date <= DATE_ADD('{current_date_str}', INTERVAL 1 DAY) THEN revenue ELSE 0 END)
-        / NULLIF(COUNT(CASE WHEN event_date <= DATE_ADD('{current_date_str}', INTERVAL 1 DAY) THEN 1 END), 0), 2
+        SUM(CASE WHEN event_date <= DATE_ADD(:current_date, INTERVAL 1 DAY) THEN revenue ELSE 0 END)
+        / NULLIF(COUNT(CASE WHEN event_date <= DATE_ADD(:current_date, INTERVAL 1 DAY) THEN 1 END), 0), 2
       ) AS aov_subscribe_day1,
       -- day3
       SUM(revenue) AS subscribe_revenue_day3,
@@ -69,15 +65,19 @@ def fetch_group_subscribe_new_samples(experiment_name, start_date, end_date, eng
     GROUP BY variation_id;
 '''
         with engine.connect() as conn:
-            day_result = conn.execute(text(query)).fetchall()
+            day_result = run_template(conn, "subscribe_new_day_aov", query, {"experiment_name": experiment_name, "current_date": current_date_str}).fetchall()
         # day_result 可能是 Row/tuple，转 dict
+        day_results = []
         for row in day_result:
             if hasattr(row, '_asdict'):
                 row_dict = row._asdict()
             else:
                 row_dict = dict(row)
-            all_results.append(row_dict)
-        current_dt += delta
+            day_results.append(row_dict)
+        return day_results
 
+    all_results = run_day_partitions(
+        fetch_day, start_date, end_date, partition=partition, max_workers=max_workers, experiment_name=experiment_name
+    )
     print(f"CLICK: 实验 {experiment_name} 多天合并查询到 {len(all_results)} 条记录")
     return all_results
\ No newline at end of file
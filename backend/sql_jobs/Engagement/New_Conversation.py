@@ -1,7 +1,54 @@
-from sqlalchemy import text
 from datetime import datetime, timedelta
 
-def fetch_group_new_conversation_samples(experiment_name, start_date, end_date, engine):
+from ..range_query import iter_dicts, rows_to_dicts
+from ..sql_templates import run_template, stream_template
+
+
+def fetch_group_new_conversation_samples_range(experiment_name, start_date, end_date, engine, stream=False):
+    """
+    单条 SQL 按 event_date 分组查询整个 [start_date, end_date] 区间，返回结构与按天循环版本一致。
+    """
+    query = '''
+            WITH assigned_users AS (
+                SELECT DISTINCT user_id, variation_id, event_date
+                FROM flow_wide_info.tbl_wide_experiment_assignment_hi
+                WHERE experiment_id = :experiment_name
+                  AND event_date BETWEEN :start_date AND :end_date
+            ),
+            chat_events AS (
+                SELECT DISTINCT user_id, conversation_id, event_date
+                FROM flow_event_info.tbl_app_event_chat_send
+                WHERE event_date BETWEEN :start_date AND :end_date
+            )
+            SELECT
+                e.event_date,
+                u.variation_id AS variation,
+                COUNT(DISTINCT e.conversation_id) AS total_new_conversation,
+                COUNT(DISTINCT e.user_id) AS unique_new_conversation_users,
+                CASE
+                    WHEN COUNT(DISTINCT e.user_id) = 0 THEN 0
+                    ELSE ROUND(COUNT(DISTINCT e.conversation_id) * 1.0 / COUNT(DISTINCT e.user_id), 4)
+                END AS new_conversation_ratio,
+                :experiment_name AS experiment_name
+            FROM chat_events e
+            JOIN assigned_users u
+              ON e.user_id = u.user_id AND e.event_date = u.event_date
+            GROUP BY e.event_date, u.variation_id
+            ORDER BY e.event_date, u.variation_id;
+    '''
+    params = {"experiment_name": experiment_name, "start_date": start_date, "end_date": end_date}
+    if stream:
+        return iter_dicts(stream_template(engine, "new_conversation", query, params), "event_date")
+    with engine.connect() as conn:
+        rows = run_template(conn, "new_conversation", query, params).fetchall()
+    all_results = rows_to_dicts(rows, "event_date")
+    print(f"CLICK: 实验 {experiment_name} 区间单次查询到 {len(all_results)} 条记录")
+    return all_results
+
+
+def fetch_group_new_conversation_samples(experiment_name, start_date, end_date, engine, single_query=True, stream=False):
+    if single_query:
+        return fetch_group_new_conversation_samples_range(experiment_name, start_date, end_date, engine, stream=stream)
     all_results = []
     start_dt = datetime.strptime(start_date, "%Y-%m-%d")
     end_dt = datetime.strptime(end_date, "%Y-%m-%d")
@@ -10,17 +57,17 @@ def fetch_group_new_conversation_samples(experiment_name, start_date, end_date,
 
     while current_dt <= end_dt:
         current_date_str = current_dt.strftime("%Y-%m-%d")
-        query = f'''
+        query = '''
            WITH assigned_users AS (
                     SELECT DISTINCT user_id, variation_id
                     FROM flow_wide_info.tbl_wide_experiment_assignment_hi
-                    WHERE experiment_id = '{experiment_name}'
-                      AND event_date = '{current_date_str}'
+                    WHERE experiment_id = :experiment_name
+                      AND event_date = :current_date
                 ),
                 chat_events AS (
                     SELECT DISTINCT user_id, conversation_id, event_date
                     FROM flow_event_info.tbl_app_event_chat_send
-                    WHERE event_date = '{current_date_str}'
+                    WHERE event_date = :current_date
                 )
                 SELECT
                     e.event_date,
@@ -31,7 +78,7 @@ def fetch_group_new_conversation_samples(experiment_name, start_date, end_date,
                         WHEN COUNT(DISTINCT e.user_id) = 0 THEN 0
                         ELSE ROUND(COUNT(DISTINCT e.conversation_id) * 1.0 / COUNT(DISTINCT e.user_id), 4)
                     END AS new_conversation_ratio,
-                    '{experiment_name}' AS experiment_name
+                    :experiment_name AS experiment_name
                 FROM chat_events e
                 JOIN assigned_users u
                   ON e.user_id = u.user_id
@@ -40,7 +87,7 @@ def fetch_group_new_conversation_samples(experiment_name, start_date, end_date,
 
         '''
         with engine.connect() as conn:
-            day_result = conn.execute(text(query)).fetchall()
+            day_result = run_template(conn, "new_conversation", query, {"experiment_name": experiment_name, "current_date": current_date_str}).fetchall()
         for row in day_result:
             row_dict = dict(row) if not hasattr(row, '_asdict') else row._asdict()
             row_dict['event_date'] = current_date_str
@@ -1,7 +1,57 @@
-from sqlalchemy import text
 from datetime import datetime, timedelta
 
-def fetch_group_regen_samples(experiment_name, start_date, end_date, engine):
+from ..range_query import iter_dicts, rows_to_dicts
+from ..sql_templates import run_template, stream_template
+
+
+def fetch_group_regen_samples_range(experiment_name, start_date, end_date, engine, stream=False):
+    """
+    单条 SQL 按 event_date 分组查询整个 [start_date, end_date] 区间，返回结构与按天循环版本一致。
+    """
+    query = '''
+            WITH dedup_assign AS (
+                SELECT user_id, variation_id
+                FROM (
+                    SELECT
+                        user_id,
+                        variation_id,
+                        event_date,
+                        ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY event_date DESC) AS rn
+                    FROM flow_wide_info.tbl_wide_experiment_assignment_hi
+                    WHERE experiment_id = :experiment_name
+                ) t
+                WHERE rn = 1
+            )
+            SELECT
+                a.event_date,
+                b.variation_id AS variation,
+                COUNT(DISTINCT a.event_id) AS total_regen,
+                COUNT(DISTINCT a.user_id) AS unique_regen_users,
+                CASE
+                    WHEN COUNT(DISTINCT a.user_id) = 0 THEN 0
+                    ELSE ROUND(COUNT(DISTINCT a.event_id) * 1.0 / COUNT(DISTINCT a.user_id), 4)
+                END AS regen_ratio,
+                :experiment_name AS experiment_name
+            FROM flow_event_info.tbl_app_event_chat_send a
+            JOIN dedup_assign b ON a.user_id = b.user_id
+            WHERE a.event_date BETWEEN :start_date AND :end_date
+              AND a.Method = 'regenerate'
+            GROUP BY a.event_date, b.variation_id
+            ORDER BY a.event_date, b.variation_id
+    '''
+    params = {"experiment_name": experiment_name, "start_date": start_date, "end_date": end_date}
+    if stream:
+        return iter_dicts(stream_template(engine, "regen", query, params), "event_date")
+    with engine.connect() as conn:
+        rows = run_template(conn, "regen", query, params).fetchall()
+    all_results = rows_to_dicts(rows, "event_date")
+    print(f"CLICK: 实验 {experiment_name} 区间单次查询到 {len(all_results)} 条记录")
+    return all_results
+
+
+def fetch_group_regen_samples(experiment_name, start_date, end_date, engine, single_query=True, stream=False):
+    if single_query:
+        return fetch_group_regen_samples_range(experiment_name, start_date, end_date, engine, stream=stream)
     all_results = []
     start_dt = datetime.strptime(start_date, "%Y-%m-%d")
     end_dt = datetime.strptime(end_date, "%Y-%m-%d")
@@ -10,7 +60,7 @@ def fetch_group_regen_samples(experiment_name, start_date, end_date, engine):
 
     while current_dt <= end_dt:
         current_date_str = current_dt.strftime("%Y-%m-%d")
-        query = f'''
+        query = '''
             WITH dedup_assign AS (
                 SELECT user_id, variation_id
                 FROM (
@@ -20,12 +70,12 @@ def fetch_group_regen_samples(experiment_name, start_date, end_date, engine):
                         event_date,
                         ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY event_date DESC) AS rn
                     FROM flow_wide_info.tbl_wide_experiment_assignment_hi
-                    WHERE experiment_id = '{experiment_name}'
+                    WHERE experiment_id = :experiment_name
                 ) t
                 WHERE rn = 1
             )
             SELECT
-                '{current_date_str}' AS event_date,
+                :current_date AS event_date,
                 b.variation_id AS variation,
                 COUNT(DISTINCT a.event_id) AS total_regen,
                 COUNT(DISTINCT a.user_id) AS unique_regen_users,
@@ -33,15 +83,15 @@ def fetch_group_regen_samples(experiment_name, start_date, end_date, engine):
                     WHEN COUNT(DISTINCT a.user_id) = 0 THEN 0
                     ELSE ROUND(COUNT(DISTINCT a.event_id) * 1.0 / COUNT(DISTINCT a.user_id), 4)
                 END AS regen_ratio,
-                '{experiment_name}' AS experiment_name
+                :experiment_name AS experiment_name
             FROM flow_event_info.tbl_app_event_chat_send a
             JOIN dedup_assign b ON a.user_id = b.user_id
-            WHERE a.event_date = '{current_date_str}'
+            WHERE a.event_date = :current_date
               AND a.Method = 'regenerate'
             GROUP BY b.variation_id
         '''
         with engine.connect() as conn:
-            day_result = conn.execute(text(query)).fetchall()
+            day_result = run_template(conn, "regen", query, {"experiment_name": experiment_name, "current_date": current_date_str}).fetchall()
         for row in day_result:
             row_dict = dict(row) if not hasattr(row, '_asdict') else row._asdict()
             row_dict['event_date'] = current_date_str
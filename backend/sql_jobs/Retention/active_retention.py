@@ -1,26 +1,26 @@
-from sqlalchemy import text
-from datetime import datetime, timedelta
+from ..assignment import first_assignment_source
+from ..day_partition import execution_mode, run_day_partitions
+from ..sql_templates import run_template
 
-def fetch_active_user_retention(experiment_name, start_date, end_date, engine, day):
+
+@execution_mode("partitioned")
+def fetch_active_user_retention(experiment_name, start_date, end_date, engine, day, partition="day", max_workers=None):
     """
     查询活跃用户指定 day (1/3/7/15) 留存率，每天查询，返回字段如:
     {variation, active_date, active_users, d1_retained_users, d1_retention_rate}
+    单日 SQL 依赖 DATE_ADD 偏移，按天/周分区后在有界线程池里并发执行，结果按日期顺序合并。
     """
-    all_results = []
-    start_dt = datetime.strptime(start_date, "%Y-%m-%d")
-    end_dt = datetime.strptime(end_date, "%Y-%m-%d")
-    delta = timedelta(days=1)
-
     # 拼出动态字段名
     retained_users_field = f'd{day}_retained_users'
     retention_rate_field = f'd{day}_retention_rate'
+    # 分组子查询只解析一次，所有分区共用
+    assignment_sql = first_assignment_source(experiment_name, engine)
 
-    while start_dt <= end_dt:
-        current_date_str = start_dt.strftime("%Y-%m-%d")
+    def fetch_day(current_date_str):
         query = f"""
         SELECT
           e.variation AS variation,
-          '{current_date_str}' AS active_date,
+          :current_date AS active_date,
           COUNT(DISTINCT base.user_id) AS active_users,
           COUNT(DISTINCT dN.user_id) AS {retained_users_field},
           ROUND(COUNT(DISTINCT dN.user_id) / NULLIF(COUNT(DISTINCT base.user_id), 0), 4) AS {retention_rate_field}
@@ -28,26 +28,20 @@ def fetch_active_user_retention(experiment_name, start_date, end_date, engine, d
             -- 当天活跃用户
             SELECT user_id
             FROM flow_wide_info.tbl_wide_active_user_app_info
-            WHERE active_date = '{current_date_str}'
+            WHERE active_date = :current_date
               AND keep_alive_flag = 1
               AND user_id IS NOT NULL AND user_id != ''
         ) base
         LEFT JOIN (
-            -- 实验分组
+            -- 实验分组（首次分组：物化表或窗口去重）
             SELECT user_id, CAST(variation_id AS CHAR) AS variation
-            FROM (
-                SELECT user_id, variation_id,
-                    ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp_assigned ASC) AS rn
-                FROM flow_wide_info.tbl_wide_experiment_assignment_hi
-                WHERE experiment_id = '{experiment_name}'
-            ) t
-            WHERE rn = 1
+            FROM ({assignment_sql}) t
         ) e ON base.user_id = e.user_id
         LEFT JOIN (
             -- N天后还活跃的
             SELECT user_id
             FROM flow_wide_info.tbl_wide_active_user_app_info
-            WHERE active_date = DATE_ADD('{current_date_str}', INTERVAL {day} DAY)
+            WHERE active_date = DATE_ADD(:current_date, INTERVAL {day} DAY)
               AND keep_alive_flag = 1
         ) dN ON base.user_id = dN.user_id
         WHERE e.variation IS NOT NULL
@@ -55,14 +49,18 @@ def fetch_active_user_retention(experiment_name, start_date, end_date, engine, d
         ORDER BY e.variation;
         """
         with engine.connect() as conn:
-            rows = conn.execute(text(query)).fetchall()
+            rows = run_template(conn, f"all_retention_d{day}", query, {"experiment_name": experiment_name, "current_date": current_date_str}).fetchall()
+        day_results = []
         for row in rows:
             # 处理字段名动态返回
             row_dict = dict(row) if not hasattr(row, '_asdict') else row._asdict()
             # 强制补充日期（防止不同SQL方言遗漏）
             row_dict['active_date'] = current_date_str
-            all_results.append(row_dict)
-        start_dt += delta
+            day_results.append(row_dict)
+        return day_results
 
+    all_results = run_day_partitions(
+        fetch_day, start_date, end_date, partition=partition, max_workers=max_workers, experiment_name=experiment_name
+    )
     print(f"RETENTION: {experiment_name} D{day} 多天合并共 {len(all_results)} 条")
     return all_results
@@ -1,4 +1,5 @@
-from sqlalchemy import text
+from ..assignment import first_assignment_source
+from ..sql_templates import run_template
 
 
 def fetch_cohort_retention_heatmap(experiment_name, start_date, end_date, engine, max_days=30):
@@ -9,8 +10,10 @@ def fetch_cohort_retention_heatmap(experiment_name, start_date, end_date, engine
     """
     # max_days 参数在这里不再需要，因为周期由 end_date 决定，但保留以兼容接口
 
+    assignment_sql = first_assignment_source(experiment_name, engine)
+
     # 使用参数化查询 :key 来保证安全
-    query = """
+    query = f"""
     WITH
       -- 步骤1: 定义我们的“定点群组”。
       -- 即，在指定的 start_date 当天，所有活跃过的实验用户。
@@ -21,13 +24,7 @@ def fetch_cohort_retention_heatmap(experiment_name, start_date, end_date, engine
         FROM flow_wide_info.tbl_wide_active_user_app_info a
         JOIN (
           SELECT user_id, variation_id
-          FROM (
-            SELECT user_id, variation_id,
-                   ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp_assigned ASC) AS rn
-            FROM flow_wide_info.tbl_wide_experiment_assignment_hi
-            WHERE experiment_id = :experiment_name
-          ) t
-          WHERE rn = 1
+          FROM ({assignment_sql}) t
         ) e ON a.user_id = e.user_id
         -- 关键筛选：只选择在 start_date 当天活跃的用户
         WHERE a.active_date = :start_date
@@ -75,7 +72,7 @@ def fetch_cohort_retention_heatmap(experiment_name, start_date, end_date, engine
     }
 
     with engine.connect() as conn:
-        result_proxy = conn.execute(text(query), params)
+        result_proxy = run_template(conn, "cohort_retention_heatmap", query, params)
         all_results = [dict(row._mapping) for row in result_proxy]
 
     print(f"[COHORT-RETENTION-HEATMAP - 定点快照模式] 实验 {experiment_name} 查询到 {len(all_results)} 条记录")
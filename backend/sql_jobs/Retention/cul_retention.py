@@ -1,13 +1,16 @@
-from sqlalchemy import text
 from datetime import datetime
 
+from ..assignment import first_assignment_source
+from ..sql_templates import run_template
+
 def fetch_group_cumulative_retained_users_daily(experiment_name, start_date, end_date, engine):
     """
     【逻辑修正版】
     一次性查询出每天的累计留存用户数、累计注册用户数和累计留存率，分 variation 输出。
     修复了导致累计留存率下降的逻辑问题。
     """
-    query = """
+    assignment_sql = first_assignment_source(experiment_name, engine)
+    query = f"""
     WITH user_first_active AS (
         -- 步骤1: 先计算出每个用户的首次活跃日
         SELECT
@@ -16,11 +19,7 @@ def fetch_group_cumulative_retained_users_daily(experiment_name, start_date, end
             MIN(a.active_date) AS first_active_date
         FROM flow_wide_info.tbl_wide_active_user_app_info a
         JOIN (
-            SELECT user_id, variation_id FROM (
-                SELECT user_id, variation_id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp_assigned ASC) AS rn
-                FROM flow_wide_info.tbl_wide_experiment_assignment_hi
-                WHERE experiment_id = :experiment_name
-            ) t WHERE rn = 1
+            SELECT user_id, variation_id FROM ({assignment_sql}) t
         ) e ON a.user_id = e.user_id
         GROUP BY e.user_id, e.variation_id
     ),
@@ -70,7 +69,7 @@ def fetch_group_cumulative_retained_users_daily(experiment_name, start_date, end
     """
     params = {"experiment_name": experiment_name, "start_date": start_date, "end_date": end_date}
     with engine.connect() as conn:
-        result_proxy = conn.execute(text(query), params)
+        result_proxy = run_template(conn, "cumulative_retention", query, params)
         all_results = [dict(row._mapping) for row in result_proxy]
     print(f"Cumulative Retained Users (每日): 实验 {experiment_name} 单次高效查询到 {len(all_results)} 条记录")
     return all_results
\ No newline at end of file
@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+
+from ..assignment import first_assignment_source
+from ..range_query import normalize_date, row_to_dict
+from ..sql_templates import run_template
+
+# 一次算出的留存天数，对应 INDICATOR_CONFIG 里的 all_retention_dN / new_retention_dN
+RETENTION_DAYS = (1, 3, 7, 15)
+
+# 同一 (实验, 区间) 的结果在进程内复用多久：8 个留存指标连着请求时只查一次
+FUSED_RETENTION_TTL_SECONDS = int(os.environ.get("FUSED_RETENTION_TTL_SECONDS", "300"))
+
+# 两类 cohort 各自的日期 / 人数字段名，和原来按天查询的返回结构一致
+_COHORT_FIELDS = {
+    "active": ("active_date", "active_users"),
+    "new": ("first_visit_date", "new_users"),
+}
+
+_results = {}  # (experiment_name, start_date, end_date) -> (time.monotonic(), {"active": [...], "new": [...]})
+# 固定数量的分段锁，按 key 的哈希取一把；不按 key 建锁，长期运行的 worker 里锁不会越积越多
+_LOCK_STRIPES = 16
+_locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+
+
+def _key_lock(key):
+    return _locks[hash(key) % _LOCK_STRIPES]
+
+
+def _retained_columns():
+    columns = []
+    for day in RETENTION_DAYS:
+        retained = f"COUNT(DISTINCT CASE WHEN DATEDIFF(l.active_date, c.cohort_date) = {day} THEN l.user_id END)"
+        columns.append(f"{retained} AS d{day}_retained_users")
+        columns.append(f"ROUND({retained} / NULLIF(COUNT(DISTINCT c.user_id), 0), 4) AS d{day}_retention_rate")
+    return ",\n          ".join(columns)
+
+
+def fetch_retention_all_days(experiment_name, start_date, end_date, engine):
+    """
+    活跃用户 / 新用户两个 cohort 的 D1/D3/D7/D15 留存一条 SQL 算完：
+    cohort 日期在 [start_date, end_date]，之后的活跃只扫一遍（到 end_date + 15 天），按 DATEDIFF 分桶计数。
+    返回 {"active": [...], "new": [...]}，每行包含所有天数的 dN_retained_users / dN_retention_rate。
+    """
+    assignment_sql = first_assignment_source(experiment_name, engine)
+    query = f"""
+        WITH exp AS (
+            SELECT user_id, CAST(variation_id AS CHAR) AS variation
+            FROM ({assignment_sql}) t
+        ),
+        cohort AS (
+            -- 每天的活跃用户
+            SELECT 'active' AS cohort, active_date AS cohort_date, user_id
+            FROM flow_wide_info.tbl_wide_active_user_app_info
+            WHERE active_date BETWEEN :start_date AND :end_date
+              AND keep_alive_flag = 1
+              AND user_id IS NOT NULL AND user_id != ''
+            UNION ALL
+            -- 每天的新增用户
+            SELECT 'new' AS cohort, DATE(first_visit_date) AS cohort_date, user_id
+            FROM flow_wide_info.tbl_wide_user_first_visit_app_info
+            WHERE DATE(first_visit_date) BETWEEN :start_date AND :end_date
+              AND user_id IS NOT NULL AND user_id != ''
+        ),
+        later_active AS (
+            -- cohort 日之后仍活跃的用户，覆盖到最长的留存天数
+            SELECT DISTINCT user_id, active_date
+            FROM flow_wide_info.tbl_wide_active_user_app_info
+            WHERE active_date BETWEEN DATE_ADD(:start_date, INTERVAL 1 DAY)
+                                  AND DATE_ADD(:end_date, INTERVAL {max(RETENTION_DAYS)} DAY)
+              AND keep_alive_flag = 1
+        )
+        SELECT
+          c.cohort AS cohort,
+          e.variation AS variation,
+          c.cohort_date AS cohort_date,
+          COUNT(DISTINCT c.user_id) AS cohort_users,
+          {_retained_columns()}
+        FROM cohort c
+        JOIN exp e ON c.user_id = e.user_id
+        LEFT JOIN later_active l
+          ON l.user_id = c.user_id
+         AND DATEDIFF(l.active_date, c.cohort_date) IN ({", ".join(str(d) for d in RETENTION_DAYS)})
+        GROUP BY c.cohort, e.variation, c.cohort_date
+        ORDER BY c.cohort, c.cohort_date, e.variation;
+    """
+    params = {"experiment_name": experiment_name, "start_date": start_date, "end_date": end_date}
+    with engine.connect() as conn:
+        rows = run_template(conn, "retention_fused", query, params).fetchall()
+
+    results = {cohort: [] for cohort in _COHORT_FIELDS}
+    for row in rows:
+        row_dict = row_to_dict(row)
+        cohort = row_dict.pop("cohort")
+        date_field, users_field = _COHORT_FIELDS[cohort]
+        row_dict[date_field] = normalize_date(row_dict.pop("cohort_date"))
+        row_dict[users_field] = row_dict.pop("cohort_users")
+        results[cohort].append(row_dict)
+    print(f"RETENTION: {experiment_name} D{'/D'.join(str(d) for d in RETENTION_DAYS)} 单次查询，"
+          f"活跃 {len(results['active'])} 条，新增 {len(results['new'])} 条")
+    return results
+
+
+def get_fused_retention(experiment_name, start_date, end_date, engine):
+    """带进程内复用的 fetch_retention_all_days：TTL 内同一区间只查一次，并发请求只有一个去查。"""
+    key = (experiment_name, start_date, end_date)
+    cached = _results.get(key)
+    if cached is not None and time.monotonic() - cached[0] < FUSED_RETENTION_TTL_SECONDS:
+        return cached[1]
+    with _key_lock(key):
+        cached = _results.get(key)
+        if cached is not None and time.monotonic() - cached[0] < FUSED_RETENTION_TTL_SECONDS:
+            return cached[1]
+        results = fetch_retention_all_days(experiment_name, start_date, end_date, engine)
+        now = time.monotonic()
+        for stale_key in [k for k, (ts, _) in _results.items() if now - ts >= FUSED_RETENTION_TTL_SECONDS]:
+            _results.pop(stale_key, None)
+        _results[key] = (now, results)
+    return results
+
+
+def fetch_active_user_retention_fused(experiment_name, start_date, end_date, engine):
+    """all_retention_d1..d15 共用：返回活跃 cohort 的行（只读，不要原地修改）。"""
+    return get_fused_retention(experiment_name, start_date, end_date, engine)["active"]
+
+
+def fetch_new_user_retention_fused(experiment_name, start_date, end_date, engine):
+    """new_retention_d1..d15 共用：返回新增 cohort 的行（只读，不要原地修改）。"""
+    return get_fused_retention(experiment_name, start_date, end_date, engine)["new"]
@@ -0,0 +1,199 @@
+# backend/sql_jobs/assignment.py
+"""
+实验分组物化表：每个实验只算一次 “用户首次分组”。
+
+几乎每个 fetcher 都会对 flow_wide_info.tbl_wide_experiment_assignment_hi 做一遍
+ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp_assigned) 去重，按天循环时还会每天重复一遍。
+这里把结果物化到 abtest_experiment_assignment (experiment_id, user_id, variation_id, first_assigned_date)。
+
+建表和刷新都只在 Airflow 流水线里做（airflow/refresh_assignments.py，在生成快照之前跑），web 请求里只读：
+- watermark 表记录物化表已覆盖到的 event_date；
+- fetcher 通过 first_assignment_source() 拿到分组子查询：实验已有 watermark 时读物化表，
+  再补上 watermark 当天及以后源表里新出现的用户（流水线两次运行之间新分组的人不会漏），
+  没有 watermark（流水线还没跑过该实验）时退回原来的窗口去重。
+表是 StarRocks 主键模型（建表语句见 backend/utils/abtest_experiment_assignment.sql），
+INSERT 按主键 upsert，不用 MySQL 的 ON DUPLICATE KEY。
+"""
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+from ..utils.admission import admit
+
+USE_ASSIGNMENT_TABLE = os.environ.get("USE_ASSIGNMENT_TABLE", "1") == "1"
+# web 进程里 “该实验有没有物化分组” 的检查结果缓存多久
+ASSIGNMENT_CHECK_SECONDS = int(os.environ.get("ASSIGNMENT_CHECK_SECONDS", "300"))
+
+ASSIGNMENT_TABLE = "abtest_experiment_assignment"
+WATERMARK_TABLE = "abtest_experiment_assignment_watermark"
+
+# 全量构建时的起点
+_FULL_BUILD_SINCE = "1970-01-01"
+
+# experiment_id -> (物化表是否可用, 检查时间 time.monotonic)
+_checked = {}
+
+CREATE_ASSIGNMENT_TABLES_SQL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {ASSIGNMENT_TABLE} (
+        experiment_id VARCHAR(128) NOT NULL,
+        user_id VARCHAR(128) NOT NULL,
+        variation_id VARCHAR(64) NOT NULL,
+        first_assigned_date DATE NOT NULL,
+        first_assigned_at DATETIME NOT NULL
+    )
+    PRIMARY KEY (experiment_id, user_id)
+    DISTRIBUTED BY HASH (experiment_id, user_id)
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+        experiment_id VARCHAR(128) NOT NULL,
+        max_event_date DATE NOT NULL,
+        refreshed_at DATETIME NOT NULL
+    )
+    PRIMARY KEY (experiment_id)
+    DISTRIBUTED BY HASH (experiment_id)
+    """,
+]
+
+
+def inline_first_assignment_sql(experiment_expr=":experiment_name"):
+    """原来的窗口去重写法：每个用户取 timestamp_assigned 最早的一条分组。"""
+    return f"""
+        SELECT user_id, variation_id,
+               DATE(timestamp_assigned) AS first_assigned_date,
+               timestamp_assigned AS first_assigned_at
+        FROM (
+            SELECT user_id, variation_id, timestamp_assigned,
+                   ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp_assigned ASC) AS rn
+            FROM flow_wide_info.tbl_wide_experiment_assignment_hi
+            WHERE experiment_id = {experiment_expr}
+        ) assign_t
+        WHERE rn = 1
+    """
+
+
+def materialized_first_assignment_sql(experiment_expr=":experiment_name"):
+    """物化表 + watermark 当天（含）之后源表里物化表还没有的用户（和刷新时的增量规则一致）。"""
+    return f"""
+        SELECT user_id, variation_id, first_assigned_date, first_assigned_at
+        FROM {ASSIGNMENT_TABLE}
+        WHERE experiment_id = {experiment_expr}
+        UNION ALL
+        SELECT t.user_id, t.variation_id, DATE(t.timestamp_assigned), t.timestamp_assigned
+        FROM (
+            SELECT user_id, variation_id, timestamp_assigned,
+                   ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp_assigned ASC) AS rn
+            FROM flow_wide_info.tbl_wide_experiment_assignment_hi
+            WHERE experiment_id = {experiment_expr}
+              AND event_date >= (
+                  SELECT max_event_date FROM {WATERMARK_TABLE} WHERE experiment_id = {experiment_expr}
+              )
+        ) t
+        LEFT JOIN {ASSIGNMENT_TABLE} m
+          ON m.experiment_id = {experiment_expr} AND m.user_id = t.user_id
+        WHERE t.rn = 1 AND m.user_id IS NULL
+    """
+
+
+def create_assignment_tables(engine):
+    """建物化分组表和 watermark 表（已存在时跳过），由流水线调用。"""
+    with engine.begin() as conn:
+        for sql in CREATE_ASSIGNMENT_TABLES_SQL:
+            conn.execute(text(sql))
+
+
+def get_watermark(experiment_name, engine):
+    sql = text(f"""
+        SELECT max_event_date, refreshed_at
+        FROM {WATERMARK_TABLE}
+        WHERE experiment_id = :experiment_name
+    """)
+    with engine.connect() as conn:
+        row = conn.execute(sql, {"experiment_name": experiment_name}).fetchone()
+    if not row:
+        return None, None
+    refreshed_at = row[1]
+    if isinstance(refreshed_at, str):
+        refreshed_at = datetime.fromisoformat(refreshed_at)
+    return str(row[0])[:10], refreshed_at
+
+
+def refresh_assignment_table(experiment_name, engine):
+    """
+    构建 / 增量刷新某个实验的物化分组，由流水线调用（web 请求里不做）。
+    从 watermark 当天（含）开始扫描源表，只插入物化表里还没有的用户；没有 watermark 时即全量构建。
+    """
+    since, _ = get_watermark(experiment_name, engine)
+    since = since or _FULL_BUILD_SINCE
+    params = {"experiment_name": experiment_name, "since": since}
+
+    max_date_sql = text("""
+        SELECT MAX(event_date)
+        FROM flow_wide_info.tbl_wide_experiment_assignment_hi
+        WHERE experiment_id = :experiment_name AND event_date >= :since
+    """)
+    insert_sql = text(f"""
+        INSERT INTO {ASSIGNMENT_TABLE}
+        (experiment_id, user_id, variation_id, first_assigned_date, first_assigned_at)
+        SELECT :experiment_name, t.user_id, t.variation_id, DATE(t.timestamp_assigned), t.timestamp_assigned
+        FROM (
+            SELECT user_id, variation_id, timestamp_assigned,
+                   ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp_assigned ASC) AS rn
+            FROM flow_wide_info.tbl_wide_experiment_assignment_hi
+            WHERE experiment_id = :experiment_name AND event_date >= :since
+        ) t
+        LEFT JOIN {ASSIGNMENT_TABLE} m
+          ON m.experiment_id = :experiment_name AND m.user_id = t.user_id
+        WHERE t.rn = 1 AND m.user_id IS NULL
+    """)
+    watermark_sql = text(f"""
+        INSERT INTO {WATERMARK_TABLE} (experiment_id, max_event_date, refreshed_at)
+        VALUES (:experiment_name, :max_event_date, NOW())
+    """)
+
+    # 主键模型的 INSERT 即 upsert；每条语句各自提交（数仓不支持跨语句的事务），
+    # 先取 watermark 再插入：插入期间新落地的同日数据下次从同一天重扫，不会漏；
+    # watermark 最后写，插入失败时下次仍从旧 watermark 重扫
+    with engine.begin() as conn:
+        max_event_date = conn.execute(max_date_sql, params).scalar()
+    with engine.begin() as conn:
+        result = conn.execute(insert_sql, params)
+    with engine.begin() as conn:
+        conn.execute(watermark_sql, {
+            "experiment_name": experiment_name,
+            "max_event_date": str(max_event_date)[:10] if max_event_date else since,
+        })
+    _checked.pop(experiment_name, None)
+    print(f"[ASSIGNMENT] 实验 {experiment_name} 分组物化表刷新完成（since={since}，新增 {result.rowcount} 人）")
+
+
+def assignment_table_ready(experiment_name, engine):
+    """
+    只读检查：流水线已经为该实验建过物化分组（有 watermark）时返回 True，否则调用方退回窗口去重。
+    结果在进程里缓存 ASSIGNMENT_CHECK_SECONDS 秒。
+    """
+    checked = _checked.get(experiment_name)
+    if checked is not None and time.monotonic() - checked[1] < ASSIGNMENT_CHECK_SECONDS:
+        return checked[0]
+    try:
+        with admit(experiment_name, priority=True):
+            since, _ = get_watermark(experiment_name, engine)
+        ready = since is not None
+    except Exception as e:
+        print(f"[ASSIGNMENT] 实验 {experiment_name} 物化分组不可用，退回窗口去重: {e}")
+        ready = False
+    _checked[experiment_name] = (ready, time.monotonic())
+    return ready
+
+
+def first_assignment_source(experiment_name, engine, experiment_expr=":experiment_name"):
+    """
+    返回 “用户首次分组” 子查询 SQL，字段为 (user_id, variation_id, first_assigned_date, first_assigned_at)。
+    experiment_expr 是 SQL 里实验名的写法（绑定参数或字面量）。
+    """
+    if USE_ASSIGNMENT_TABLE and assignment_table_ready(experiment_name, engine):
+        return materialized_first_assignment_sql(experiment_expr)
+    return inline_first_assignment_sql(experiment_expr)
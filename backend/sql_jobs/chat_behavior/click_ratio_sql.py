@@ -1,6 +1,6 @@
-from sqlalchemy import text
+from ..sql_templates import run_template, stream_template
 
-def fetch_group_click_ratio_samples(experiment_name, start_date, end_date, engine):
+def fetch_group_click_ratio_samples(experiment_name, start_date, end_date, engine, stream=False):
     query = '''
     WITH dedup_assignment AS (
         SELECT user_id, event_date, variation_id
@@ -69,10 +69,10 @@ def fetch_group_click_ratio_samples(experiment_name, start_date, end_date, engin
     GROUP BY a.variation_id, s.event_date
     ORDER BY s.event_date, a.variation_id;
     '''
+    params = {"experiment_name": experiment_name, "start_date": start_date, "end_date": end_date}
+    if stream:
+        return stream_template(engine, "click_rate", query, params)
     with engine.connect() as conn:
-        df = conn.execute(
-            text(query),
-            {"experiment_name": experiment_name, "start_date": start_date, "end_date": end_date}
-        ).fetchall()
+        df = run_template(conn, "click_rate", query, params).fetchall()
     print(f"CLICK: 实验 {experiment_name} 查询到 {len(df)} 条记录")
     return df
\ No newline at end of file
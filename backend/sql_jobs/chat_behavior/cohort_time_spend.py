@@ -1,4 +1,5 @@
-from sqlalchemy import text
+from ..assignment import first_assignment_source
+from ..sql_templates import run_template
 
 
 def fetch_cohort_time_spent_heatmap(experiment_name, start_date, end_date, engine, max_days=30):
@@ -15,7 +16,8 @@ def fetch_cohort_time_spent_heatmap(experiment_name, start_date, end_date, engin
       }, ...
     ]
     """
-    query = """
+    assignment_sql = first_assignment_source(experiment_name, engine)
+    query = f"""
            WITH
           -- 步骤1: 定义我们的“定点群组”。
           -- 即，在指定的 start_date 当天，所有活跃过的实验用户。
@@ -26,13 +28,7 @@ def fetch_cohort_time_spent_heatmap(experiment_name, start_date, end_date, engin
             FROM flow_wide_info.tbl_wide_active_user_app_info a
             JOIN (
               SELECT user_id, variation_id
-              FROM (
-                SELECT user_id, variation_id,
-                       ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp_assigned ASC) AS rn
-                FROM flow_wide_info.tbl_wide_experiment_assignment_hi
-                WHERE experiment_id = :experiment_name
-              ) t
-              WHERE rn = 1
+              FROM ({assignment_sql}) t
             ) e ON a.user_id = e.user_id
             -- 关键筛选：只选择在 start_date 当天活跃的用户
             WHERE a.active_date = :start_date
@@ -78,7 +74,7 @@ def fetch_cohort_time_spent_heatmap(experiment_name, start_date, end_date, engin
         "end_date": end_date,
     }
     with engine.connect() as conn:
-        df = conn.execute(text(query), params).fetchall()
+        df = run_template(conn, "cohort_time_spent_heatmap", query, params).fetchall()
     result = [dict(row._mapping) for row in df]
     print(f"[COHORT-TIME-SPENT-HEATMAP] 实验 {experiment_name} 查询到 {len(result)} 条记录")
     return result
@@ -1,19 +1,19 @@
 
-from sqlalchemy import text
+from ..sql_templates import run_template
 from datetime import datetime, timedelta
 def fetch_group_cumulative_lt_daily(experiment_name, start_date, end_date, engine):
     """
     查询 [start_date, end_date] 区间内，每一天、每组（variation）的累计 LT（日累计人均时长，单位分钟）。
     字段：event_date, variation_id, cumulative_time_minutes, cumulative_active_users, cumulative_lt
     """
-    query = f"""
+    query = """
       WITH user_variation_map AS (
         SELECT user_id, variation_id FROM (
           SELECT user_id, variation_id,
             ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY event_date ASC) AS rn
           FROM flow_wide_info.tbl_wide_experiment_assignment_hi
-          WHERE experiment_id = '{experiment_name}'
-            AND event_date BETWEEN '{start_date}' AND '{end_date}'
+          WHERE experiment_id = :experiment_name
+            AND event_date BETWEEN :start_date AND :end_date
         ) t WHERE rn = 1
       ),
       session_base AS (
@@ -24,7 +24,7 @@ def fetch_group_cumulative_lt_daily(experiment_name, start_date, end_date, engin
           SUM(s.duration) / 1000 / 60 AS time_minutes
         FROM flow_event_info.tbl_app_session_info s
         JOIN user_variation_map uvm ON s.user_id = uvm.user_id
-        WHERE s.event_date BETWEEN '{start_date}' AND '{end_date}'
+        WHERE s.event_date BETWEEN :start_date AND :end_date
         GROUP BY DATE(s.event_date), s.user_id, uvm.variation_id
       ),
       user_first_active AS (
@@ -64,8 +64,9 @@ def fetch_group_cumulative_lt_daily(experiment_name, start_date, end_date, engin
       ORDER BY t.event_date, t.variation_id
     """
 
+    params = {"experiment_name": experiment_name, "start_date": start_date, "end_date": end_date}
     with engine.connect() as conn:
-        result = conn.execute(text(query)).fetchall()
+        result = run_template(conn, "cumulative_lt", query, params).fetchall()
     all_results = [dict(row._mapping) for row in result]  # 就改这一行！
     print(f"[Cohort Cumulative LT] 实验 {experiment_name}: {len(all_results)} 条记录")
     return all_results
\ No newline at end of file
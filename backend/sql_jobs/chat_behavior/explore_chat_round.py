@@ -1,7 +1,73 @@
-from sqlalchemy import text
 from datetime import datetime, timedelta
 
-def fetch_group_explore_chat_round_samples(experiment_name, start_date, end_date, engine):
+from ..range_query import iter_dicts, rows_to_dicts
+from ..sql_templates import run_template, stream_template
+
+
+def fetch_group_explore_chat_round_samples_range(experiment_name, start_date, end_date, engine, stream=False):
+    """
+    单条 SQL 按 event_date 分组查询整个 [start_date, end_date] 区间，返回结构与按天循环版本一致。
+    """
+    query = '''
+        WITH dedup_assignment AS (
+            SELECT user_id, event_date, variation_id
+            FROM (
+                SELECT *,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY user_id, event_date, experiment_id
+                        ORDER BY variation_id
+                    ) AS rn
+                FROM flow_wide_info.tbl_wide_experiment_assignment_hi
+                WHERE experiment_id = :experiment_name
+            ) t
+            WHERE rn = 1
+        ),
+        first_visit_user AS (
+            SELECT user_id, DATE(first_visit_date) AS first_visit_date
+            FROM flow_wide_info.tbl_wide_user_first_visit_app_info
+        ),
+        chat_data AS (
+            SELECT
+                cs.*,
+                a.variation_id,
+                u.user_id AS new_user_flag,
+                CASE WHEN u.user_id IS NOT NULL AND cs.event_date = u.first_visit_date THEN 1 ELSE 0 END AS is_new_user
+            FROM flow_event_info.tbl_app_event_chat_send cs
+            JOIN dedup_assignment a
+                ON cs.user_id = a.user_id AND cs.event_date = a.event_date
+            LEFT JOIN first_visit_user u
+                ON cs.user_id = u.user_id
+            WHERE cs.event_date BETWEEN :start_date AND :end_date
+            AND cs.source = 'tag:Explore'
+        )
+        SELECT
+            event_date,
+            variation_id AS variation,
+            COUNT(event_id) AS total_chat_rounds,
+            COUNT(DISTINCT user_id) AS unique_users,
+            ROUND(COUNT(distinct event_id) * 1.0 / COUNT(DISTINCT user_id), 2) AS chat_depth_user,
+            ROUND(COUNT(DISTINCT CASE WHEN is_new_user = 1 THEN event_id END) * 1.0 / COUNT(DISTINCT CASE WHEN is_new_user = 1 THEN user_id END), 2) AS chat_depth_user_new,
+            ROUND(COUNT(DISTINCT CASE WHEN is_new_user = 1 THEN event_id END) * 1.0 / (
+                COUNT(DISTINCT prompt_id) * COUNT(DISTINCT CASE WHEN is_new_user = 1 THEN user_id END)
+            ), 4) AS chat_depth_per_user_per_bot_new,
+            :experiment_name AS experiment_name
+        FROM chat_data
+        GROUP BY event_date, variation_id
+        ORDER BY event_date, variation_id;
+    '''
+    params = {"experiment_name": experiment_name, "start_date": start_date, "end_date": end_date}
+    if stream:
+        return iter_dicts(stream_template(engine, "explore_avg_chat_rounds", query, params), "event_date")
+    with engine.connect() as conn:
+        rows = run_template(conn, "explore_avg_chat_rounds", query, params).fetchall()
+    all_results = rows_to_dicts(rows, "event_date")
+    print(f"CLICK: 实验 {experiment_name} 区间单次查询到 {len(all_results)} 条记录")
+    return all_results
+
+
+def fetch_group_explore_chat_round_samples(experiment_name, start_date, end_date, engine, single_query=True, stream=False):
+    if single_query:
+        return fetch_group_explore_chat_round_samples_range(experiment_name, start_date, end_date, engine, stream=stream)
     all_results = []
     start_dt = datetime.strptime(start_date, "%Y-%m-%d")
     end_dt = datetime.strptime(end_date, "%Y-%m-%d")
@@ -10,7 +76,7 @@ def fetch_group_explore_chat_round_samples(experiment_name, start_date, end_date
 
     while current_dt <= end_dt:
         current_date_str = current_dt.strftime("%Y-%m-%d")
-        query = f'''
+        query = '''
       WITH dedup_assignment AS (
             SELECT user_id, event_date, variation_id
             FROM (
@@ -20,7 +86,7 @@ def fetch_group_explore_chat_round_samples(experiment_name, start_date, end_date
                         ORDER BY variation_id
                     ) AS rn
                 FROM flow_wide_info.tbl_wide_experiment_assignment_hi
-                WHERE experiment_id = '{experiment_name}'
+                WHERE experiment_id = :experiment_name
             ) t
             WHERE rn = 1
         ),
@@ -39,11 +105,11 @@ def fetch_group_explore_chat_round_samples(experiment_name, start_date, end_date
                 ON cs.user_id = a.user_id AND cs.event_date = a.event_date
             LEFT JOIN first_visit_user u
                 ON cs.user_id = u.user_id
-            WHERE cs.event_date = '{current_date_str}'
+            WHERE cs.event_date = :current_date
             AND cs.source = 'tag:Explore'
         )
         SELECT
-            '{current_date_str}' AS event_date,
+            :current_date AS event_date,
             variation_id AS variation,
             COUNT(event_id) AS total_chat_rounds,
             COUNT(DISTINCT user_id) AS unique_users,
@@ -52,12 +118,12 @@ def fetch_group_explore_chat_round_samples(experiment_name, start_date, end_date
             ROUND(COUNT(DISTINCT CASE WHEN is_new_user = 1 THEN event_id END) * 1.0 / (
                 COUNT(DISTINCT prompt_id) * COUNT(DISTINCT CASE WHEN is_new_user = 1 THEN user_id END)
             ), 4) AS chat_depth_per_user_per_bot_new,
-            '{experiment_name}' AS experiment_name
+            :experiment_name AS experiment_name
         FROM chat_data
         GROUP BY variation_id;
         '''
         with engine.connect() as conn:
-            day_result = conn.execute(text(query)).fetchall()
+            day_result = run_template(conn, "explore_avg_chat_rounds", query, {"experiment_name": experiment_name, "current_date": current_date_str}).fetchall()
         for row in day_result:
             row_dict = dict(row) if not hasattr(row, '_asdict') else row._asdict()
             row_dict['event_date'] = current_date_str
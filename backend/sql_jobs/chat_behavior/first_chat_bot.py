@@ -1,6 +1,6 @@
-from sqlalchemy import text
+from ..sql_templates import run_template, stream_template
 
-def fetch_group_explore_chat_start_rate_samples(experiment_name, start_date, end_date, engine):
+def fetch_group_explore_chat_start_rate_samples(experiment_name, start_date, end_date, engine, stream=False):
     query = '''
 
                 WITH dedup_assignment AS (
@@ -12,17 +12,17 @@ def fetch_group_explore_chat_start_rate_samples(experiment_name, start_date, end
                             ORDER BY timestamp_assigned
                         ) AS rn
                     FROM flow_wide_info.tbl_wide_experiment_assignment_hi
-                    WHERE experiment_id = '{experiment_name}'
+                    WHERE experiment_id = :experiment_name
                 ) t
                 WHERE rn = 1
             ),
             new_user AS (
-                SELECT user_id
+                SELECT user_id, DATE(first_visit_date) AS first_visit_date
                 FROM flow_wide_info.tbl_wide_user_first_visit_app_info
-                WHERE DATE(first_visit_date) = '{current_date}'
+                WHERE DATE(first_visit_date) BETWEEN :start_date AND :end_date
             )
             SELECT
-                '{current_date}' AS event_date,
+                c.event_date AS event_date,
                 d.variation_id AS variation_id,
                 COUNT(DISTINCT CONCAT(c.user_id, '_', c.prompt_id)) AS total_click,
                 COUNT(DISTINCT c.user_id) AS total_user,
@@ -37,15 +37,16 @@ def fetch_group_explore_chat_start_rate_samples(experiment_name, start_date, end
             JOIN dedup_assignment d
               ON c.user_id = d.user_id AND c.event_date = d.event_date
             LEFT JOIN new_user n
-              ON c.user_id = n.user_id
-            WHERE c.event_date = '{current_date}'
-            GROUP BY d.variation_id
+              ON c.user_id = n.user_id AND c.event_date = n.first_visit_date
+            WHERE c.event_date BETWEEN :start_date AND :end_date
+            GROUP BY c.event_date, d.variation_id
+            ORDER BY c.event_date, d.variation_id
     '''
+    params = {"experiment_name": experiment_name, "start_date": start_date, "end_date": end_date}
+    if stream:
+        return stream_template(engine, "first_chat_bot", query, params)
     with engine.connect() as conn:
-        df = conn.execute(
-            text(query),
-            {"experiment_name": experiment_name, "start_date": start_date, "end_date": end_date}
-        ).fetchall()
+        df = run_template(conn, "first_chat_bot", query, params).fetchall()
     print(f"CLICK: 实验 {experiment_name} 查询到 {len(df)} 条记录")
     return df
 
@@ -1,7 +1,74 @@
-from sqlalchemy import text
 from datetime import datetime, timedelta
 
-def fetch_group_time_spend_samples(experiment_name, start_date, end_date, engine):
+from ..range_query import iter_dicts, rows_to_dicts
+from ..sql_templates import run_template, stream_template
+
+
+def fetch_group_time_spend_samples_range(experiment_name, start_date, end_date, engine, stream=False):
+    """
+    单条 SQL 按 event_date 分组查询整个 [start_date, end_date] 区间，返回结构与按天循环版本一致。
+    """
+    query = """
+        WITH session_agg AS (
+            SELECT
+                DATE(event_date) AS event_date,
+                user_id,
+                ROUND(SUM(duration) / 1000 / 60, 2) AS total_time_minutes
+            FROM flow_event_info.tbl_app_session_info
+            WHERE DATE(event_date) BETWEEN :start_date AND :end_date
+            GROUP BY DATE(event_date), user_id
+        ),
+        experiment_var AS (
+            SELECT user_id, event_date, variation_id
+            FROM (
+                SELECT
+                    user_id,
+                    event_date,
+                    variation_id,
+                    ROW_NUMBER() OVER (PARTITION BY user_id, event_date ORDER BY event_date) AS rn
+                FROM flow_wide_info.tbl_wide_experiment_assignment_hi
+                WHERE experiment_id = :experiment_name
+                  AND event_date BETWEEN :start_date AND :end_date
+            ) t
+            WHERE rn = 1
+        ),
+        new_users AS (
+            SELECT user_id, DATE(first_visit_date) AS first_visit_date
+            FROM flow_wide_info.tbl_wide_user_first_visit_app_info
+            WHERE DATE(first_visit_date) BETWEEN :start_date AND :end_date
+        )
+        SELECT
+            sa.event_date,
+            ev.variation_id AS variation,
+            SUM(sa.total_time_minutes) AS total_time_minutes,
+            COUNT(DISTINCT sa.user_id) AS unique_users,
+            ROUND(SUM(sa.total_time_minutes) / NULLIF(COUNT(DISTINCT sa.user_id), 0), 2) AS avg_time_spent_minutes,
+            SUM(CASE WHEN nu.user_id IS NOT NULL THEN sa.total_time_minutes ELSE 0 END) AS new_user_total_time_minutes,
+            COUNT(DISTINCT CASE WHEN nu.user_id IS NOT NULL THEN sa.user_id END) AS new_user_count,
+            ROUND(
+                SUM(CASE WHEN nu.user_id IS NOT NULL THEN sa.total_time_minutes ELSE 0 END)
+                / NULLIF(COUNT(DISTINCT CASE WHEN nu.user_id IS NOT NULL THEN sa.user_id END), 0), 2
+            ) AS new_user_avg_time_spent_minutes,
+            :experiment_name AS experiment_name
+        FROM session_agg sa
+        JOIN experiment_var ev ON sa.user_id = ev.user_id AND sa.event_date = ev.event_date
+        LEFT JOIN new_users nu ON sa.user_id = nu.user_id AND sa.event_date = nu.first_visit_date
+        GROUP BY sa.event_date, ev.variation_id
+        ORDER BY sa.event_date, ev.variation_id;
+    """
+    params = {"experiment_name": experiment_name, "start_date": start_date, "end_date": end_date}
+    if stream:
+        return iter_dicts(stream_template(engine, "avg_time_spent", query, params), "event_date")
+    with engine.connect() as conn:
+        rows = run_template(conn, "avg_time_spent", query, params).fetchall()
+    all_results = rows_to_dicts(rows, "event_date")
+    print(f"CLICK: 实验 {experiment_name} 区间单次查询到 {len(all_results)} 条记录")
+    return all_results
+
+
+def fetch_group_time_spend_samples(experiment_name, start_date, end_date, engine, single_query=True, stream=False):
+    if single_query:
+        return fetch_group_time_spend_samples_range(experiment_name, start_date, end_date, engine, stream=stream)
     all_results = []
     start_dt = datetime.strptime(start_date, "%Y-%m-%d")
     end_dt = datetime.strptime(end_date, "%Y-%m-%d")
@@ -10,14 +77,14 @@ def fetch_group_time_spend_samples(experiment_name, start_date, end_date, engine
 
     while current_dt <= end_dt:
         current_date_str = current_dt.strftime("%Y-%m-%d")
-        query = f"""
+        query = """
   WITH session_agg AS (
             SELECT
                 DATE(event_date) AS event_date,                                 
                 user_id,                                      
                 ROUND(SUM(duration) / 1000 / 60, 2) AS total_time_minutes  
             FROM flow_event_info.tbl_app_session_info
-            WHERE DATE(event_date) = '{current_date_str}'
+            WHERE DATE(event_date) = :current_date
             GROUP BY DATE(event_date), user_id
         ),
         experiment_var AS (
@@ -28,15 +95,15 @@ def fetch_group_time_spend_samples(experiment_name, start_date, end_date, engine
                     variation_id,
                     ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY event_date) AS rn
                 FROM flow_wide_info.tbl_wide_experiment_assignment_hi
-                WHERE experiment_id = '{experiment_name}'
-                  AND event_date = '{current_date_str}'
+                WHERE experiment_id = :experiment_name
+                  AND event_date = :current_date
             ) t
             WHERE rn = 1
         ),
         new_users AS (
             SELECT user_id
             FROM flow_wide_info.tbl_wide_user_first_visit_app_info
-            WHERE DATE(first_visit_date) = '{current_date_str}'
+            WHERE DATE(first_visit_date) = :current_date
         )
         SELECT
             sa.event_date,
@@ -50,7 +117,7 @@ def fetch_group_time_spend_samples(experiment_name, start_date, end_date, engine
                 SUM(CASE WHEN nu.user_id IS NOT NULL THEN sa.total_time_minutes ELSE 0 END) 
                 / NULLIF(COUNT(DISTINCT CASE WHEN nu.user_id IS NOT NULL THEN sa.user_id END), 0), 2
             ) AS new_user_avg_time_spent_minutes,
-            '{experiment_name}' AS experiment_name
+            :experiment_name AS experiment_name
         FROM session_agg sa
         JOIN experiment_var ev ON sa.user_id = ev.user_id
         LEFT JOIN new_users nu ON sa.user_id = nu.user_id
@@ -60,7 +127,7 @@ def fetch_group_time_spend_samples(experiment_name, start_date, end_date, engine
 
     """
         with engine.connect() as conn:
-            day_result = conn.execute(text(query)).fetchall()
+            day_result = run_template(conn, "avg_time_spent", query, {"experiment_name": experiment_name, "current_date": current_date_str}).fetchall()
         for row in day_result:
             row_dict = dict(row) if not hasattr(row, '_asdict') else row._asdict()
             row_dict['event_date'] = current_date_str
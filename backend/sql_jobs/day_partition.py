@@ -0,0 +1,90 @@
+# backend/sql_jobs/day_partition.py
+"""
+按天 / 按周切分日期区间，并发执行“必须按天查”的 fetcher。
+
+有些 fetcher 的单日 SQL 里用了 DATE_ADD(current_date, INTERVAL n DAY) 这类按天偏移的 join，
+不方便改成一条区间 SQL。这里把 [start_date, end_date] 切成若干分区，
+放进有上限的线程池里并发跑（每个分区各自从连接池取连接），最后按日期顺序合并结果，
+返回结构和原来的串行 while 循环完全一致。
+
+按天执行的 fetcher 用 @execution_mode(...) 标明自己的执行方式，preflight 据此估算 SQL 条数，
+不看函数签名（有的 fetcher 串行按天循环，却没有 partition 参数）。
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from ..utils.admission import admit, share_admission
+
+# 单个请求内同时在跑的分区数上限，避免一个长实验把数仓连接占满
+DEFAULT_MAX_WORKERS = int(os.environ.get("DAY_PARTITION_MAX_WORKERS", "4"))
+
+
+# fetcher 的执行方式：
+# "partitioned" 每天一条 SQL，分区间并发（run_day_partitions）；
+# "serial" 每天一条 SQL，在 Python 里串行循环；
+# "range" 整个区间一条 SQL（没有标记的 fetcher 都按这个处理）
+EXECUTION_MODES = ("partitioned", "serial", "range")
+
+
+def execution_mode(mode):
+    """标记 fetcher 的执行方式，见 EXECUTION_MODES。"""
+    if mode not in EXECUTION_MODES:
+        raise ValueError(f"未知的执行方式: {mode}")
+
+    def decorate(fetch_func):
+        fetch_func.execution_mode = mode
+        return fetch_func
+    return decorate
+
+
+def iter_days(start_date, end_date):
+    """按天产出 [start_date, end_date] 内的 'YYYY-MM-DD'。"""
+    current_dt = datetime.strptime(start_date, "%Y-%m-%d")
+    end_dt = datetime.strptime(end_date, "%Y-%m-%d")
+    while current_dt <= end_dt:
+        yield current_dt.strftime("%Y-%m-%d")
+        current_dt += timedelta(days=1)
+
+
+def split_date_range(start_date, end_date, partition="day"):
+    """
+    把区间切成分区列表，每个分区是一组按顺序排列的日期字符串。
+    partition: "day" 每天一个分区；"week" 每 7 天一个分区。
+    """
+    days = list(iter_days(start_date, end_date))
+    if partition == "day":
+        return [[d] for d in days]
+    if partition == "week":
+        return [days[i:i + 7] for i in range(0, len(days), 7)]
+    raise ValueError(f"未知的分区粒度: {partition}")
+
+
+def _run_partition(fetch_day, days):
+    rows = []
+    for day in days:
+        rows.extend(fetch_day(day))
+    return rows
+
+
+def run_day_partitions(fetch_day, start_date, end_date, partition="day", max_workers=None, experiment_name=None):
+    """
+    fetch_day(current_date_str) -> 当天的行列表。
+    分区之间并发、分区内部按天串行，结果按日期顺序拼接；任一分区报错会直接抛出。
+    整个 fetch 只占 experiment_name 的一个数仓准入名额，分区线程共用（并发由 max_workers 控制）。
+    """
+    partitions = split_date_range(start_date, end_date, partition)
+    if not partitions:
+        return []
+    workers = max(1, min(max_workers or DEFAULT_MAX_WORKERS, len(partitions)))
+    with admit(experiment_name):
+        if workers == 1:
+            return _run_partition(fetch_day, [d for days in partitions for d in days])
+
+        run_partition = share_admission(_run_partition)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="day-partition") as pool:
+            futures = [pool.submit(run_partition, fetch_day, days) for days in partitions]
+            all_results = []
+            for future in futures:
+                all_results.extend(future.result())
+    return all_results
@@ -0,0 +1,204 @@
+# backend/sql_jobs/query_planner.py
+"""
+合并取数：共用同一批底表的指标一条 SQL 查完。
+
+all_bayesian / all_category_all_metrics 按指标逐个调 fetch_func，
+engagement 的 6 个指标各扫一遍 tbl_app_event_chat_send（或 follow / reset 表）和实验分组表，
+chat 类的 avg_chat_rounds / explore_avg_chat_rounds 更是同一条 SQL 跑两次。
+
+这里按指标名把请求的指标分组（PLAN_GROUPS），同一组里请求了 2 个及以上时：
+- engagement：底表和各指标用到的分组去重 CTE 只写一次（去重口径相同的指标共用一个 CTE），
+  每个指标一个 UNION ALL 分支，结果按 metric 列拆回各自原来的行结构；
+- chat_rounds：两个指标的 SQL 完全一致，只查一次，两个指标共用结果。
+分组去重口径保持各指标原样（有的按 (user, date) 取最早，有的按 user 取最新），只合并扫描，不改数值。
+"""
+from .chat_behavior.Chat_round import fetch_group_chat_round_samples_range
+from .range_query import normalize_date, row_to_dict
+from .sql_templates import run_template
+
+# 各指标用到的实验分组去重 CTE（和原 fetcher 里的 dedup_assign 一致）
+_ASSIGNMENT_CTES = {
+    # Continue：每个 (user, date) 取 timestamp_assigned 最早的一条
+    "assign_day_first": """
+        SELECT user_id, variation_id, event_date
+        FROM (
+            SELECT user_id, variation_id, event_date,
+                   ROW_NUMBER() OVER (PARTITION BY user_id, event_date ORDER BY timestamp_assigned ASC) AS rn
+            FROM flow_wide_info.tbl_wide_experiment_assignment_hi
+            WHERE experiment_id = :experiment_name
+        ) t
+        WHERE rn = 1 AND event_date BETWEEN :start_date AND :end_date""",
+    # Conversation_Reset：每个 (user, date) 取 timestamp_assigned 最晚的一条
+    "assign_day_last": """
+        SELECT user_id, variation_id, event_date
+        FROM (
+            SELECT user_id, variation_id, event_date,
+                   ROW_NUMBER() OVER (PARTITION BY user_id, event_date ORDER BY timestamp_assigned DESC) AS rn
+            FROM flow_wide_info.tbl_wide_experiment_assignment_hi
+            WHERE experiment_id = :experiment_name
+        ) t
+        WHERE rn = 1 AND event_date BETWEEN :start_date AND :end_date""",
+    # Edit：每个 (user, date) 任取一条（和事件按 event_date 关联，区间外的分组本来就用不到）
+    "assign_day_any": """
+        SELECT user_id, variation_id, event_date
+        FROM (
+            SELECT user_id, variation_id, event_date,
+                   ROW_NUMBER() OVER (PARTITION BY user_id, event_date ORDER BY event_date DESC) AS rn
+            FROM flow_wide_info.tbl_wide_experiment_assignment_hi
+            WHERE experiment_id = :experiment_name
+        ) t
+        WHERE rn = 1 AND event_date BETWEEN :start_date AND :end_date""",
+    # Regen / Follow：每个 user 取最近一天的分组，只按 user 关联
+    "assign_user_latest": """
+        SELECT user_id, variation_id
+        FROM (
+            SELECT user_id, variation_id, event_date,
+                   ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY event_date DESC) AS rn
+            FROM flow_wide_info.tbl_wide_experiment_assignment_hi
+            WHERE experiment_id = :experiment_name
+        ) t
+        WHERE rn = 1""",
+    # New_Conversation：区间内 (user, variation, date) 去重
+    "assign_day_distinct": """
+        SELECT DISTINCT user_id, variation_id, event_date
+        FROM flow_wide_info.tbl_wide_experiment_assignment_hi
+        WHERE experiment_id = :experiment_name
+          AND event_date BETWEEN :start_date AND :end_date""",
+}
+
+# 事件底表，区间内只扫一遍
+_SOURCE_CTES = {
+    "chat_send": """
+        SELECT user_id, event_date, event_id, conversation_id, Method
+        FROM flow_event_info.tbl_app_event_chat_send
+        WHERE event_date BETWEEN :start_date AND :end_date""",
+    "bot_follow": """
+        SELECT user_id, event_date, event_id
+        FROM flow_event_info.tbl_app_event_bot_follow
+        WHERE event_date BETWEEN :start_date AND :end_date""",
+    "conversation_reset_event": """
+        SELECT user_id, event_date, event_id
+        FROM flow_event_info.tbl_app_event_conversation_reset
+        WHERE event_date BETWEEN :start_date AND :end_date""",
+}
+
+# 指标 -> (分组 CTE, 事件 CTE, 事件过滤条件, 计数字段, 是否按 event_date 关联分组, 原结果是否带 experiment_name 列)
+# 输出字段统一是 total_{metric} / unique_{metric}_users / {metric}_ratio
+ENGAGEMENT_METRICS = {
+    "continue": ("assign_day_first", "chat_send", "e.Method = 'continue'", "event_id", True, True),
+    "edit": ("assign_day_any", "chat_send", "e.Method = 'edit'", "event_id", True, True),
+    "regen": ("assign_user_latest", "chat_send", "e.Method = 'regenerate'", "event_id", False, True),
+    "new_conversation": ("assign_day_distinct", "chat_send", None, "conversation_id", True, True),
+    "follow": ("assign_user_latest", "bot_follow", None, "event_id", False, False),
+    "conversation_reset": ("assign_day_last", "conversation_reset_event", None, "event_id", True, False),
+}
+
+# 同一组指标 SQL 完全一致，查一次共用
+CHAT_ROUND_METRICS = ("avg_chat_rounds", "explore_avg_chat_rounds")
+
+
+def _engagement_branch(metric):
+    assign_cte, source_cte, condition, count_field, join_date, _ = ENGAGEMENT_METRICS[metric]
+    join_on = "e.user_id = a.user_id" + (" AND e.event_date = a.event_date" if join_date else "")
+    where = f"\n        WHERE {condition}" if condition else ""
+    return f"""
+        SELECT
+            '{metric}' AS metric,
+            e.event_date AS event_date,
+            a.variation_id AS variation,
+            COUNT(DISTINCT e.{count_field}) AS total_cnt,
+            COUNT(DISTINCT e.user_id) AS user_cnt,
+            CASE
+                WHEN COUNT(DISTINCT e.user_id) = 0 THEN 0
+                ELSE ROUND(COUNT(DISTINCT e.{count_field}) * 1.0 / COUNT(DISTINCT e.user_id), 4)
+            END AS ratio
+        FROM {source_cte} e
+        JOIN {assign_cte} a ON {join_on}{where}
+        GROUP BY e.event_date, a.variation_id"""
+
+
+def build_engagement_sql(metrics):
+    """按请求的指标拼一条 SQL：只带用到的分组 / 事件 CTE，每个指标一个 UNION ALL 分支。"""
+    metrics = [m for m in ENGAGEMENT_METRICS if m in metrics]
+    cte_names = []
+    for metric in metrics:
+        assign_cte, source_cte = ENGAGEMENT_METRICS[metric][:2]
+        for name in (assign_cte, source_cte):
+            if name not in cte_names:
+                cte_names.append(name)
+    ctes = ",\n".join(
+        f"{name} AS ({_ASSIGNMENT_CTES.get(name) or _SOURCE_CTES[name]}\n)" for name in cte_names
+    )
+    branches = "\n        UNION ALL".join(_engagement_branch(m) for m in metrics)
+    return f"WITH {ctes}\n{branches}\n        ORDER BY metric, event_date, variation"
+
+
+def fetch_engagement_group(experiment_name, start_date, end_date, engine, metrics):
+    """
+    engagement 指标合并查询，返回 {metric: rows}，每个指标的行结构和原 fetcher 一致：
+    event_date / variation / total_{metric} / unique_{metric}_users / {metric}_ratio（原来带 experiment_name 的照样带上）。
+    """
+    metrics = [m for m in ENGAGEMENT_METRICS if m in metrics]
+    query = build_engagement_sql(metrics)
+    params = {"experiment_name": experiment_name, "start_date": start_date, "end_date": end_date}
+    # 不同指标组合的 SQL 文本不同，同名模板下按组合各注册一个变体
+    with engine.connect() as conn:
+        rows = run_template(conn, "engagement_group", query, params).fetchall()
+
+    results = {metric: [] for metric in metrics}
+    for row in rows:
+        row_dict = row_to_dict(row)
+        metric = row_dict["metric"]
+        out = {
+            "event_date": normalize_date(row_dict["event_date"]),
+            "variation": row_dict["variation"],
+            f"total_{metric}": row_dict["total_cnt"],
+            f"unique_{metric}_users": row_dict["user_cnt"],
+            f"{metric}_ratio": row_dict["ratio"],
+        }
+        if ENGAGEMENT_METRICS[metric][5]:
+            out["experiment_name"] = experiment_name
+        results[metric].append(out)
+    print(f"PLANNER: 实验 {experiment_name} engagement {len(metrics)} 个指标单次查询到 {len(rows)} 条记录")
+    return results
+
+
+def fetch_chat_round_group(experiment_name, start_date, end_date, engine, metrics):
+    rows = fetch_group_chat_round_samples_range(experiment_name, start_date, end_date, engine)
+    return {metric: rows for metric in CHAT_ROUND_METRICS if metric in metrics}
+
+
+# 组名 -> (组内指标, 合并取数函数)
+PLAN_GROUPS = {
+    "engagement": (tuple(ENGAGEMENT_METRICS), fetch_engagement_group),
+    "chat_rounds": (CHAT_ROUND_METRICS, fetch_chat_round_group),
+}
+
+
+def plan(metrics):
+    """
+    返回 [(组名, [组内被请求的指标])]，只包含请求了 2 个及以上指标的组；
+    组外或组里只请求了 1 个的指标不在计划里，调用方照常逐个 fetch。
+    """
+    requested = set(metrics)
+    planned = []
+    for group, (members, _) in PLAN_GROUPS.items():
+        hit = [m for m in members if m in requested]
+        if len(hit) >= 2:
+            planned.append((group, hit))
+    return planned
+
+
+def fetch_planned(metrics, experiment_name, start_date, end_date, engine):
+    """
+    按 plan() 合并取数，返回 {metric: rows}（rows 只读，同组指标可能共用同一个列表）。
+    某一组查询失败时打印日志并跳过，该组指标由调用方退回逐个 fetch。
+    """
+    results = {}
+    for group, hit in plan(metrics):
+        fetch_group = PLAN_GROUPS[group][1]
+        try:
+            results.update(fetch_group(experiment_name, start_date, end_date, engine, hit))
+        except Exception as e:
+            print(f"[PLANNER] {group} 合并查询失败，退回逐个指标查询: {e}")
+    return results
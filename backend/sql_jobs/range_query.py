@@ -0,0 +1,58 @@
+# backend/sql_jobs/range_query.py
+"""
+多天区间查询的公共工具。
+
+原来按天循环的 fetcher（每天一条 SQL）改成整段 [start_date, end_date] 一条 SQL、
+按 event_date 分组后，用这里的日期序列 CTE 和行转换函数，保证返回结构和按天循环版本一致：
+每行一个 dict，日期字段统一成 'YYYY-MM-DD' 字符串，按日期升序。
+"""
+from datetime import date, datetime
+
+# 生成 [:start_date, :end_date] 的日期序列（最多 1000 天），写法与 Retention/cul_retention.py 一致。
+# 用法：WITH {DATE_SERIES_CTE}, other_cte AS (...)
+DATE_SERIES_CTE = """
+    date_series AS (
+        SELECT DATE(DATE_ADD(:start_date, INTERVAL seq.seq DAY)) AS event_date FROM (
+            SELECT (HUNDREDS.digit * 100 + TENS.digit * 10 + ONES.digit) AS seq FROM
+            (SELECT 0 AS digit UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7 UNION ALL SELECT 8 UNION ALL SELECT 9) ONES
+            CROSS JOIN (SELECT 0 AS digit UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7 UNION ALL SELECT 8 UNION ALL SELECT 9) TENS
+            CROSS JOIN (SELECT 0 AS digit UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7 UNION ALL SELECT 8 UNION ALL SELECT 9) HUNDREDS
+        ) seq WHERE DATE_ADD(:start_date, INTERVAL seq.seq DAY) <= :end_date
+    )"""
+
+
+def normalize_date(value):
+    """date / datetime / 字符串统一成 'YYYY-MM-DD'，None 原样返回。"""
+    if value is None:
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.strftime("%Y-%m-%d")
+    return str(value)[:10]
+
+
+def row_to_dict(row):
+    """SQLAlchemy Row / RowProxy / dict 统一转 dict。"""
+    if isinstance(row, dict):
+        return dict(row)
+    if hasattr(row, "_mapping"):
+        return dict(row._mapping)
+    if hasattr(row, "_asdict"):
+        return row._asdict()
+    return dict(row)
+
+
+def iter_dicts(rows, date_field="event_date"):
+    """rows_to_dicts 的惰性版本，配合流式游标逐行转换。"""
+    for row in rows:
+        row_dict = row_to_dict(row)
+        if date_field in row_dict:
+            row_dict[date_field] = normalize_date(row_dict[date_field])
+        yield row_dict
+
+
+def rows_to_dicts(rows, date_field="event_date"):
+    """
+    把一条多天 SQL 的结果转成和按天循环版本相同的行结构：
+    dict 列表，date_field 统一成 'YYYY-MM-DD' 字符串。
+    """
+    return list(iter_dicts(rows, date_field))
@@ -0,0 +1,142 @@
+# backend/sql_jobs/sql_templates.py
+"""
+SQL 模板注册表。
+
+所有 fetcher 的 SQL 文本都只包含 :param 绑定参数（实验名、日期等不再拼进字符串），
+同一个模板在进程内只创建一次 TextClause，语句文本稳定，
+SQLAlchemy 的 compiled cache 和数仓侧的计划缓存都能复用。
+
+run_template(conn, name, sql, params) 代替 conn.execute(text(sql), params)；
+name 一般就是指标 / fetcher 名，template_stats() 按 name 汇总编译和执行的次数与耗时，给压测脚本用。
+stream_template(engine, name, sql, params) 是流式版本：服务端游标（pymysql SSCursor）逐批产出行。
+两者执行前都要过 utils/admission.py 的准入控制（按 params 里的 experiment_name 计单实验并发）。
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import text
+
+from ..utils.admission import admit
+
+_templates = {}  # (name, sql) -> SqlTemplate
+_latest_range = {}  # name -> 最近一次用到的区间模板（给 preflight 的 EXPLAIN 用；按天的变体不记）
+_templates_lock = threading.Lock()
+
+# 流式读取时每次从服务端游标拉取的行数
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", "1000"))
+
+_stats = defaultdict(lambda: {
+    "templates": 0,
+    "compile_count": 0,
+    "compile_seconds": 0.0,
+    "execute_count": 0,
+    "execute_seconds": 0.0,
+})
+_stats_lock = threading.Lock()
+
+
+class SqlTemplate:
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        self.clause = text(sql)
+        self.compiled_dialects = set()
+        # 整个区间一条 SQL 的模板（按 :start_date / :end_date 查，不是按天的 :current_date）
+        self.is_range = ":start_date" in sql and ":current_date" not in sql
+
+
+def get_template(name, sql):
+    """同一 (name, sql) 在进程内只注册一次；同一 name 下可以有多个变体（比如留存的 D1/D3/D7/D15）。"""
+    key = (name, sql)
+    template = _templates.get(key)
+    if template is not None:
+        if template.is_range:
+            _latest_range[name] = template
+        return template
+    with _templates_lock:
+        template = _templates.get(key)
+        if template is None:
+            template = SqlTemplate(name, sql)
+            _templates[key] = template
+            with _stats_lock:
+                _stats[name]["templates"] += 1
+        if template.is_range:
+            _latest_range[name] = template
+    return template
+
+
+def latest_range_template(name):
+    """name 下最近一次执行过的区间模板；本进程还没执行过（或只跑过按天的变体）时返回 None。"""
+    return _latest_range.get(name)
+
+
+def _record(name, kind, seconds):
+    with _stats_lock:
+        _stats[name][f"{kind}_count"] += 1
+        _stats[name][f"{kind}_seconds"] += seconds
+
+
+def _ensure_compiled(template, conn):
+    dialect = getattr(conn, "dialect", None)
+    if dialect is not None and dialect.name not in template.compiled_dialects:
+        start = time.perf_counter()
+        template.clause.compile(dialect=dialect)
+        template.compiled_dialects.add(dialect.name)
+        _record(template.name, "compile", time.perf_counter() - start)
+
+
+def run_template(conn, name, sql, params=None):
+    """
+    执行模板，返回和 conn.execute 一样的结果对象。
+    某个方言第一次用到该模板时单独编译一次并计时（之后命中 SQLAlchemy 的 compiled cache）。
+    """
+    template = get_template(name, sql)
+    _ensure_compiled(template, conn)
+
+    params = params or {}
+    with admit(params.get("experiment_name")):
+        start = time.perf_counter()
+        result = conn.execute(template.clause, params)
+        _record(name, "execute", time.perf_counter() - start)
+    return result
+
+
+def stream_template(engine, name, sql, params=None, batch_size=None):
+    """
+    生成器：用服务端游标（stream_results，pymysql 下即 SSCursor）执行模板，按 batch_size 一批批取行并逐行产出，
+    结果集不会整体缓存在客户端。连接在迭代结束（或生成器被关闭）时释放；
+    未读完就中断时会关闭游标，同一连接之后还能继续执行别的语句。
+    execute 耗时只统计到服务端开始返回结果为止。
+    """
+    template = get_template(name, sql)
+    batch_size = batch_size or STREAM_BATCH_SIZE
+    params = params or {}
+    # 名额一直占到结果读完：服务端游标在读完之前都还在数仓上执行
+    with admit(params.get("experiment_name")), engine.connect() as conn:
+        _ensure_compiled(template, conn)
+        start = time.perf_counter()
+        # 只对这一条语句开服务端游标，不改变连接本身的 execution_options
+        result = conn.execute(template.clause, params, execution_options={"stream_results": True})
+        _record(name, "execute", time.perf_counter() - start)
+        try:
+            while True:
+                batch = result.fetchmany(batch_size)
+                if not batch:
+                    break
+                for row in batch:
+                    yield row
+        finally:
+            result.close()
+
+
+def template_stats():
+    """{name: {templates, compile_count, compile_seconds, execute_count, execute_seconds}}"""
+    with _stats_lock:
+        return {name: dict(values) for name, values in _stats.items()}
+
+
+def reset_template_stats():
+    with _stats_lock:
+        _stats.clear()
@@ -0,0 +1,74 @@
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pandas")
+
+from backend.utils.columnar import group_by_variation, pivot_by_date, rows_to_columns, to_list
+
+CFG = {"value_field": 2, "revenue_field": 3, "order_field": 4}
+
+
+def test_rows_to_columns_converts_numeric_fields():
+    rows = [("a", "2024-01-01", Decimal("1.5"), None, 2), ("b", "2024-01-02", None, Decimal("3"), None)]
+    columns = rows_to_columns(iter(rows), CFG)
+    assert list(columns["variation_field"]) == ["a", "b"]
+    assert columns["value_field"].dtype == np.float64
+    assert columns["value_field"][0] == 1.5
+    assert np.isnan(columns["value_field"][1])
+    assert np.isnan(columns["revenue_field"][0])
+    assert columns["order_field"][0] == 2.0
+
+
+def test_rows_to_columns_with_named_fields():
+    cfg = {"variation_field": "variation", "date_field": "event_date", "value_field": "v",
+           "revenue_field": "r", "order_field": "o"}
+    rows = [{"variation": "a", "event_date": "2024-01-01", "v": 1, "r": 2, "o": 3}, {"variation": "b"}]
+    columns = rows_to_columns(rows, cfg)
+    assert list(columns["variation_field"]) == ["a", "b"]
+    assert columns["value_field"][0] == 1.0
+    # 缺字段的行按 getval 口径当作 None
+    assert np.isnan(columns["value_field"][1])
+
+
+def test_rows_to_columns_empty():
+    columns = rows_to_columns([], CFG)
+    assert all(len(values) == 0 for values in columns.values())
+    assert group_by_variation(columns) == []
+
+
+def test_group_by_variation_matches_dict_loop():
+    rows = [
+        ("b", "2024-01-01", 1.0, 10.0, 1),
+        ("a", "2024-01-01", 2.0, None, 2),
+        ("b", "2024-01-02", 3.0, 5.0, None),
+        ("a", "2024-01-02", None, 100.0, 100),  # value 为空的行整行丢掉
+        (None, "2024-01-02", 9.0, 9.0, 9),  # 没有 variation 的行丢掉
+    ]
+    groups = group_by_variation(rows_to_columns(rows, CFG))
+    # 首次出现顺序
+    assert [g[0] for g in groups] == ["b", "a"]
+    variation, values, revenue, order = groups[0]
+    assert values.tolist() == [1.0, 3.0]
+    assert revenue == 15.0
+    assert order == 1
+    assert groups[1][1].tolist() == [2.0]
+    assert groups[1][2] == 0.0
+    assert groups[1][3] == 2
+
+
+def test_pivot_by_date_sorts_dates_and_keeps_last_row():
+    rows = [
+        ("a", "2024-01-02", 1.0, 1.0, 1),
+        ("b", date(2024, 1, 1), 2.0, 2.0, 2),
+        ("a", "2024-01-01 00:00:00", 3.0, 3.0, 3),
+        ("a", "2024-01-02", 4.0, 4.0, 4),  # 同一格后出现的覆盖前面的
+    ]
+    pivot = pivot_by_date(rows_to_columns(rows, CFG))
+    assert pivot["dates"] == ["2024-01-01", "2024-01-02"]
+    assert pivot["variations"] == ["a", "b"]
+    assert to_list(pivot["value"][0]) == [3.0, 4.0]
+    assert to_list(pivot["value"][1]) == [2.0, None]
+    assert to_list(pivot["order"][1], fill=0, as_int=True) == [2, 0]
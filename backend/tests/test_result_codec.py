@@ -0,0 +1,96 @@
+import json
+import math
+
+import pytest
+
+from backend.utils import result_codec
+from backend.utils.response_body import render_body
+
+
+def _bayesian_result():
+    samples = [0.1 * i for i in range(1000)]
+    samples[3] = None
+    return {
+        "groups": [{
+            "group": "control",
+            "mean": 1.5,
+            "std": None,
+            "n": 1000,
+            "posterior_samples": samples,
+            "credible_interval": [0.2, 0.8],
+            "total_order": 12,
+        }],
+        "distribution": {"control": [float(i) for i in range(40)]},
+        "order": list(range(40)),
+    }
+
+
+def test_binary_round_trip():
+    result = _bayesian_result()
+    raw = result_codec.encode_result(result)
+    assert raw[:3] == result_codec.MAGIC
+    assert raw[3] == result_codec.VERSION
+    decoded = result_codec.decode_result(raw)
+
+    group = decoded["groups"][0]
+    assert group["group"] == "control"
+    assert group["std"] is None
+    assert group["credible_interval"] == [0.2, 0.8]
+    # posterior_samples 按 float32 存，只保证统计精度
+    assert len(group["posterior_samples"]) == 1000
+    assert all(
+        math.isclose(a, b, rel_tol=1e-6, abs_tol=1e-6)
+        for a, b in zip(group["posterior_samples"], result["groups"][0]["posterior_samples"])
+        if a is not None
+    )
+    # 其余 float 列表按 float64 存，原样还原
+    assert decoded["distribution"] == result["distribution"]
+    # 含 int 的列表不打包，类型不变
+    assert decoded["order"] == result["order"]
+    assert all(type(v) is int for v in decoded["order"])
+
+
+def test_binary_none_and_nan_decode_to_none():
+    values = [1.0] * 20
+    values[0] = None
+    values[1] = float("nan")
+    decoded = result_codec.decode_result(result_codec.encode_result({"value": values}))
+    assert decoded["value"][0] is None
+    assert decoded["value"][1] is None
+    assert decoded["value"][2:] == [1.0] * 18
+
+
+def test_short_lists_stay_in_meta():
+    result = {"credible_interval": [0.1, 0.9], "dates": ["2024-01-01"]}
+    assert result_codec.decode_result(result_codec.encode_result(result)) == result
+
+
+def test_legacy_json_text_and_bytes():
+    result = {"groups": [], "distribution": {"a": [1.0, 2.0]}}
+    text = json.dumps(result)
+    assert result_codec.decode_result(text) == result
+    # BLOB 列读出来的旧 JSON 是 UTF-8 bytes
+    assert result_codec.decode_result(text.encode("utf-8")) == result
+    assert result_codec.decode_result(memoryview(text.encode("utf-8"))) == result
+
+
+def test_unknown_version_rejected():
+    raw = result_codec.MAGIC + bytes([99]) + b"payload"
+    with pytest.raises(ValueError):
+        result_codec.decode_result(raw)
+
+
+def test_decode_result_and_body():
+    result = {"mean": float("nan"), "values": [1.0, float("inf")]}
+    body = render_body(result)
+    decoded, stored_body = result_codec.decode_result_and_body(body.decode("utf-8"))
+    assert decoded == {"mean": None, "values": [1.0, None]}
+    assert stored_body == body
+
+    # 旧格式的 JSON 文本里有 NaN，不是合法的响应体
+    decoded, stored_body = result_codec.decode_result_and_body(json.dumps(result))
+    assert math.isnan(decoded["mean"])
+    assert stored_body is None
+
+    _, stored_body = result_codec.decode_result_and_body(result_codec.encode_result(result))
+    assert stored_body is None
@@ -0,0 +1,135 @@
+import threading
+import time
+
+import pytest
+
+from backend.utils import single_flight as sf
+
+
+def _start_leader(key, release, result="leader"):
+    """起一个 leader 线程，compute 阻塞到 release 被 set；返回 (线程, 结果列表)。"""
+    started = threading.Event()
+    results = []
+
+    def compute():
+        started.set()
+        release.wait(5)
+        return result
+
+    thread = threading.Thread(target=lambda: results.append(sf.single_flight(key, compute)))
+    thread.start()
+    assert started.wait(5)
+    return thread, results
+
+
+def _wait_for_coalesced(count):
+    deadline = time.monotonic() + 5
+    while sf.single_flight_stats()["coalesced"] < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_waiters_share_leader_result():
+    release = threading.Event()
+    leader, leader_results = _start_leader(("coalesce",), release)
+    coalesced = sf.single_flight_stats()["coalesced"]
+    calls = []
+    waiter_results = []
+    waiters = [
+        threading.Thread(target=lambda: waiter_results.append(
+            sf.single_flight(("coalesce",), lambda: calls.append(1) or "waiter")
+        ))
+        for _ in range(3)
+    ]
+    for thread in waiters:
+        thread.start()
+    # 三个等待方都挂到 leader 上之后再放行
+    _wait_for_coalesced(coalesced + 3)
+    release.set()
+    for thread in [leader] + waiters:
+        thread.join(5)
+
+    assert leader_results == ["leader"]
+    assert waiter_results == ["leader"] * 3
+    assert calls == []
+    assert sf.single_flight_stats()["in_flight"] == 0
+
+
+def test_leader_error_reaches_waiters():
+    release = threading.Event()
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    errors = []
+
+    def call(compute):
+        try:
+            sf.single_flight(("error",), compute)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call, args=(failing,))
+    leader.start()
+    assert started.wait(5)
+    coalesced = sf.single_flight_stats()["coalesced"]
+    waiter = threading.Thread(target=call, args=(lambda: "unused",))
+    waiter.start()
+    _wait_for_coalesced(coalesced + 1)
+    release.set()
+    leader.join(5)
+    waiter.join(5)
+    assert errors == ["boom", "boom"]
+
+
+def test_waiter_timeout_computes_itself(monkeypatch):
+    monkeypatch.setattr(sf, "SINGLE_FLIGHT_WAIT_TIMEOUT", 0.05)
+    release = threading.Event()
+    leader, leader_results = _start_leader(("timeout",), release)
+    before = sf.single_flight_stats()["wait_timeouts"]
+    try:
+        assert sf.single_flight(("timeout",), lambda: "fallback") == "fallback"
+        assert sf.single_flight_stats()["wait_timeouts"] == before + 1
+    finally:
+        release.set()
+        leader.join(5)
+    assert leader_results == ["leader"]
+
+
+def test_sequential_calls_recompute():
+    calls = []
+    assert sf.single_flight(("seq",), lambda: calls.append(1) or 1) == 1
+    assert sf.single_flight(("seq",), lambda: calls.append(2) or 2) == 2
+    assert calls == [1, 2]
+
+
+class _FailingEngine:
+    def connect(self):
+        raise RuntimeError("GET_LOCK not supported")
+
+
+def test_unavailable_lock_falls_back_to_local(monkeypatch):
+    monkeypatch.setattr(sf, "_distributed_available", True)
+    rechecked = []
+    result = sf.single_flight(
+        ("no-lock",), lambda: "computed", engine=_FailingEngine(), recheck=lambda: rechecked.append(1) or "cached"
+    )
+    # 没拿到锁时不 recheck，直接算；之后本进程不再尝试 GET_LOCK
+    assert result == "computed"
+    assert rechecked == []
+    assert sf.single_flight_stats()["distributed"] is False
+
+
+def test_lock_name_is_short_and_stable():
+    key = ("bayesian", "exp" * 50, "aov", "", "2024-01-01", "2024-01-31")
+    assert len(sf.lock_name(key)) <= 64
+    assert sf.lock_name(key) == sf.lock_name(key)
+    assert sf.lock_name(key) != sf.lock_name(key[:-1] + ("2024-02-01",))
+
+
+@pytest.fixture(autouse=True)
+def _no_leftover_calls():
+    yield
+    assert sf.single_flight_stats()["in_flight"] == 0
@@ -0,0 +1,61 @@
+from backend.utils import snapshot_utils
+from backend.utils.snapshot_utils import days_in_ranges, open_days_for, plan_fetch_ranges, supports_incremental
+
+
+def test_empty_snapshot_fetches_whole_range():
+    assert plan_fetch_ranges("2024-01-01", "2024-01-05", set(), 1) == [("2024-01-01", "2024-01-05")]
+
+
+def test_full_snapshot_only_refetches_open_days():
+    existing = {f"2024-01-0{d}" for d in range(1, 6)}
+    assert plan_fetch_ranges("2024-01-01", "2024-01-05", existing, 1) == [("2024-01-05", "2024-01-05")]
+    assert plan_fetch_ranges("2024-01-01", "2024-01-05", existing, 3) == [("2024-01-03", "2024-01-05")]
+
+
+def test_zero_open_days_reuses_everything():
+    existing = {f"2024-01-0{d}" for d in range(1, 6)}
+    assert plan_fetch_ranges("2024-01-01", "2024-01-05", existing, 0) == []
+
+
+def test_gaps_become_separate_ranges():
+    existing = {"2024-01-01", "2024-01-02", "2024-01-04", "2024-01-05", "2024-01-06", "2024-01-07"}
+    assert plan_fetch_ranges("2024-01-01", "2024-01-08", existing, 2) == [
+        ("2024-01-03", "2024-01-03"),
+        ("2024-01-07", "2024-01-08"),
+    ]
+
+
+def test_missing_days_merge_with_open_days():
+    existing = {"2024-01-01", "2024-01-02"}
+    assert plan_fetch_ranges("2024-01-01", "2024-01-05", existing, 1) == [("2024-01-03", "2024-01-05")]
+
+
+def test_open_days_longer_than_range():
+    assert plan_fetch_ranges("2024-01-01", "2024-01-02", {"2024-01-01", "2024-01-02"}, 7) == [
+        ("2024-01-01", "2024-01-02")
+    ]
+
+
+def test_crosses_month_boundary():
+    existing = {"2024-01-30", "2024-01-31", "2024-02-01"}
+    assert plan_fetch_ranges("2024-01-30", "2024-02-02", existing, 1) == [("2024-02-02", "2024-02-02")]
+
+
+def test_days_in_ranges():
+    assert days_in_ranges([("2024-01-30", "2024-02-01"), ("2024-02-03", "2024-02-03")]) == {
+        "2024-01-30", "2024-01-31", "2024-02-01", "2024-02-03"
+    }
+
+
+def test_open_days_for_uses_settle_days(monkeypatch):
+    monkeypatch.setattr(snapshot_utils, "SNAPSHOT_OPEN_DAYS", 1)
+    assert open_days_for({}) == 1
+    assert open_days_for({"settle_days": 7}) == 7
+    monkeypatch.setattr(snapshot_utils, "SNAPSHOT_OPEN_DAYS", 3)
+    assert open_days_for({"settle_days": 2}) == 3
+
+
+def test_supports_incremental():
+    assert supports_incremental({})
+    assert not supports_incremental({"incremental": False})
+    assert not supports_incremental({"result_type": "heatmap"})
@@ -0,0 +1,18 @@
+-- StarRocks 主键模型：INSERT 按主键 upsert（流水线 airflow/refresh_assignments.py 会 CREATE TABLE IF NOT EXISTS）
+CREATE TABLE IF NOT EXISTS abtest_experiment_assignment (
+    experiment_id VARCHAR(128) NOT NULL,
+    user_id VARCHAR(128) NOT NULL,
+    variation_id VARCHAR(64) NOT NULL,
+    first_assigned_date DATE NOT NULL,
+    first_assigned_at DATETIME NOT NULL
+)
+PRIMARY KEY (experiment_id, user_id)
+DISTRIBUTED BY HASH (experiment_id, user_id);
+
+CREATE TABLE IF NOT EXISTS abtest_experiment_assignment_watermark (
+    experiment_id VARCHAR(128) NOT NULL,
+    max_event_date DATE NOT NULL,
+    refreshed_at DATETIME NOT NULL
+)
+PRIMARY KEY (experiment_id)
+DISTRIBUTED BY HASH (experiment_id);
@@ -6,6 +6,42 @@ CREATE TABLE abtest_query_cache (
     category VARCHAR(64) NOT NULL,
     start_date DATE NOT NULL,
     end_date DATE NOT NULL,
-    result_json MEDIUMTEXT NOT NULL,
+    result_json MEDIUMBLOB NOT NULL,  -- result_codec 编码的二进制，旧行是 JSON 文本
+    size_bytes INT NOT NULL DEFAULT 0,  -- result_json 的字节数，housekeeping 的字节预算用
+    generation BIGINT NOT NULL DEFAULT 0,  -- 写入时实验的缓存 generation（见 abtest_cache_generation）
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    last_hit_at TIMESTAMP NULL DEFAULT NULL,  -- 最近一次命中，cache_housekeeping 批量更新
+    UNIQUE KEY uk_cache_key (query_type, experiment_name, metric, category, start_date, end_date)
+);
+
+-- 已有表的迁移：先删掉同一缓存 key 下较旧的重复行（保留 id 最大的一行），再加唯一键
+-- DELETE c1 FROM abtest_query_cache c1
+-- JOIN abtest_query_cache c2
+--   ON c1.query_type = c2.query_type
+--  AND c1.experiment_name = c2.experiment_name
+--  AND c1.metric = c2.metric
+--  AND c1.category = c2.category
+--  AND c1.start_date = c2.start_date
+--  AND c1.end_date = c2.end_date
+--  AND c1.id < c2.id;
+-- ALTER TABLE abtest_query_cache
+--   ADD UNIQUE KEY uk_cache_key (query_type, experiment_name, metric, category, start_date, end_date);
+
+-- 切换到二进制编码（CACHE_ENCODING=binary）前，把列改成 BLOB；旧的 JSON 行照样能读
+-- ALTER TABLE abtest_query_cache MODIFY result_json MEDIUMBLOB NOT NULL;
+
+-- 流水线驱动的缓存失效：summary_cache.main 跑完后给处理过的实验 generation + 1
+CREATE TABLE abtest_cache_generation (
+    experiment_name VARCHAR(128) NOT NULL PRIMARY KEY,
+    generation BIGINT NOT NULL DEFAULT 0,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
 );
+
+-- 已有表加 generation 列（旧行为 0，实验有 generation 之后即视为过期）
+-- ALTER TABLE abtest_query_cache ADD COLUMN generation BIGINT NOT NULL DEFAULT 0 AFTER result_json;
+
+-- housekeeping（cache_housekeeping.py）用的列；已有行的 size_bytes 回填一次
+-- ALTER TABLE abtest_query_cache
+--   ADD COLUMN size_bytes INT NOT NULL DEFAULT 0 AFTER result_json,
+--   ADD COLUMN last_hit_at TIMESTAMP NULL DEFAULT NULL AFTER updated_at;
+-- UPDATE abtest_query_cache SET size_bytes = LENGTH(result_json), updated_at = updated_at;
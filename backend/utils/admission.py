@@ -0,0 +1,162 @@
+# backend/utils/admission.py
+"""
+数仓查询的准入控制。
+
+gunicorn 2 个 worker × 8 个线程，几个人同时打开实验时，每个线程都可能在跑一整轮未命中缓存的取数，
+几十条分析查询同时打到 StarRocks（9030 端口），所有人的尾延迟一起变差。
+所有数仓查询（sql_templates.run_template / stream_template）都先经过这里：
+
+- 全局同时在跑的查询不超过 WAREHOUSE_MAX_INFLIGHT，单个实验不超过 WAREHOUSE_MAX_PER_EXPERIMENT；
+- 拿不到名额的请求排队，最多 WAREHOUSE_QUEUE_MAX 个，等待超过 WAREHOUSE_QUEUE_TIMEOUT 秒放弃；
+  队列满或超时抛 AdmissionRejected，单指标接口返回 503，多指标接口（all_bayesian / all_trend / all_in_one）
+  只把被拒的指标标成 error，其它指标照常返回；
+- 读写缓存表、读快照这类轻查询走优先通道（priority=True）：不受单实验上限约束，
+  并且额外有 WAREHOUSE_PRIORITY_SLOTS 个只给优先通道用的名额，不会被重查询堵住。
+
+名额按顶层请求算，不按 SQL 算：按天分区的 fetcher（day_partition.run_day_partitions）整体占一个名额，
+用 share_admission() 把它带进分区线程，分区里的每条 SQL 不再各自排队。
+否则 all_in_one 扇出 3 个指标 × 每个指标 4 个分区线程，会超过单实验上限 3，互相等到 WAREHOUSE_QUEUE_TIMEOUT。
+
+每个 gunicorn worker 进程各自计数；admission_stats() 给出在跑 / 排队数量和等待时间，用来调参数。
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+ADMISSION_ENABLED = os.environ.get("WAREHOUSE_ADMISSION", "1") == "1"
+WAREHOUSE_MAX_INFLIGHT = int(os.environ.get("WAREHOUSE_MAX_INFLIGHT", "6"))
+WAREHOUSE_MAX_PER_EXPERIMENT = int(os.environ.get("WAREHOUSE_MAX_PER_EXPERIMENT", "3"))
+WAREHOUSE_PRIORITY_SLOTS = int(os.environ.get("WAREHOUSE_PRIORITY_SLOTS", "2"))
+WAREHOUSE_QUEUE_MAX = int(os.environ.get("WAREHOUSE_QUEUE_MAX", "32"))
+WAREHOUSE_QUEUE_TIMEOUT = float(os.environ.get("WAREHOUSE_QUEUE_TIMEOUT", "30"))
+
+
+class AdmissionRejected(Exception):
+    """排队已满或等待超时，这次查询没有执行。"""
+
+
+_cond = threading.Condition()
+_inflight = 0
+_inflight_by_experiment = {}
+_queued = 0
+_stats = {
+    "admitted": 0,
+    "admitted_priority": 0,
+    "rejected_queue_full": 0,
+    "rejected_timeout": 0,
+    "wait_seconds": 0.0,
+    "max_wait_seconds": 0.0,
+    "max_queued": 0,
+}
+
+# 同一线程里嵌套的查询（比如流式结果还没读完又查了一条）不重复占名额，避免自己等自己
+_local = threading.local()
+
+
+def _can_admit(experiment_name, priority):
+    if priority:
+        return _inflight < WAREHOUSE_MAX_INFLIGHT + WAREHOUSE_PRIORITY_SLOTS
+    if _inflight >= WAREHOUSE_MAX_INFLIGHT:
+        return False
+    return experiment_name is None or _inflight_by_experiment.get(experiment_name, 0) < WAREHOUSE_MAX_PER_EXPERIMENT
+
+
+def _acquire(experiment_name, priority):
+    global _inflight, _queued
+    start = time.perf_counter()
+    with _cond:
+        if not _can_admit(experiment_name, priority):
+            if _queued >= WAREHOUSE_QUEUE_MAX:
+                _stats["rejected_queue_full"] += 1
+                raise AdmissionRejected(f"数仓查询排队已满（{_queued}），请稍后重试")
+            _queued += 1
+            _stats["max_queued"] = max(_stats["max_queued"], _queued)
+            try:
+                admitted = _cond.wait_for(lambda: _can_admit(experiment_name, priority), WAREHOUSE_QUEUE_TIMEOUT)
+            finally:
+                _queued -= 1
+            if not admitted:
+                _stats["rejected_timeout"] += 1
+                raise AdmissionRejected(f"数仓查询排队超过 {WAREHOUSE_QUEUE_TIMEOUT:g} 秒，请稍后重试")
+
+        _inflight += 1
+        if experiment_name is not None:
+            _inflight_by_experiment[experiment_name] = _inflight_by_experiment.get(experiment_name, 0) + 1
+        waited = time.perf_counter() - start
+        _stats["admitted_priority" if priority else "admitted"] += 1
+        _stats["wait_seconds"] += waited
+        _stats["max_wait_seconds"] = max(_stats["max_wait_seconds"], waited)
+
+
+def _release(experiment_name):
+    global _inflight
+    with _cond:
+        _inflight -= 1
+        if experiment_name is not None:
+            left = _inflight_by_experiment.get(experiment_name, 1) - 1
+            if left > 0:
+                _inflight_by_experiment[experiment_name] = left
+            else:
+                _inflight_by_experiment.pop(experiment_name, None)
+        _cond.notify_all()
+
+
+@contextmanager
+def admit(experiment_name=None, priority=False):
+    """
+    with admit(experiment_name): 执行数仓查询。
+    experiment_name 为 None 时只受全局上限约束；priority=True 走轻查询的优先通道。
+    """
+    depth = getattr(_local, "depth", 0)
+    if not ADMISSION_ENABLED or depth > 0:
+        _local.depth = depth + 1
+        try:
+            yield
+        finally:
+            _local.depth = depth
+        return
+
+    _acquire(experiment_name, priority)
+    _local.depth = 1
+    try:
+        yield
+    finally:
+        _local.depth = 0
+        _release(experiment_name)
+
+
+def share_admission(func):
+    """
+    把当前线程持有的名额带进线程池里跑的 func：func 里的查询算在同一个名额上，不再各自排队。
+    当前线程没有持有名额（或没开准入控制）时原样返回 func。调用方要在名额释放之前等 func 跑完。
+    """
+    if not getattr(_local, "depth", 0):
+        return func
+
+    def run(*args, **kwargs):
+        depth = getattr(_local, "depth", 0)
+        _local.depth = depth + 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.depth = depth
+    return run
+
+
+def admission_stats():
+    """当前在跑 / 排队的数量、各实验在跑数量，以及累计的准入、拒绝次数和排队耗时。"""
+    with _cond:
+        stats = dict(_stats)
+        stats.update({
+            "inflight": _inflight,
+            "queued": _queued,
+            "inflight_by_experiment": dict(_inflight_by_experiment),
+            "max_inflight": WAREHOUSE_MAX_INFLIGHT,
+            "max_per_experiment": WAREHOUSE_MAX_PER_EXPERIMENT,
+            "priority_slots": WAREHOUSE_PRIORITY_SLOTS,
+            "queue_max": WAREHOUSE_QUEUE_MAX,
+        })
+    admitted = stats["admitted"] + stats["admitted_priority"]
+    stats["avg_wait_seconds"] = stats["wait_seconds"] / admitted if admitted else 0.0
+    return stats
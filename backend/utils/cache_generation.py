@@ -0,0 +1,97 @@
+# backend/utils/cache_generation.py
+"""
+每个实验一个缓存代数（generation），由流水线驱动缓存失效。
+
+ab_testing_pipeline 每天重算快照，summary_cache.main 跑完后给处理过的实验 generation + 1；
+abtest_query_cache 的每行记下写入时的 generation：
+
+- 行的 generation >= 实验当前 generation：有效，不看写入时间（数据没变就一直用）；
+- 小于当前 generation：新数据已落地，该行过期（可按 stale-while-revalidate 先返回再后台刷新）；
+- 实验还没有 generation（流水线没跑过它，current = 0）：退回原来按 CACHE_EXPIRE_HOURS 的时钟过期。
+
+流水线自己写的行直接用 next_generation()（当前 + 1），bump 之后立刻有效，相当于整批刷新。
+当前 generation 在进程里缓存 GENERATION_CACHE_SECONDS 秒，避免每次读缓存都多查一次库。
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import bindparam, text
+
+GENERATION_TABLE = "abtest_cache_generation"
+GENERATION_CACHE_SECONDS = float(os.environ.get("GENERATION_CACHE_SECONDS", "30"))
+
+_generations = {}  # experiment_name -> (generation, fetched_at)
+_lock = threading.Lock()
+
+
+def _execute(engine_or_conn, sql, params, fetch=False):
+    """传 engine 时自己开事务，传 connection 时用调用方的事务。"""
+    if hasattr(engine_or_conn, "connect"):
+        with engine_or_conn.begin() as conn:
+            result = conn.execute(sql, params)
+            return result.fetchall() if fetch else None
+    result = engine_or_conn.execute(sql, params)
+    return result.fetchall() if fetch else None
+
+
+def current_generations(engine_or_conn, experiment_names):
+    """返回 {experiment_name: generation}，没有记录的实验为 0。"""
+    names = sorted({name for name in experiment_names if name})
+    now = time.monotonic()
+    result = {}
+    with _lock:
+        for name in names:
+            entry = _generations.get(name)
+            if entry is not None and now - entry[1] < GENERATION_CACHE_SECONDS:
+                result[name] = entry[0]
+    missing = [name for name in names if name not in result]
+    if not missing:
+        return result
+
+    sql = text(f"""
+        SELECT experiment_name, generation
+        FROM {GENERATION_TABLE}
+        WHERE experiment_name IN :names
+    """).bindparams(bindparam("names", expanding=True))
+    fetched = {name: 0 for name in missing}
+    try:
+        rows = _execute(engine_or_conn, sql, {"names": missing}, fetch=True)
+    except Exception as e:
+        # 表还没建时不影响读写缓存，按没有 generation（时钟过期）处理
+        print(f"[CACHE-GEN] 读取 {GENERATION_TABLE} 失败，按时钟过期处理: {e}")
+        rows = []
+    fetched.update({row[0]: int(row[1]) for row in rows})
+    with _lock:
+        for name, generation in fetched.items():
+            _generations[name] = (generation, now)
+    result.update(fetched)
+    return result
+
+
+def current_generation(engine_or_conn, experiment_name):
+    return current_generations(engine_or_conn, [experiment_name]).get(experiment_name, 0)
+
+
+def next_generation(engine_or_conn, experiment_name):
+    """流水线本轮写缓存用的 generation：bump 之后即为当前 generation。"""
+    return current_generation(engine_or_conn, experiment_name) + 1
+
+
+def bump_generations(engine_or_conn, experiment_names):
+    """新数据落地：给这些实验的 generation + 1（没有记录的从 1 开始），之前写入的缓存行全部过期。"""
+    names = sorted({name for name in experiment_names if name})
+    if not names:
+        return
+    sql = text(f"""
+        INSERT INTO {GENERATION_TABLE} (experiment_name, generation, updated_at)
+        VALUES (:experiment_name, 1, NOW())
+        ON DUPLICATE KEY UPDATE
+            generation = generation + 1,
+            updated_at = VALUES(updated_at)
+    """)
+    _execute(engine_or_conn, sql, [{"experiment_name": name} for name in names])
+    # 本进程立刻看到新值（其它进程最多晚 GENERATION_CACHE_SECONDS 秒）
+    with _lock:
+        for name in names:
+            _generations.pop(name, None)
@@ -0,0 +1,273 @@
+# backend/utils/cache_housekeeping.py
+"""
+abtest_query_cache 的清理和容量统计。
+
+原来没有任何地方删行：用户每选一个新的 start_date / end_date 就多一行几百 KB 的结果，表和索引一直涨。
+
+- 访问记录：缓存命中（进程内或数据库）时 record_hits() 只把 key 记进内存，
+  后台线程每 CACHE_HIT_FLUSH_SECONDS 秒（或攒够 CACHE_HIT_FLUSH_MAX_KEYS 个 key）批量更新一次 last_hit_at；
+- run_housekeeping()：
+  1. 删掉已经不能再用的行（cache_utils.entry_state 为 "expired"：过期且超出 stale-while-revalidate 窗口）
+     和超过 CACHE_PURGE_IDLE_DAYS 天没人访问的行（封闭区间固定住的行也一样）；
+  2. 剩下的总字节数超过 CACHE_TABLE_MAX_BYTES 时，按最近访问时间从旧到新淘汰，
+     降到预算的 CACHE_TABLE_LOW_WATER 为止（避免每次只删一点、反复触发）；
+  只扫元数据列（不读 result_json），按 id 做 keyset 分页（每页 CACHE_HOUSEKEEPING_BATCH 行），
+  内存里只留当前一页；LRU 淘汰按 (最近访问时间, id) 分页，从最旧的开始删；
+  删除每批 CACHE_HOUSEKEEPING_BATCH 行、走准入控制，批之间停 CACHE_DELETE_PAUSE_SECONDS 秒，不和在线查询抢数仓；
+- cache_size_report()：按实验和 query_type 汇总行数和字节数，给 /api/cache_report 用。
+
+run_housekeeping 由 ab_testing_pipeline 的 purge_cache 任务每天跑一次，也可以 POST /api/cache_housekeeping 手动触发。
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, text
+
+from .admission import admit
+
+CACHE_TABLE_MAX_BYTES = int(os.environ.get("CACHE_TABLE_MAX_BYTES", str(2 * 1024 ** 3)))
+CACHE_TABLE_LOW_WATER = float(os.environ.get("CACHE_TABLE_LOW_WATER", "0.9"))
+CACHE_PURGE_IDLE_DAYS = int(os.environ.get("CACHE_PURGE_IDLE_DAYS", "30"))
+CACHE_HIT_TRACKING = os.environ.get("CACHE_HIT_TRACKING", "1") == "1"
+CACHE_HIT_FLUSH_SECONDS = float(os.environ.get("CACHE_HIT_FLUSH_SECONDS", "60"))
+CACHE_HIT_FLUSH_MAX_KEYS = int(os.environ.get("CACHE_HIT_FLUSH_MAX_KEYS", "500"))
+CACHE_HOUSEKEEPING_BATCH = int(os.environ.get("CACHE_HOUSEKEEPING_BATCH", "500"))
+CACHE_DELETE_PAUSE_SECONDS = float(os.environ.get("CACHE_DELETE_PAUSE_SECONDS", "0.2"))
+
+_pending = set()  # 待写 last_hit_at 的缓存 key
+_pending_lock = threading.Lock()
+_engine = None
+_flusher_pid = None
+_wake = threading.Event()
+
+
+def record_hits(engine, keys):
+    """记下命中的缓存 key（cache_utils.cache_key 格式），由后台线程批量写 last_hit_at。"""
+    global _engine
+    if not CACHE_HIT_TRACKING or not keys:
+        return
+    with _pending_lock:
+        _engine = engine
+        _pending.update(keys)
+        pending = len(_pending)
+    _ensure_flusher()
+    if pending >= CACHE_HIT_FLUSH_MAX_KEYS:
+        _wake.set()
+
+
+def _ensure_flusher():
+    global _flusher_pid
+    # gunicorn fork 出来的 worker 里线程不会跟过来，按 pid 判断要不要重新起
+    pid = os.getpid()
+    if _flusher_pid == pid:
+        return
+    with _pending_lock:
+        if _flusher_pid == pid:
+            return
+        _flusher_pid = pid
+    threading.Thread(target=_flush_loop, name="cache-hit-flusher", daemon=True).start()
+
+
+def _flush_loop():
+    while True:
+        _wake.wait(CACHE_HIT_FLUSH_SECONDS)
+        _wake.clear()
+        try:
+            flush_hits()
+        except Exception as e:
+            print(f"[CACHE-HK] 写 last_hit_at 失败: {e}")
+
+
+def flush_hits():
+    """把攒下的命中写进 last_hit_at：按 (query_type, experiment_name, start_date, end_date) 分组，每组一条 UPDATE。"""
+    with _pending_lock:
+        keys = list(_pending)
+        _pending.clear()
+        engine = _engine
+    if not keys or engine is None:
+        return 0
+    groups = {}
+    for query_type, experiment_name, metric, category, start_date, end_date in keys:
+        groups.setdefault((query_type, experiment_name, start_date, end_date), set()).add(metric)
+    # updated_at 列带 ON UPDATE CURRENT_TIMESTAMP，显式写回原值才不会被刷新（它决定过期和 ETag）
+    sql = text("""
+        UPDATE abtest_query_cache
+        SET last_hit_at = :now, updated_at = updated_at
+        WHERE query_type = :query_type
+          AND experiment_name = :experiment_name
+          AND start_date = :start_date
+          AND end_date = :end_date
+          AND metric IN :metrics
+    """).bindparams(bindparam("metrics", expanding=True))
+    now = datetime.now().replace(microsecond=0)
+    with admit(None, priority=True), engine.begin() as conn:
+        for (query_type, experiment_name, start_date, end_date), metrics in groups.items():
+            conn.execute(sql, {
+                "now": now,
+                "query_type": query_type,
+                "experiment_name": experiment_name,
+                "start_date": start_date,
+                "end_date": end_date,
+                "metrics": sorted(metrics),
+            })
+    return len(keys)
+
+
+def _as_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+
+# 元数据列；last_access 是最近一次访问（没有命中记录时为写入时间）
+_META_COLUMNS = """
+    id, query_type, experiment_name, metric, category, start_date, end_date,
+    updated_at, last_hit_at, generation, size_bytes,
+    GREATEST(updated_at, COALESCE(last_hit_at, updated_at)) AS last_access
+"""
+SCAN_SQL = text(f"""
+    SELECT {_META_COLUMNS}
+    FROM abtest_query_cache
+    WHERE id > :after_id
+    ORDER BY id
+    LIMIT :limit
+""")
+LRU_SQL = text(f"""
+    SELECT {_META_COLUMNS}
+    FROM abtest_query_cache
+    WHERE GREATEST(updated_at, COALESCE(last_hit_at, updated_at)) > :after_access
+       OR (GREATEST(updated_at, COALESCE(last_hit_at, updated_at)) = :after_access AND id > :after_id)
+    ORDER BY last_access, id
+    LIMIT :limit
+""")
+
+
+def _fetch_page(engine, sql, params):
+    with admit(None), engine.connect() as conn:
+        return conn.execute(sql, dict(params, limit=CACHE_HOUSEKEEPING_BATCH)).fetchall()
+
+
+def _delete_ids(engine, ids):
+    """按 CACHE_HOUSEKEEPING_BATCH 分批删除，每批走准入控制，批之间停 CACHE_DELETE_PAUSE_SECONDS 秒。"""
+    sql = text("DELETE FROM abtest_query_cache WHERE id IN :ids").bindparams(bindparam("ids", expanding=True))
+    for i in range(0, len(ids), CACHE_HOUSEKEEPING_BATCH):
+        if i and CACHE_DELETE_PAUSE_SECONDS > 0:
+            time.sleep(CACHE_DELETE_PAUSE_SECONDS)
+        with admit(None), engine.begin() as conn:
+            conn.execute(sql, {"ids": ids[i:i + CACHE_HOUSEKEEPING_BATCH]})
+
+
+def _purgeable(rows, engine, idle_before):
+    """一页元数据里应该直接删掉的行的 id：已经不能再用（expired），或者超过 idle_before 没人访问。"""
+    from .cache_utils import cache_key, entry_state
+    from .cache_generation import current_generations
+
+    generations = current_generations(engine, [row[2] for row in rows])
+    ids = set()
+    for row in rows:
+        key = cache_key(row[1], row[2], row[3], row[4], row[5], row[6])
+        state, _ = entry_state(key, _as_datetime(row[7]), row[9], generations.get(row[2], 0))
+        if state == "expired" or _as_datetime(row[11]) < idle_before:
+            ids.add(row[0])
+    return ids
+
+
+def run_housekeeping(engine, max_bytes=None, idle_days=None, dry_run=False):
+    """清理过期 / 长期不用的行，再按字节预算做 LRU 淘汰。返回清理统计。"""
+    max_bytes = CACHE_TABLE_MAX_BYTES if max_bytes is None else max_bytes
+    idle_days = CACHE_PURGE_IDLE_DAYS if idle_days is None else idle_days
+    idle_before = datetime.now() - timedelta(days=idle_days)
+
+    # ---- 1. 按 id 分页扫一遍：统计总字节数，删掉过期 / 长期不用的行 ----
+    scanned, purged, bytes_before, purged_bytes = 0, 0, 0, 0
+    after_id = 0
+    while True:
+        rows = _fetch_page(engine, SCAN_SQL, {"after_id": after_id})
+        if not rows:
+            break
+        after_id = rows[-1][0]
+        ids = _purgeable(rows, engine, idle_before)
+        scanned += len(rows)
+        bytes_before += sum(int(row[10] or 0) for row in rows)
+        purged += len(ids)
+        purged_bytes += sum(int(row[10] or 0) for row in rows if row[0] in ids)
+        if ids and not dry_run:
+            _delete_ids(engine, sorted(ids))
+
+    # ---- 2. 还超预算时按最近访问时间从旧到新分页淘汰，降到低水位为止 ----
+    live_bytes = bytes_before - purged_bytes
+    evicted = 0
+    if live_bytes > max_bytes:
+        target = max_bytes * CACHE_TABLE_LOW_WATER
+        after_access, after_id = datetime.min, 0
+        while live_bytes > target:
+            rows = _fetch_page(engine, LRU_SQL, {"after_access": after_access, "after_id": after_id})
+            if not rows:
+                break
+            after_access, after_id = _as_datetime(rows[-1][11]), rows[-1][0]
+            # dry_run 时第 1 步的行还在表里，跳过它们（已经算进 purged）
+            skip = _purgeable(rows, engine, idle_before) if dry_run else set()
+            ids = []
+            for row in rows:
+                if live_bytes <= target:
+                    break
+                if row[0] in skip:
+                    continue
+                ids.append(row[0])
+                live_bytes -= int(row[10] or 0)
+            evicted += len(ids)
+            if ids and not dry_run:
+                _delete_ids(engine, ids)
+
+    stats = {
+        "scanned": scanned,
+        "purged": purged,
+        "evicted": evicted,
+        "bytes_before": bytes_before,
+        "bytes_after": live_bytes,
+        "max_bytes": max_bytes,
+        "dry_run": dry_run,
+    }
+    print(f"[CACHE-HK] {stats}")
+    return stats
+
+
+def cache_size_report(engine):
+    """按实验、query_type 汇总缓存表的行数和字节数（字节数为 size_bytes，即编码后的 result_json 大小）。"""
+    sql = text("""
+        SELECT experiment_name, query_type, COUNT(*), COALESCE(SUM(size_bytes), 0),
+               MAX(updated_at), MAX(last_hit_at)
+        FROM abtest_query_cache
+        GROUP BY experiment_name, query_type
+    """)
+    with admit(None, priority=True), engine.connect() as conn:
+        rows = conn.execute(sql).fetchall()
+
+    experiments = {}
+    by_query_type = {}
+    for experiment_name, query_type, row_count, size, last_updated, last_hit in rows:
+        row_count, size = int(row_count), int(size)
+        exp = experiments.setdefault(experiment_name, {
+            "experiment_name": experiment_name, "rows": 0, "bytes": 0, "query_types": {},
+        })
+        exp["rows"] += row_count
+        exp["bytes"] += size
+        exp["query_types"][query_type] = {
+            "rows": row_count,
+            "bytes": size,
+            "last_updated": str(last_updated) if last_updated else None,
+            "last_hit": str(last_hit) if last_hit else None,
+        }
+        total = by_query_type.setdefault(query_type, {"rows": 0, "bytes": 0})
+        total["rows"] += row_count
+        total["bytes"] += size
+
+    return {
+        "total_rows": sum(exp["rows"] for exp in experiments.values()),
+        "total_bytes": sum(exp["bytes"] for exp in experiments.values()),
+        "max_bytes": CACHE_TABLE_MAX_BYTES,
+        "by_query_type": by_query_type,
+        "by_experiment": sorted(experiments.values(), key=lambda exp: exp["bytes"], reverse=True),
+    }
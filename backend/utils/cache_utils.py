@@ -1,12 +1,106 @@
-import json
-from datetime import datetime
-from sqlalchemy import text
+import hashlib
+import os
+from datetime import date, datetime, timedelta
+from sqlalchemy import bindparam, text
 
+from .admission import admit
+from .local_cache import LOCAL_CACHE_ENABLED, query_cache
+from . import result_codec
+from .cache_generation import current_generations
+from .cache_housekeeping import record_hits
+from .response_body import CachedResult, render_body
+
+# 实验还没有缓存 generation（流水线没跑过它）时的时钟过期时间；有 generation 时按 generation 失效
 CACHE_EXPIRE_HOURS = 6
+# result_json 的写入格式："binary" 为 result_codec 的压缩二进制，"json" 为 JSON 文本。读取两种格式都支持。
+# json 格式写的就是最终响应体（render_body），从库里读出来直接返回，不再序列化；binary 的响应体在进程内缓存里生成一次。
+# 默认 json：已有部署的列还是 MEDIUMTEXT，跑完 abtest_query_cache.sql 里的 MODIFY ... MEDIUMBLOB 之后再设成 binary。
+CACHE_ENCODING = os.environ.get("CACHE_ENCODING", "json")
+# stale-while-revalidate：过期不超过这么多小时的条目照样先返回（标记 stale），同时后台刷新；0 关闭
+CACHE_STALE_SERVE_HOURS = float(os.environ.get("CACHE_STALE_SERVE_HOURS", "72"))
+
+# 数据新鲜度水位：数仓里最新的完整分区 = 当天往前 DATA_WATERMARK_LAG_DAYS 天
+DATA_WATERMARK_LAG_DAYS = int(os.environ.get("DATA_WATERMARK_LAG_DAYS", "1"))
+# 区间结束（加上指标的 settle_days）后再留几天给迟到数据，之后才算封闭区间
+CACHE_CLOSED_MARGIN_DAYS = int(os.environ.get("CACHE_CLOSED_MARGIN_DAYS", "2"))
+CACHE_PIN_CLOSED_RANGES = os.environ.get("CACHE_PIN_CLOSED_RANGES", "1") == "1"
+
+def data_watermark(today=None):
+    """最新的完整分区日期。"""
+    return (today or date.today()) - timedelta(days=DATA_WATERMARK_LAG_DAYS)
+
+def range_closes_on(metric, end_date):
+    """
+    区间 [.., end_date] 的数据从哪天起不再变化（按日历日）：
+    end_date + 指标的 settle_days + CACHE_CLOSED_MARGIN_DAYS 被水位覆盖的那一天。
+    """
+    from ..service.config import INDICATOR_CONFIG
+    settle_days = int(INDICATOR_CONFIG.get(metric or '', {}).get("settle_days", 0))
+    end = datetime.strptime(str(end_date)[:10], "%Y-%m-%d").date()
+    return end + timedelta(days=settle_days + CACHE_CLOSED_MARGIN_DAYS + DATA_WATERMARK_LAG_DAYS)
+
+def is_closed_range(metric, end_date, today=None):
+    """区间已封闭（结果不会再变）时返回 True；碰到最近几天的是开放区间。"""
+    return range_closes_on(metric, end_date) <= (today or date.today())
+
+def _pinned(key, updated_at):
+    """缓存行是在区间封闭之后算的：结果不会再变，不设过期时间。"""
+    if not CACHE_PIN_CLOSED_RANGES:
+        return False
+    _, _, metric, _, _, end_date = key
+    try:
+        return updated_at.date() >= range_closes_on(metric, end_date)
+    except ValueError:
+        return False
+
+def entry_etag(key, generation, updated_at):
+    """缓存条目的强 ETag：由缓存 key、行的 generation 和 updated_at（精确到秒）决定。"""
+    version = f"{cache_key(*key)}|{generation or 0}|{str(updated_at)[:19]}"
+    return hashlib.sha1(version.encode("utf-8")).hexdigest()
+
+def cache_key(query_type, experiment_name, metric, category, start_date, end_date):
+    """进程内缓存的 key，日期统一成字符串（接口传字符串，流水线可能传 date）。"""
+    return (query_type, experiment_name, metric or '', category or '', str(start_date)[:10], str(end_date)[:10])
+
+def _local_key(key, generation):
+    """进程内缓存的 key 带上 generation，流水线 bump 之后旧条目自然失效。"""
+    return key + (generation,)
+
+def _generations(engine_local, experiment_names):
+    experiment_name = experiment_names[0] if len(set(experiment_names)) == 1 else None
+    with admit(experiment_name, priority=True):
+        return current_generations(engine_local, experiment_names)
 
 def get_abtest_cache(engine_local, query_type, experiment_name, metric, category, start_date, end_date):
+    result, _ = get_abtest_cache_swr(
+        engine_local, query_type, experiment_name, metric, category, start_date, end_date, allow_stale=False
+    )
+    return result
+
+def get_abtest_cache_swr(engine_local, query_type, experiment_name, metric, category, start_date, end_date,
+                         allow_stale=True):
+    """
+    返回 (result, stale)。allow_stale 时已过期但不超过 CACHE_STALE_SERVE_HOURS 的条目也返回，stale=True，
+    调用方应先把它返回给用户，再用 refresh_in_background() 刷新。
+    """
+    entry, stale = get_abtest_cache_entry(
+        engine_local, query_type, experiment_name, metric, category, start_date, end_date, allow_stale
+    )
+    return (entry.result if entry is not None else None), stale
+
+def get_abtest_cache_entry(engine_local, query_type, experiment_name, metric, category, start_date, end_date,
+                           allow_stale=True):
+    """同 get_abtest_cache_swr，返回 (CachedResult, stale)：命中时可以用 entry.body() 直接作为响应体。"""
+    key = cache_key(query_type, experiment_name, metric, category, start_date, end_date)
+    generation = _generations(engine_local, [experiment_name]).get(experiment_name, 0)
+    if LOCAL_CACHE_ENABLED:
+        cached = query_cache.get(_local_key(key, generation))
+        if cached is not None:
+            record_hits(engine_local, [key])
+            return cached, False
+
     sql = text("""
-        SELECT result_json, updated_at
+        SELECT result_json, updated_at, generation
         FROM abtest_query_cache
         WHERE query_type=:query_type
           AND experiment_name=:experiment_name
@@ -15,7 +109,8 @@ def get_abtest_cache(engine_local, query_type, experiment_name, metric, category
           AND start_date=:start_date
           AND end_date=:end_date
     """)
-    with engine_local.connect() as conn:
+    # 缓存表和数仓在同一个库上，轻查询走准入控制的优先通道
+    with admit(experiment_name, priority=True), engine_local.connect() as conn:
         row = conn.execute(
             sql,
             {
@@ -27,55 +122,289 @@ def get_abtest_cache(engine_local, query_type, experiment_name, metric, category
                 "end_date": end_date,
             }
         ).fetchone()
-        if row:
-            updated_at = row[1]
-            if isinstance(updated_at, str):
-                updated_at = datetime.fromisoformat(updated_at)
-            if (datetime.now() - updated_at).total_seconds() < CACHE_EXPIRE_HOURS * 3600:
-                return json.loads(row[0])
-    return None
+    if row:
+        entry, stale = _load_entry(key, row[0], row[1], allow_stale, row[2], generation)
+        if entry is not None:
+            record_hits(engine_local, [key])
+        return entry, stale
+    return None, False
+
+def _load_entry(key, result_raw, updated_at, allow_stale=False, row_generation=0, generation=0):
+    """
+    解析 result_json，返回 (CachedResult, stale)：未过期的连同响应体一起回填进程内缓存。
+    过期规则：区间封闭后才写入的行永不过期；实验有 generation 时行的 generation 落后即过期；
+    否则按 CACHE_EXPIRE_HOURS 的时钟过期。
+    过期的在 allow_stale 且写入不超过 CACHE_EXPIRE_HOURS + CACHE_STALE_SERVE_HOURS（或只落后一代）时
+    返回 stale=True（不进进程内缓存），否则 (None, False)。
+    """
+    if isinstance(updated_at, str):
+        updated_at = datetime.fromisoformat(updated_at)
+    state, ttl = entry_state(key, updated_at, row_generation, generation)
+    if state != "fresh":
+        if not allow_stale or state != "stale":
+            return None, False
+        return CachedResult(result_codec.decode_result(result_raw)), True
+    result, body = result_codec.decode_result_and_body(result_raw)
+    entry = CachedResult(result, entry_etag(key, row_generation, updated_at), body)
+    if LOCAL_CACHE_ENABLED:
+        # 内存里的条目不活得比数据库那行久；响应体现在就生成，之后的命中直接返回
+        _cache_locally(_local_key(key, generation), entry, len(result_raw), ttl)
+    return entry, False
+
+def entry_state(key, updated_at, row_generation=0, generation=0):
+    """
+    缓存行的状态，返回 (state, 剩余有效秒数)：
+    "fresh" 有效；"stale" 过期但还能先返回（stale-while-revalidate）；"expired" 不能再用（housekeeping 可以删）。
+    """
+    age_seconds = (datetime.now() - updated_at).total_seconds()
+    fresh_seconds = CACHE_EXPIRE_HOURS * 3600
+    if _pinned(key, updated_at):
+        # 封闭区间：固定住，只受进程内缓存自己的 TTL 限制
+        return "fresh", float("inf")
+    if generation:
+        # 流水线驱动：新数据落地前一直有效
+        if (row_generation or 0) >= generation:
+            return "fresh", float("inf")
+    elif age_seconds < fresh_seconds:
+        return "fresh", fresh_seconds - age_seconds
+    # 只落后一代的行（上一轮流水线的数据）不看写入时间也可以先返回
+    recent = age_seconds < fresh_seconds + CACHE_STALE_SERVE_HOURS * 3600
+    one_behind = generation and (row_generation or 0) == generation - 1
+    if CACHE_STALE_SERVE_HOURS and (recent or one_behind):
+        return "stale", 0
+    return "expired", 0
+
+def _cache_locally(local_key, entry, raw_size, ttl_seconds=None):
+    body = entry.body()
+    query_cache.set(local_key, entry, raw_size + len(body), ttl_seconds)
+
+def mark_stale(result):
+    """给过期结果加上 stale 标记（复制一份，不改缓存里的对象）。"""
+    if isinstance(result, dict):
+        return dict(result, stale=True)
+    return result
+
+def refresh_in_background(key, func, *args):
+    """
+    过期条目的后台刷新：func(*args) 负责重算并写缓存。
+    同一个 key 在本进程里同时只有一个刷新任务（jobs.submit_job 按 key 去重）；
+    在单独的 refresh 线程池里跑，不和预估过贵的用户请求抢线程。
+    """
+    from .jobs import submit_job
+    return submit_job(("refresh",) + tuple(cache_key(*key)), func, *args, pool="refresh")
+
+# 唯一键 uk_cache_key 覆盖完整的缓存 key，所有写缓存的地方都走这一条 upsert
+UPSERT_CACHE_SQL = text("""
+    INSERT INTO abtest_query_cache
+    (query_type, experiment_name, metric, category, start_date, end_date, result_json, size_bytes, generation,
+     updated_at)
+    VALUES (:query_type, :experiment_name, :metric, :category, :start_date, :end_date, :result_json, :size_bytes,
+            :generation, :updated_at)
+    ON DUPLICATE KEY UPDATE
+        result_json = VALUES(result_json),
+        size_bytes = VALUES(size_bytes),
+        generation = VALUES(generation),
+        updated_at = VALUES(updated_at)
+""")
+
+# 二进制写入失败过一次（列还不是 BLOB）后，本进程之后都写 JSON
+_binary_writes_ok = True
+
+def encode_result(result_json):
+    """结果对象 -> result_json 列的值（按 CACHE_ENCODING 编码）。"""
+    if CACHE_ENCODING == "binary" and _binary_writes_ok:
+        return result_codec.encode_result(result_json)
+    return render_body(result_json).decode("utf-8")
+
+def _as_json_rows(rows):
+    """二进制编码的行改成 JSON 文本（写入失败后的回退）。"""
+    return [
+        dict(row, result_json=render_body(result_codec.decode_result(row["result_json"])).decode("utf-8"))
+        if isinstance(row["result_json"], (bytes, bytearray)) else row
+        for row in rows
+    ]
+
+def _execute_upsert(engine_or_conn, rows):
+    params = rows if len(rows) > 1 else rows[0]
+    if hasattr(engine_or_conn, "connect"):
+        with engine_or_conn.begin() as conn:
+            conn.execute(UPSERT_CACHE_SQL, params)
+    else:
+        engine_or_conn.execute(UPSERT_CACHE_SQL, params)
+
+def _size_bytes(result_raw):
+    return len(result_raw.encode("utf-8")) if isinstance(result_raw, str) else len(result_raw)
+
+def upsert_query_cache(engine_or_conn, rows):
+    """
+    rows: [{query_type, experiment_name, metric, category, start_date, end_date,
+            result_json(encode_result 编码后的值), generation(写入时实验的缓存 generation), updated_at(可省略)}]。
+    updated_at 由这里统一填当前时间（精确到秒），和进程内条目的 ETag 用同一个值；size_bytes（housekeeping 的字节预算用）也在这里算。
+    传 engine 时自己开事务，传 connection 时用调用方的事务（流水线在一个事务里写）。
+    多行时 executemany，pymysql 会合成一条多行 VALUES。
+    二进制写入失败时（列还是 MEDIUMTEXT）改成 JSON 重写一次。返回实际写入的行。
+    """
+    if not rows:
+        return
+    now = datetime.now().replace(microsecond=0)
+    rows = [
+        dict(row, updated_at=row.get("updated_at") or now, size_bytes=_size_bytes(row["result_json"]))
+        for row in rows
+    ]
+    try:
+        _execute_upsert(engine_or_conn, rows)
+    except Exception as e:
+        if not any(isinstance(row["result_json"], (bytes, bytearray)) for row in rows):
+            raise
+        # 列还是 MEDIUMTEXT 时二进制写不进去：这次改写 JSON，本进程之后也只写 JSON
+        global _binary_writes_ok
+        _binary_writes_ok = False
+        print(f"[CACHE] 二进制写入失败，回退为 JSON 编码（result_json 列需改成 MEDIUMBLOB）: {e}")
+        rows = [dict(row, size_bytes=_size_bytes(row["result_json"])) for row in _as_json_rows(rows)]
+        _execute_upsert(engine_or_conn, rows)
+    return rows
 
 def set_abtest_cache(engine_local, query_type, experiment_name, metric, category, start_date, end_date, result_json):
-    delete_sql = text("""
-        DELETE FROM abtest_query_cache
-        WHERE query_type = :query_type
-          AND experiment_name = :experiment_name
-          AND metric = :metric
-          AND category = :category
-          AND start_date = :start_date
-          AND end_date = :end_date
-    """)
-    insert_sql = text("""
-        INSERT INTO abtest_query_cache
-        (query_type, experiment_name, metric, category, start_date, end_date, result_json, updated_at)
-        VALUES (:query_type, :experiment_name, :metric, :category, :start_date, :end_date, :result_json, NOW())
-    """)
-    with engine_local.begin() as conn:
-        conn.execute(delete_sql, {
-            "query_type": query_type,
-            "experiment_name": experiment_name,
-            "metric": metric,
-            "category": category,
-            "start_date": start_date,
-            "end_date": end_date,
+    """写一条缓存，返回写好的 CachedResult（带 ETag 和响应体）。"""
+    key = cache_key(query_type, experiment_name, metric, category, start_date, end_date)
+    return set_abtest_cache_many(engine_local, [(key, result_json)])[key]
+
+def _group_keys(keys):
+    """按 (query_type, experiment_name, start_date, end_date) 分组，组内只有 metric / category 不同。"""
+    groups = {}
+    for key in keys:
+        query_type, experiment_name, metric, category, start_date, end_date = key
+        groups.setdefault((query_type, experiment_name, start_date, end_date), []).append(key)
+    return groups
+
+def get_abtest_cache_many(engine_local, keys, stale_keys=None):
+    """
+    批量版 get_abtest_cache：keys 是 cache_key() 的列表，返回 {key: result}，未命中 / 过期的 key 不在结果里。
+    先查进程内缓存，剩下的 key 一条 SQL 查完（每组一个 metric IN 分支，UNION ALL 拼起来）。
+    传入 stale_keys（set）时按 stale-while-revalidate 返回可用的过期条目，并把这些 key 加进 stale_keys。
+    """
+    return {key: entry.result for key, entry in get_abtest_cache_entries(engine_local, keys, stale_keys).items()}
+
+def get_abtest_cache_entries(engine_local, keys, stale_keys=None):
+    """同 get_abtest_cache_many，返回 {key: CachedResult}。"""
+    keys = [cache_key(*key) for key in keys]
+    if not keys:
+        return {}
+    generations = _generations(engine_local, [key[1] for key in keys])
+    results = {}
+    missing = []
+    for key in keys:
+        cached = query_cache.get(_local_key(key, generations.get(key[1], 0))) if LOCAL_CACHE_ENABLED else None
+        if cached is not None:
+            results[key] = cached
+        else:
+            missing.append(key)
+    if not missing:
+        record_hits(engine_local, list(results))
+        return results
+
+    branches = []
+    params = {}
+    for i, ((query_type, experiment_name, start_date, end_date), group) in enumerate(_group_keys(missing).items()):
+        branches.append(f"""
+            SELECT query_type, experiment_name, metric, category, start_date, end_date, result_json, updated_at,
+                   generation
+            FROM abtest_query_cache
+            WHERE query_type = :query_type_{i}
+              AND experiment_name = :experiment_name_{i}
+              AND start_date = :start_date_{i}
+              AND end_date = :end_date_{i}
+              AND metric IN :metrics_{i}""")
+        params.update({
+            f"query_type_{i}": query_type,
+            f"experiment_name_{i}": experiment_name,
+            f"start_date_{i}": start_date,
+            f"end_date_{i}": end_date,
+            f"metrics_{i}": sorted({key[2] for key in group}),
         })
-        conn.execute(insert_sql, {
+    sql = text("\n            UNION ALL".join(branches)).bindparams(
+        *[bindparam(f"metrics_{i}", expanding=True) for i in range(len(branches))]
+    )
+    experiment_name = missing[0][1] if len({key[1] for key in missing}) == 1 else None
+    with admit(experiment_name, priority=True), engine_local.connect() as conn:
+        rows = conn.execute(sql, params).fetchall()
+
+    # 同一个 key 有多行时取 updated_at 最新的一行
+    latest = {}
+    for row in rows:
+        key = cache_key(row[0], row[1], row[2], row[3], row[4], row[5])
+        if key in latest and str(latest[key][1]) >= str(row[7]):
+            continue
+        latest[key] = (row[6], row[7], row[8])
+    wanted = set(missing)
+    for key, (result_text, updated_at, row_generation) in latest.items():
+        if key not in wanted:
+            continue  # 同组里 metric 对上但 category 不同的行
+        entry, stale = _load_entry(
+            key, result_text, updated_at, stale_keys is not None, row_generation, generations.get(key[1], 0)
+        )
+        if entry is not None:
+            results[key] = entry
+            if stale:
+                stale_keys.add(key)
+    record_hits(engine_local, list(results))
+    return results
+
+def lookup_metric_caches(engine_local, query_type, experiment_name, metric_names, start_date, end_date,
+                         stale_metrics=None, entries=False):
+    """
+    指标列表按 INDICATOR_CONFIG 里的真实分类批量查缓存，返回 ({metric: result}, [未命中的 metric])。
+    不在 INDICATOR_CONFIG 里的指标直接跳过。传入 stale_metrics（set）时过期条目也算命中，对应指标加进 stale_metrics。
+    entries=True 时值为 CachedResult（接口拼响应体用）。
+    """
+    from ..service.config import INDICATOR_CONFIG
+    keys = {}
+    for metric in metric_names:
+        cfg = INDICATOR_CONFIG.get(metric)
+        if cfg is None:
+            continue
+        keys[metric] = cache_key(query_type, experiment_name, metric, cfg.get("category", "") or "", start_date, end_date)
+    stale_keys = set() if stale_metrics is not None else None
+    found = get_abtest_cache_entries(engine_local, list(keys.values()), stale_keys)
+    cached = {metric: found[key] if entries else found[key].result for metric, key in keys.items() if key in found}
+    if stale_metrics is not None:
+        stale_metrics.update(metric for metric, key in keys.items() if key in stale_keys)
+    missing = [metric for metric, key in keys.items() if key not in found]
+    return cached, missing
+
+def set_abtest_cache_many(engine_local, entries):
+    """
+    批量写缓存：entries 是 [(cache_key, result_json)]，一条 upsert 写完，写库成功后直写进程内缓存
+    （调用方之后不要再改 result_json）。返回 {cache_key: CachedResult}（带 ETag，接口可以直接用来返回）。
+    """
+    if not entries:
+        return {}
+    updated_at = datetime.now().replace(microsecond=0)
+    generations = _generations(engine_local, [cache_key(*key)[1] for key, _ in entries])
+    rows = []
+    for key, result_json in entries:
+        query_type, experiment_name, metric, category, start_date, end_date = cache_key(*key)
+        rows.append({
             "query_type": query_type,
             "experiment_name": experiment_name,
             "metric": metric,
             "category": category,
             "start_date": start_date,
             "end_date": end_date,
-            "result_json": json.dumps(result_json, ensure_ascii=False),
+            "result_json": encode_result(result_json),
+            "generation": generations.get(experiment_name, 0),
+            "updated_at": updated_at,
         })
-
-def write_snapshot_row(engine, row):
-    sql = text("""
-        INSERT INTO abtest_metric_snapshot
-        (experiment_name, metric_name, variation_id, event_date, value, revenue, orders, calc_time)
-        VALUES (:experiment_name, :metric_name, :variation_id, :event_date, :value, :revenue, :orders, NOW())
-        ON DUPLICATE KEY UPDATE
-            value=VALUES(value), revenue=VALUES(revenue), orders=VALUES(orders), calc_time=NOW()
-    """)
-    with engine.begin() as conn:
-        conn.execute(sql, row)
+    experiment_name = rows[0]["experiment_name"] if len({r["experiment_name"] for r in rows}) == 1 else None
+    with admit(experiment_name, priority=True):
+        upsert_query_cache(engine_local, rows)
+    written = {}
+    for (key, result_json), row in zip(entries, rows):
+        key = cache_key(*key)
+        # JSON 编码时写进库的就是响应体
+        body = row["result_json"].encode("utf-8") if isinstance(row["result_json"], str) else None
+        entry = CachedResult(result_json, entry_etag(key, row["generation"], updated_at), body)
+        if LOCAL_CACHE_ENABLED:
+            _cache_locally(_local_key(key, row["generation"]), entry, len(row["result_json"]))
+        written[key] = entry
+    return written
@@ -0,0 +1,165 @@
+# backend/utils/columnar.py
+"""
+fetcher 结果的列式表示和向量化聚合。
+
+原来每个接口都是逐行 getval(row, field) 再 float() / int()，分组、按日期透视也都在 Python 循环里做。
+这里先把行一次性转成列：rows_to_columns() 返回以 INDICATOR_CONFIG 字段名
+（variation_field / date_field / value_field / revenue_field / order_field）为 key 的 NumPy 数组，
+Decimal / None 到 float64（NaN）的转换整列完成；之后 group_by_variation() / pivot_by_date()
+用 factorize + bincount 做分组和透视，返回结构和原来的 dict 循环一致。
+"""
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+
+from .fetch_utils import iter_fetch
+
+# (INDICATOR_CONFIG 字段名, 缺省下标)
+FIELDS = (
+    ("variation_field", 0),
+    ("date_field", 1),
+    ("value_field", None),
+    ("revenue_field", None),
+    ("order_field", None),
+)
+NUMERIC_FIELDS = ("value_field", "revenue_field", "order_field")
+
+
+def _getval(row, field):
+    """和原来接口里的 getval 同口径：下标取不到、dict 里没有的字段都当作 None。"""
+    if field is None:
+        return None
+    if isinstance(field, int):
+        try:
+            return row[field]
+        except (IndexError, KeyError, TypeError):
+            return None
+    if isinstance(row, dict):
+        return row.get(field)
+    mapping = getattr(row, "_mapping", None)
+    return mapping.get(field) if mapping is not None else None
+
+
+def to_float64(values):
+    """整列转 float64，None 变成 NaN（Decimal / int 由 astype 批量转换）。"""
+    arr = np.asarray(values, dtype=object)
+    if arr.size == 0:
+        return np.empty(0, dtype=np.float64)
+    arr = arr.copy()
+    arr[pd.isna(arr)] = np.nan
+    return arr.astype(np.float64)
+
+
+def rows_to_columns(rows, cfg):
+    """
+    rows 只遍历一遍（可以是流式生成器），返回 {字段名: ndarray}。
+    variation / date 是 object 数组（保留原始值），数值字段是 float64。
+    配置里显式写成 None 的字段（比如快照贝叶斯不需要 date）不取，整列为空值。
+    """
+    names = [name for name, default in FIELDS if cfg.get(name, default) is not None]
+    fields = [cfg.get(name, default) for name, default in FIELDS if name in names]
+    # itemgetter 只有一个字段时返回标量，统一包成 tuple
+    getter = itemgetter(*fields) if len(fields) > 1 else (lambda row: (row[fields[0]],))
+    extracted = []
+    for row in rows:
+        try:
+            extracted.append(getter(row))
+        except (IndexError, KeyError, TypeError):
+            # 行结构和字段写法对不上（比如 Row + 字符串字段），这一行按 getval 口径逐字段取
+            extracted.append(tuple(_getval(row, f) for f in fields))
+
+    n = len(extracted)
+    transposed = dict(zip(names, zip(*extracted))) if extracted else {}
+    columns = {}
+    for name, _ in FIELDS:
+        values = transposed.get(name, [None] * n)
+        if name in NUMERIC_FIELDS:
+            columns[name] = to_float64(values)
+        else:
+            columns[name] = np.asarray(values, dtype=object)
+    return columns
+
+
+def fetch_columns(cfg, experiment_name, start_date, end_date, engine):
+    """fetch_func 的列式版本：边取边收集，返回 rows_to_columns() 的结构。"""
+    return rows_to_columns(iter_fetch(cfg["fetch_func"], experiment_name, start_date, end_date, engine), cfg)
+
+
+def factorize(values, label=None):
+    """
+    按首次出现顺序编码，返回 (codes, uniques)；None 的 code 为 -1。
+    label 用来把原始值规整成展示用的 key（比如日期统一成 'YYYY-MM-DD'），规整后相同的值合并成一组。
+    """
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    if label is None or len(uniques) == 0:
+        return codes, list(uniques)
+    label_codes, labels = pd.factorize(np.asarray([label(u) for u in uniques], dtype=object))
+    codes = np.where(codes >= 0, label_codes[np.maximum(codes, 0)], -1)
+    return codes, list(labels)
+
+
+def group_by_variation(columns, variation_label=None):
+    """
+    贝叶斯接口用：丢掉 variation 或 value 为空的行，按 variation 分组。
+    返回 [(variation, values ndarray, revenue 合计, order 合计)]，顺序同原来的 defaultdict（首次出现）。
+    """
+    value = columns["value_field"]
+    variation = columns["variation_field"]
+    keep = ~np.isnan(value) & ~pd.isna(variation)
+    codes, uniques = factorize(variation[keep], variation_label)
+    if not uniques:
+        return []
+    value = value[keep]
+    revenue = np.nan_to_num(columns["revenue_field"][keep])
+    order = np.nan_to_num(columns["order_field"][keep])
+
+    n = len(uniques)
+    revenue_sum = np.bincount(codes, weights=revenue, minlength=n)
+    order_sum = np.bincount(codes, weights=order, minlength=n)
+    counts = np.bincount(codes, minlength=n)
+    # 稳定排序后按组切片，组内保持原始行顺序
+    grouped_values = np.split(value[np.argsort(codes, kind="stable")], np.cumsum(counts)[:-1])
+    return [
+        (uniques[k], grouped_values[k], float(revenue_sum[k]), int(order_sum[k]))
+        for k in range(n)
+    ]
+
+
+def pivot_by_date(columns, variation_label=None):
+    """
+    趋势接口用：variation × date 透视。丢掉 variation 或 date 为空的行；同一格有多行时取最后一行（同原来的 dict 覆盖）。
+    返回 {"dates": 升序日期, "variations": 首次出现顺序, "value"/"revenue"/"order": 二维 float64，缺失为 NaN}。
+    """
+    variation = columns["variation_field"]
+    date = columns["date_field"]
+    keep = ~pd.isna(variation) & ~pd.isna(date)
+    v_codes, variations = factorize(variation[keep], variation_label)
+    d_codes, dates = factorize(date[keep], lambda d: str(d)[:10])
+
+    # 日期升序
+    date_order = np.argsort(np.asarray(dates, dtype=object), kind="stable")
+    date_rank = np.empty(len(dates), dtype=np.int64)
+    date_rank[date_order] = np.arange(len(dates))
+    dates = [dates[i] for i in date_order]
+    d_codes = date_rank[d_codes] if len(d_codes) else d_codes
+
+    shape = (len(variations), len(dates))
+    result = {"dates": dates, "variations": variations}
+    flat = v_codes * len(dates) + d_codes
+    # 每个格子只保留最后一次出现的行
+    _, first_in_reversed = np.unique(flat[::-1], return_index=True)
+    last = len(flat) - 1 - first_in_reversed
+    for name, key in (("value_field", "value"), ("revenue_field", "revenue"), ("order_field", "order")):
+        matrix = np.full(shape, np.nan)
+        if len(last):
+            matrix.flat[flat[last]] = columns[name][keep][last]
+        result[key] = matrix
+    return result
+
+
+def to_list(values, fill=None, as_int=False):
+    """一行矩阵转成 JSON 列表，NaN 换成 fill。"""
+    if as_int:
+        return [fill if np.isnan(x) else int(x) for x in values]
+    return [fill if np.isnan(x) else float(x) for x in values]
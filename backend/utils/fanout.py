@@ -0,0 +1,36 @@
+# backend/utils/fanout.py
+"""
+扇出接口（一次请求要取几十个指标）的并发执行。
+
+fetcher 和 SQLAlchemy engine 都是同步的，这里不换异步驱动：
+每个调用用 asyncio.to_thread 放到线程里跑，asyncio.gather 收集结果，
+信号量限制同一请求里同时在跑的调用数（默认和单实验的数仓准入上限一致，多开只会在准入队列里排队）。
+单个调用抛出的异常原样作为结果返回，不影响其它调用，由调用方决定怎么展示。
+"""
+import asyncio
+import os
+
+from .admission import WAREHOUSE_MAX_PER_EXPERIMENT
+
+FANOUT_CONCURRENCY = int(os.environ.get("FANOUT_CONCURRENCY", str(WAREHOUSE_MAX_PER_EXPERIMENT)))
+
+
+async def _gather(calls, concurrency):
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(func, args):
+        async with semaphore:
+            return await asyncio.to_thread(func, *args)
+
+    results = await asyncio.gather(*(run(func, args) for _, func, args in calls), return_exceptions=True)
+    return {key: result for (key, _, _), result in zip(calls, results)}
+
+
+def run_concurrently(calls, concurrency=None):
+    """
+    calls: [(key, func, args)]，返回 {key: func(*args) 的返回值或抛出的异常}。
+    在 Flask 的同步线程里调用，内部起一个临时事件循环，全部完成后返回。
+    """
+    if not calls:
+        return {}
+    return asyncio.run(_gather(calls, concurrency or FANOUT_CONCURRENCY))
@@ -0,0 +1,32 @@
+# backend/utils/fetch_utils.py
+"""
+fetcher 的流式调用入口。
+
+支持 stream 参数的 fetcher（单条 SQL 的区间查询）在 stream=True 时返回生成器，
+底层走服务端游标逐批取行；其余 fetcher（按天分区、热力图、留存 lambda）照旧返回列表。
+调用方统一用 iter_fetch() 取行、只遍历一遍，不要对结果取 len() 或重复遍历。
+STREAM_ROWS=0 可整体关掉流式，退回 fetchall。
+"""
+import os
+from inspect import signature
+
+STREAM_ROWS = os.environ.get("STREAM_ROWS", "1") == "1"
+
+
+def supports_stream(fetch_func):
+    try:
+        return "stream" in signature(fetch_func).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def stream_kwargs(fetch_func):
+    """给 fetch_func 额外传的参数：支持流式时为 {"stream": True}，否则为空。"""
+    if STREAM_ROWS and supports_stream(fetch_func):
+        return {"stream": True}
+    return {}
+
+
+def iter_fetch(fetch_func, experiment_name, start_date, end_date, engine):
+    """返回可迭代的行：流式 fetcher 是生成器，其余是原来的列表。"""
+    return fetch_func(experiment_name, start_date, end_date, engine, **stream_kwargs(fetch_func))
@@ -0,0 +1,100 @@
+# backend/utils/jobs.py
+"""
+进程内的后台计算任务。
+
+预估很贵的请求（见 preflight.py）不在 gunicorn 请求线程里算满 90 秒，而是交给这里的有界线程池，
+计算函数自己把结果写进 abtest_query_cache；前端拿到 job_id 后可以轮询 /api/jobs/<job_id>，
+或者过一会儿重新请求原接口（算完后直接命中缓存）。
+任务只记在当前 worker 进程里，轮询落到另一个 worker 时查不到，以重新请求原接口为准。
+
+不同类型的任务用各自的线程池（submit_job 的 pool 参数），缓存刷新、预热和清理都不会占住用户请求转来的计算任务。
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+REFRESH_WORKERS = int(os.environ.get("REFRESH_WORKERS", "2"))
+# 各线程池的线程数：
+# "jobs" 预估过贵的用户请求；"refresh" stale-while-revalidate 的后台刷新；
+# "warmer" 缓存预热（同一时间只跑一轮）；"maintenance" 缓存表清理等长时间的维护任务
+POOL_WORKERS = {
+    "jobs": JOB_WORKERS,
+    "refresh": REFRESH_WORKERS,
+    "warmer": 1,
+    "maintenance": 1,
+}
+# 已结束的任务保留多久，超时后从登记表里清掉
+JOB_KEEP_SECONDS = int(os.environ.get("JOB_KEEP_SECONDS", "3600"))
+
+_executors = {}  # pool -> ThreadPoolExecutor，第一次用到时创建
+_jobs = {}  # job_id -> {job_id, key, status, submitted_at, started_at, finished_at, error}
+_job_by_key = {}  # key -> 未结束的 job_id，同一计算不重复提交
+_lock = threading.Lock()
+
+
+def _purge(now):
+    expired = [
+        job_id for job_id, job in _jobs.items()
+        if job["finished_at"] is not None and now - job["finished_at"] > JOB_KEEP_SECONDS
+    ]
+    for job_id in expired:
+        _jobs.pop(job_id, None)
+
+
+def _run(job_id, func, args):
+    with _lock:
+        _jobs[job_id]["status"] = "running"
+        _jobs[job_id]["started_at"] = time.time()
+    try:
+        func(*args)
+        status, error = "done", None
+    except Exception as e:
+        print(f"[JOB] {job_id} 执行失败: {e}")
+        status, error = "failed", str(e)
+    with _lock:
+        job = _jobs[job_id]
+        job.update({"status": status, "error": error, "finished_at": time.time()})
+        _job_by_key.pop(job["key"], None)
+
+
+def _executor(pool):
+    executor = _executors.get(pool)
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=POOL_WORKERS[pool], thread_name_prefix=f"abtest-{pool}")
+        _executors[pool] = executor
+    return executor
+
+
+def submit_job(key, func, *args, pool="jobs"):
+    """提交 func(*args) 到 pool 线程池；同一 key 已在排队 / 运行时直接返回已有任务。返回任务信息 dict。"""
+    with _lock:
+        job_id = _job_by_key.get(key)
+        if job_id is not None:
+            return dict(_jobs[job_id])
+        now = time.time()
+        _purge(now)
+        job_id = uuid.uuid4().hex
+        _jobs[job_id] = {
+            "job_id": job_id,
+            "key": key,
+            "status": "queued",
+            "submitted_at": now,
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+            "pool": pool,
+        }
+        _job_by_key[key] = job_id
+        info = dict(_jobs[job_id])
+        executor = _executor(pool)
+    executor.submit(_run, job_id, func, args)
+    return info
+
+
+def get_job(job_id):
+    with _lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job is not None else None
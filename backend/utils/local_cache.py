@@ -0,0 +1,93 @@
+# backend/utils/local_cache.py
+"""
+abtest_query_cache 前面的进程内 LRU / TTL 缓存。
+
+get_abtest_cache 每次命中都要去 MySQL 走一次网络，再解码一大段 result_json；
+这里按缓存 key 存解析好的结果，读时回填、set_abtest_cache 时直写，
+同一 worker 里重复打开页面直接从内存返回。
+
+- 容量按字节算（用 result_json 的长度近似），超过 LOCAL_CACHE_MAX_BYTES 时淘汰最久没用的；
+- 条目在数据库那行过期时同时过期，另外最多存 LOCAL_CACHE_TTL_SECONDS 秒，
+  避免别的 worker / 流水线改了表以后这里一直读旧值；
+- 返回的是缓存里的同一个对象，调用方只读，需要加字段时先复制。
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+LOCAL_CACHE_ENABLED = os.environ.get("LOCAL_CACHE", "1") == "1"
+LOCAL_CACHE_MAX_BYTES = int(os.environ.get("LOCAL_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+LOCAL_CACHE_TTL_SECONDS = int(os.environ.get("LOCAL_CACHE_TTL_SECONDS", "300"))
+
+
+class LocalCache:
+    def __init__(self, max_bytes, ttl_seconds):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            value, size, expires_at = entry
+            if now >= expires_at:
+                self._remove(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, key, value, size, ttl_seconds=None):
+        """ttl_seconds 不超过实例的 ttl_seconds；size 太大（超过总容量的 1/4）的不放进来。"""
+        ttl = self.ttl_seconds if ttl_seconds is None else min(ttl_seconds, self.ttl_seconds)
+        if ttl <= 0 or size > self.max_bytes // 4:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + ttl)
+            self._bytes += size
+            self._stats["sets"] += 1
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes})
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+query_cache = LocalCache(LOCAL_CACHE_MAX_BYTES, LOCAL_CACHE_TTL_SECONDS)
+
+
+def local_cache_stats():
+    return query_cache.stats()
@@ -0,0 +1,159 @@
+# backend/utils/preflight.py
+"""
+取数前的成本预估。
+
+/api/<metric>_bayesian 之类的接口允许任意 start_date..end_date，
+按天分区的 fetcher 一年的区间就是几百条 SQL，足以把 gunicorn 线程拖到 90 秒超时。
+fetch 之前先用 estimate_cost() 估一下：
+
+- 区间天数；
+- fetcher 的执行方式（day_partition.execution_mode 标记）：按天分区（每天一条 SQL，分区间有并发上限）、
+  串行按天循环（每天一条 SQL，一条接一条），没有标记的是单条区间 SQL；
+- 可选（PREFLIGHT_EXPLAIN=1）：对该指标的区间 SQL 模板（METRIC_TEMPLATES）做一次 EXPLAIN，
+  取计划里最大的 cardinality 作为扫描行数。
+
+超过阈值的请求由接口层改成“近 PREFLIGHT_PREVIEW_DAYS 天的预览 + 后台任务算全量”（见 jobs.py）。
+"""
+import math
+import os
+import re
+from datetime import datetime, timedelta
+from sqlalchemy import text
+
+from .admission import admit
+from ..sql_jobs.day_partition import DEFAULT_MAX_WORKERS
+from ..sql_jobs.sql_templates import latest_range_template
+
+PREFLIGHT_ENABLED = os.environ.get("PREFLIGHT", "1") == "1"
+# 粗略的耗时模型：每条 SQL 的固定开销 + 每天数据的扫描开销
+PREFLIGHT_SECONDS_PER_QUERY = float(os.environ.get("PREFLIGHT_SECONDS_PER_QUERY", "0.8"))
+PREFLIGHT_SECONDS_PER_DAY = float(os.environ.get("PREFLIGHT_SECONDS_PER_DAY", "0.2"))
+# 预估超过这个秒数就不在请求线程里算全量（默认是 gunicorn 超时的一半）
+PREFLIGHT_MAX_SECONDS = float(os.environ.get("PREFLIGHT_MAX_SECONDS", "45"))
+PREFLIGHT_EXPLAIN = os.environ.get("PREFLIGHT_EXPLAIN", "0") == "1"
+PREFLIGHT_MAX_EXPLAIN_ROWS = int(os.environ.get("PREFLIGHT_MAX_EXPLAIN_ROWS", "500000000"))
+PREFLIGHT_PREVIEW_DAYS = int(os.environ.get("PREFLIGHT_PREVIEW_DAYS", "14"))
+
+_CARDINALITY_RE = re.compile(r"cardinality[=:]\s*(\d+)", re.IGNORECASE)
+
+# 指标（INDICATOR_CONFIG 的 key）-> 它的 fetch_func 执行的 SQL 模板名（sql_templates.run_template 的 name）。
+# 模板名和指标名不一定相同：留存 D1~D15 共用一条融合 SQL；
+# 互动类指标在 all_in_one 的合并查询里用的是 engagement_group，但单指标接口跑的是各自的模板。
+METRIC_TEMPLATES = {
+    "aov": "aov",
+    "arpu": "arpu",
+    "arppu": "arppu",
+    "payment_rate_all": "payment_rate_all",
+    "payment_rate_new": "payment_rate_new",
+    "aov_new_day": "aov_new_day",
+    "cancel_sub_day": "cancel_sub_day",
+    "subscribe_new_day_aov": "subscribe_new_day_aov",
+    "click_rate": "click_rate",
+    "explore_start_chat_rate": "explore_start_chat_rate",
+    "avg_chat_rounds": "avg_chat_rounds",
+    "first_chat_bot": "first_chat_bot",
+    "avg_click_bots": "avg_click_bots",
+    "avg_time_spent": "avg_time_spent",
+    "explore_click_rate": "explore_click_rate",
+    "explore_avg_chat_rounds": "explore_avg_chat_rounds",
+    "continue": "continue",
+    "conversation_reset": "conversation_reset",
+    "edit": "edit",
+    "follow": "follow",
+    "new_conversation": "new_conversation",
+    "regen": "regen",
+    "all_retention_d1": "retention_fused",
+    "all_retention_d3": "retention_fused",
+    "all_retention_d7": "retention_fused",
+    "all_retention_d15": "retention_fused",
+    "new_retention_d1": "retention_fused",
+    "new_retention_d3": "retention_fused",
+    "new_retention_d7": "retention_fused",
+    "new_retention_d15": "retention_fused",
+    "cumulative_retention": "cumulative_retention",
+    "cumulative_ltv": "cumulative_ltv",
+    "cumulative_lt": "cumulative_lt",
+    "cohort_arpu": "cohort_arpu_heatmap",
+    "cohort_retention_heatmap": "cohort_retention_heatmap",
+    "cohort_time_spent_heatmap": "cohort_time_spent_heatmap",
+}
+
+
+def count_days(start_date, end_date):
+    start_dt = datetime.strptime(start_date, "%Y-%m-%d")
+    end_dt = datetime.strptime(end_date, "%Y-%m-%d")
+    return max((end_dt - start_dt).days + 1, 0)
+
+
+def fetcher_kind(fetch_func):
+    """
+    'partitioned'：按天分区、每天一条 SQL，分区间并发；'serial'：每天一条 SQL，串行；
+    'range'：整个区间一条 SQL。以 fetcher 上的 execution_mode 标记为准，没有标记的按 'range'。
+    """
+    return getattr(fetch_func, "execution_mode", "range")
+
+
+def explain_rows(engine, metric, experiment_name, start_date, end_date):
+    """
+    对 metric 的区间 SQL 模板（METRIC_TEMPLATES）做 EXPLAIN，返回计划里最大的 cardinality；
+    没有登记模板、本进程还没执行过该模板的区间变体或 EXPLAIN 失败时返回 None。
+    """
+    name = METRIC_TEMPLATES.get(metric)
+    template = latest_range_template(name) if name else None
+    if template is None:
+        return None
+    sql = "EXPLAIN " + template.sql.strip().rstrip(";")
+    params = {"experiment_name": experiment_name, "start_date": start_date, "end_date": end_date}
+    try:
+        with admit(experiment_name, priority=True), engine.connect() as conn:
+            lines = [str(row[0]) for row in conn.execute(text(sql), params).fetchall()]
+    except Exception as e:
+        print(f"[PREFLIGHT] {metric} EXPLAIN 失败: {e}")
+        return None
+    values = [int(v) for line in lines for v in _CARDINALITY_RE.findall(line)]
+    return max(values) if values else None
+
+
+def estimate_cost(fetch_func, experiment_name, start_date, end_date, engine=None, metric=None):
+    """
+    返回 {"days", "kind", "queries", "estimated_seconds", "explain_rows", "expensive", "reason"}。
+    engine / metric 只在开启 PREFLIGHT_EXPLAIN 时用到。
+    """
+    days = count_days(start_date, end_date)
+    kind = fetcher_kind(fetch_func)
+    if kind == "partitioned":
+        queries = days
+        serial_rounds = math.ceil(days / max(DEFAULT_MAX_WORKERS, 1))
+    elif kind == "serial":
+        queries = days
+        serial_rounds = days
+    else:
+        queries = 1 if days else 0
+        serial_rounds = queries
+    estimated_seconds = serial_rounds * PREFLIGHT_SECONDS_PER_QUERY + days * PREFLIGHT_SECONDS_PER_DAY
+
+    rows = None
+    if PREFLIGHT_EXPLAIN and engine is not None and metric and kind == "range":
+        rows = explain_rows(engine, metric, experiment_name, start_date, end_date)
+
+    reason = None
+    if estimated_seconds > PREFLIGHT_MAX_SECONDS:
+        reason = f"预估耗时 {estimated_seconds:.0f}s 超过 {PREFLIGHT_MAX_SECONDS:g}s（{days} 天，{queries} 条 SQL）"
+    elif rows is not None and rows > PREFLIGHT_MAX_EXPLAIN_ROWS:
+        reason = f"EXPLAIN 预估扫描 {rows} 行超过 {PREFLIGHT_MAX_EXPLAIN_ROWS}"
+    return {
+        "days": days,
+        "kind": kind,
+        "queries": queries,
+        "estimated_seconds": round(estimated_seconds, 1),
+        "explain_rows": rows,
+        "expensive": PREFLIGHT_ENABLED and reason is not None,
+        "reason": reason,
+    }
+
+
+def preview_range(start_date, end_date):
+    """预览用的区间：原区间的最后 PREFLIGHT_PREVIEW_DAYS 天。"""
+    end_dt = datetime.strptime(end_date, "%Y-%m-%d")
+    preview_start = end_dt - timedelta(days=PREFLIGHT_PREVIEW_DAYS - 1)
+    return max(start_date, preview_start.strftime("%Y-%m-%d")), end_date
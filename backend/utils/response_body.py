@@ -0,0 +1,106 @@
+# backend/utils/response_body.py
+"""
+缓存命中时直接返回的响应体。
+
+原来每次命中：解码 result_json → replace_nan_inf 递归遍历几千个后验样本 → jsonify 再 json.dumps 一遍。
+这里把最终的响应体（NaN / inf 已换成 null 的 JSON bytes）和结构化结果一起放进进程内缓存（CachedResult），
+命中时 json_response(entry.body()) 直接返回，不再解析和序列化。
+
+- 响应体和缓存行一起持久化：CACHE_ENCODING=json 时 result_json 列写的就是 render_body() 的结果，
+  从库里读出来直接作为响应体（cache_utils._load_entry），别的 worker / 重启后的第一次命中也不用再序列化；
+  binary 编码的行在放进进程内缓存时生成一次。大小计入 LOCAL_CACHE_MAX_BYTES；
+- 多指标接口用 object_body() 把每个指标的响应体按字节拼成一个 JSON 对象，
+  命中的指标不用重新序列化，没命中 / 带 stale 标记的结构化结果现场序列化。
+
+条件请求：CachedResult.etag 由缓存行的 generation 和 updated_at 得到（cache_utils.entry_etag），
+cached_response() 带上强 ETag，If-None-Match 对得上时直接 304，不碰统计代码也不发响应体。
+多指标接口的 ETag 由各指标的 ETag 合成（combine_etags），有任何一个指标不是新鲜的缓存条目时不带 ETag。
+"""
+import hashlib
+import json
+import math
+
+
+def replace_nan_inf(obj):
+    """递归替换所有 NaN, inf, -inf 为 None。"""
+    # 原来在 service.py 里；挪到这里是因为流水线也会 import 本模块，而 service.py 依赖 flask
+    if isinstance(obj, float):
+        if math.isnan(obj) or math.isinf(obj):
+            return None
+        return obj
+    elif isinstance(obj, list):
+        return [replace_nan_inf(x) for x in obj]
+    elif isinstance(obj, dict):
+        return {k: replace_nan_inf(v) for k, v in obj.items()}
+    else:
+        return obj
+
+
+def render_body(result):
+    """结构化结果 -> 响应体 bytes。"""
+    return json.dumps(replace_nan_inf(result), ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class CachedResult:
+    """进程内缓存的条目：结构化结果（只读）+ 响应体 + ETag。"""
+    __slots__ = ("result", "etag", "_body")
+
+    def __init__(self, result, etag=None, body=None):
+        self.result = result
+        self.etag = etag
+        self._body = body
+
+    def body(self):
+        if self._body is None:
+            self._body = render_body(self.result)
+        return self._body
+
+
+def result_of(value):
+    """CachedResult 或结构化结果 -> 结构化结果。"""
+    return value.result if isinstance(value, CachedResult) else value
+
+
+def body_of(value):
+    """CachedResult 或结构化结果 -> 响应体 bytes。"""
+    return value.body() if isinstance(value, CachedResult) else render_body(value)
+
+
+def object_body(values):
+    """{name: CachedResult 或结构化结果} -> 一个 JSON 对象的响应体，命中的部分直接拼接。"""
+    parts = [json.dumps(str(name), ensure_ascii=False).encode("utf-8") + b":" + body_of(value)
+             for name, value in values.items()]
+    return b"{" + b",".join(parts) + b"}"
+
+
+def combine_etags(values):
+    """{name: CachedResult 或结构化结果} 的合成 ETag；有不带 ETag 的部分时返回 None。"""
+    parts = []
+    for name, value in sorted(values.items()):
+        etag = value.etag if isinstance(value, CachedResult) else None
+        if not etag:
+            return None
+        parts.append(f"{name}={etag}")
+    return hashlib.sha1("&".join(parts).encode("utf-8")).hexdigest()
+
+
+def json_response(body, status=200, etag=None):
+    # 流水线也会 import cache_utils（进而 import 本模块），flask 用到时再导入
+    from flask import current_app
+    response = current_app.response_class(body, status=status, mimetype="application/json")
+    if etag:
+        response.set_etag(etag)
+        # 浏览器每次都带 If-None-Match 回来验证，前端不用改
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def cached_response(etag, render):
+    """带强 ETag 返回 render() 的响应体；If-None-Match 命中时返回 304，不调用 render。"""
+    from flask import current_app, request
+    if etag and request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+    return json_response(render(), etag=etag)
@@ -0,0 +1,133 @@
+# backend/utils/result_codec.py
+"""
+abtest_query_cache.result_json 的紧凑二进制编码。
+
+贝叶斯结果里每组 1000 个 posterior_samples 加上原始 distribution，用 json.dumps 存成文本又大又慢。
+新格式（版本 1）：
+
+    MAGIC(3 字节 b"ABQ") + 版本(1 字节) + zlib(
+        uint32 小端 meta 长度 + meta(JSON) + 各数组的原始字节依次拼接
+    )
+
+- 长度 >= PACK_MIN_LEN 且元素全是 float / None 的列表打包成数组：posterior_samples 用 float32，其余 float64；
+  meta 里原位置换成 {"__pk__": 下标}，meta["arrays"] 记每个数组的 [类型码, 元素个数]；
+- None 打包成 NaN，解码时 NaN 还原成 None（接口输出前本来就会把 NaN 换成 None）；
+- 含 int 的列表（比如 order）不打包，保持原样，解码后类型不变。
+
+decode_result() 同时兼容旧的 JSON 文本行（str，或 BLOB 列读出来的 UTF-8 bytes）。
+JSON 文本行按 response_body.render_body 的格式写入（NaN 已换成 null），本身就是接口的响应体，
+decode_result_and_body() 把它原样带出来，读库后不用再序列化一遍。
+"""
+import json
+import math
+import struct
+import sys
+import zlib
+from array import array
+
+MAGIC = b"ABQ"
+VERSION = 1
+PACK_MIN_LEN = 16
+# 只要统计精度的字段用 float32
+FLOAT32_KEYS = {"posterior_samples"}
+ZLIB_LEVEL = 6
+
+_PACK_KEY = "__pk__"
+
+
+def _packable(value):
+    if not isinstance(value, list) or len(value) < PACK_MIN_LEN:
+        return False
+    # bool 是 int 的子类，这里只要 float 和 None
+    return all(v is None or type(v) is float for v in value)
+
+
+def _pack(value, key, arrays, buffers):
+    typecode = "f" if key in FLOAT32_KEYS else "d"
+    packed = array(typecode, (math.nan if v is None else v for v in value))
+    if sys.byteorder != "little":
+        packed.byteswap()
+    arrays.append([typecode, len(packed)])
+    buffers.append(packed.tobytes())
+    return {_PACK_KEY: len(arrays) - 1}
+
+
+def _strip(obj, arrays, buffers, key=None):
+    if isinstance(obj, dict):
+        return {k: _strip(v, arrays, buffers, k) for k, v in obj.items()}
+    if isinstance(obj, list):
+        if _packable(obj):
+            return _pack(obj, key, arrays, buffers)
+        return [_strip(v, arrays, buffers, key) for v in obj]
+    return obj
+
+
+def _restore(obj, unpacked):
+    if isinstance(obj, dict):
+        if len(obj) == 1 and _PACK_KEY in obj:
+            return unpacked[obj[_PACK_KEY]]
+        return {k: _restore(v, unpacked) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_restore(v, unpacked) for v in obj]
+    return obj
+
+
+def encode_result(result):
+    """结果对象 -> 二进制（bytes）。"""
+    arrays, buffers = [], []
+    data = _strip(result, arrays, buffers)
+    meta = json.dumps({"arrays": arrays, "data": data}, ensure_ascii=False, default=str).encode("utf-8")
+    body = struct.pack("<I", len(meta)) + meta + b"".join(buffers)
+    return MAGIC + bytes([VERSION]) + zlib.compress(body, ZLIB_LEVEL)
+
+
+def _decode_v1(payload):
+    body = zlib.decompress(payload)
+    (meta_len,) = struct.unpack_from("<I", body, 0)
+    offset = 4 + meta_len
+    meta = json.loads(body[4:offset].decode("utf-8"))
+    unpacked = []
+    for typecode, count in meta["arrays"]:
+        values = array(typecode)
+        size = values.itemsize * count
+        values.frombytes(body[offset:offset + size])
+        if sys.byteorder != "little":
+            values.byteswap()
+        offset += size
+        unpacked.append([None if math.isnan(v) else v for v in values])
+    return _restore(meta["data"], unpacked)
+
+
+def decode_result_and_body(raw):
+    """
+    同 decode_result，另外返回可以直接作为响应体的 bytes：
+    JSON 文本行里没有 NaN / Infinity（不是合法 JSON，旧格式的行可能有）时就是它本身，否则和二进制行一样返回 None。
+    """
+    if isinstance(raw, memoryview):
+        raw = raw.tobytes()
+    if isinstance(raw, (bytes, bytearray)) and bytes(raw[:len(MAGIC)]) == MAGIC:
+        return decode_result(raw), None
+    body = bytes(raw) if isinstance(raw, (bytes, bytearray)) else raw.encode("utf-8")
+    constants = []
+
+    def parse_constant(name):
+        constants.append(name)
+        return float(name)
+
+    result = json.loads(body.decode("utf-8"), parse_constant=parse_constant)
+    return result, (None if constants else body)
+
+
+def decode_result(raw):
+    """result_json 列的值 -> 结果对象；新格式按版本解码，旧 JSON 文本直接 json.loads。"""
+    if isinstance(raw, memoryview):
+        raw = raw.tobytes()
+    if isinstance(raw, (bytes, bytearray)):
+        raw = bytes(raw)
+        if raw[:len(MAGIC)] == MAGIC:
+            version = raw[len(MAGIC)]
+            if version == 1:
+                return _decode_v1(raw[len(MAGIC) + 1:])
+            raise ValueError(f"未知的缓存编码版本: {version}")
+        raw = raw.decode("utf-8")
+    return json.loads(raw)
@@ -0,0 +1,149 @@
+# backend/utils/single_flight.py
+"""
+并发相同缓存未命中的合并（single-flight）。
+
+冷缓存时几个人同时打开同一个实验，每个请求都会把同一个 fetch_func 跑一遍，再抢着写 set_abtest_cache。
+single_flight(key, compute) 按缓存 key 合并：
+
+- 进程内：同一 key 同时只有一个线程（leader）执行 compute，其余线程等它的结果；
+- 跨副本：leader 执行前先在缓存库上拿 MySQL GET_LOCK（锁名由 key 哈希得到），
+  拿到锁后先调 recheck() 看别的 pod 是不是已经算完写进缓存了，算过就直接用，没有才 compute。
+  库不支持 GET_LOCK（比如直连 StarRocks）时打印一次日志，之后本进程只做进程内合并。
+
+等待方拿到的是 leader 的同一个结果对象，只读使用。
+"""
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import text
+
+SINGLE_FLIGHT_DISTRIBUTED = os.environ.get("SINGLE_FLIGHT_DISTRIBUTED", "1") == "1"
+# 等 GET_LOCK 的秒数，超时就不等了自己算（不超过 gunicorn 的 90 秒超时）
+SINGLE_FLIGHT_LOCK_TIMEOUT = int(os.environ.get("SINGLE_FLIGHT_LOCK_TIMEOUT", "30"))
+# 进程内等待 leader 的秒数，超时自己算
+SINGLE_FLIGHT_WAIT_TIMEOUT = float(os.environ.get("SINGLE_FLIGHT_WAIT_TIMEOUT", "85"))
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_calls = {}  # key -> _Call
+_calls_lock = threading.Lock()
+_distributed_available = SINGLE_FLIGHT_DISTRIBUTED
+
+_stats = {
+    "leaders": 0,
+    "coalesced": 0,
+    "wait_timeouts": 0,
+    "lock_acquired": 0,
+    "lock_timeouts": 0,
+    "recheck_hits": 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def lock_name(key):
+    """GET_LOCK 的锁名最长 64 字符，用 key 的哈希。"""
+    return "abtest:" + hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:40]
+
+
+@contextmanager
+def distributed_lock(engine, key):
+    """
+    在 engine 对应的库上持有 GET_LOCK，with 块内返回是否真的拿到了锁。
+    没开启、不支持或等待超时都返回 False，调用方照常执行（只是不再跨副本去重）。
+    """
+    global _distributed_available
+    if not _distributed_available or engine is None:
+        yield False
+        return
+    name = lock_name(key)
+    conn = None
+    acquired = False
+    try:
+        conn = engine.connect()
+        acquired = conn.execute(
+            text("SELECT GET_LOCK(:name, :timeout)"), {"name": name, "timeout": SINGLE_FLIGHT_LOCK_TIMEOUT}
+        ).scalar() == 1
+    except Exception as e:
+        print(f"[SINGLE-FLIGHT] GET_LOCK 不可用，之后只做进程内合并: {e}")
+        _distributed_available = False
+        if conn is not None:
+            conn.close()
+            conn = None
+    if conn is not None:
+        _count("lock_acquired" if acquired else "lock_timeouts")
+    try:
+        yield acquired
+    finally:
+        if conn is not None:
+            try:
+                if acquired:
+                    conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": name})
+            finally:
+                conn.close()
+
+
+def _lead(key, compute, engine, recheck):
+    with distributed_lock(engine, key) as locked:
+        if locked and recheck is not None:
+            # 等锁期间别的副本可能已经算完并写了缓存
+            value = recheck()
+            if value is not None:
+                _count("recheck_hits")
+                return value
+        return compute()
+
+
+def single_flight(key, compute, engine=None, recheck=None):
+    """
+    同一 key 并发调用只执行一次 compute()，其余调用等它并拿同一个结果（异常也一样抛给所有等待方）。
+    engine 为缓存库 engine 时启用跨副本的 GET_LOCK；recheck() 返回非 None 时用它代替 compute()。
+    """
+    with _calls_lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _Call()
+            _calls[key] = call
+
+    if not leader:
+        _count("coalesced")
+        if not call.event.wait(SINGLE_FLIGHT_WAIT_TIMEOUT):
+            _count("wait_timeouts")
+            return compute()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    _count("leaders")
+    try:
+        call.result = _lead(key, compute, engine, recheck)
+        return call.result
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _calls_lock:
+            _calls.pop(key, None)
+        call.event.set()
+
+
+def single_flight_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    with _calls_lock:
+        stats["in_flight"] = len(_calls)
+    stats["distributed"] = _distributed_available
+    return stats
@@ -0,0 +1,140 @@
+# backend/utils/snapshot_utils.py
+"""
+基于 abtest_metric_snapshot 的增量取数。
+
+流水线每天都会把整个 phase 区间重新跑一遍，但过去的日期早就在快照表里了。
+这里先查出某个 (experiment, metric) 在区间内已有的 event_date，
+只把缺失的日期和末尾仍在变化的 “open days” 交给 fetch_func，再和快照里的旧行合并。
+
+- INDICATOR_CONFIG 里 "incremental": False 的指标（累计类、结果依赖区间起点的）总是全量取数；
+- "settle_days" 表示某天的值要过几天才稳定（比如 D7 留存），末尾这些天每次都重取。
+"""
+import os
+from datetime import datetime, timedelta
+from itertools import chain
+
+from sqlalchemy import text
+
+from .admission import admit
+from .fetch_utils import iter_fetch
+
+# 末尾至少重取的天数（当天数据通常还没落全）
+SNAPSHOT_OPEN_DAYS = int(os.environ.get("SNAPSHOT_OPEN_DAYS", "1"))
+
+
+def supports_incremental(cfg):
+    return cfg.get("incremental", True) and cfg.get("result_type") != "heatmap"
+
+
+def open_days_for(cfg):
+    return max(SNAPSHOT_OPEN_DAYS, int(cfg.get("settle_days", 0)))
+
+
+def get_snapshot_rows(engine_or_conn, experiment_name, metric, start_date, end_date):
+    """
+    读区间内已有的快照行；同一 (variation, event_date) 有多条时保留 updated_at 最新的一条。
+    返回 [{"variation_id", "event_date", "value", "revenue", "orders"}]，event_date 为 'YYYY-MM-DD'。
+    """
+    sql = text("""
+        SELECT variation_id, event_date, value, revenue, orders
+        FROM abtest_metric_snapshot
+        WHERE query_type = 'trend'
+          AND experiment_name = :experiment_name
+          AND metric = :metric
+          AND event_date BETWEEN :start_date AND :end_date
+        ORDER BY updated_at
+    """)
+    params = {"experiment_name": experiment_name, "metric": metric, "start_date": start_date, "end_date": end_date}
+    with admit(experiment_name, priority=True):
+        if hasattr(engine_or_conn, "connect"):
+            with engine_or_conn.connect() as conn:
+                rows = conn.execute(sql, params).fetchall()
+        else:
+            rows = engine_or_conn.execute(sql, params).fetchall()
+
+    latest = {}
+    for row in rows:
+        event_date = str(row[1])[:10]
+        latest[(str(row[0]), event_date)] = {
+            "variation_id": str(row[0]),
+            "event_date": event_date,
+            "value": row[2],
+            "revenue": row[3],
+            "orders": row[4],
+        }
+    return list(latest.values())
+
+
+def plan_fetch_ranges(start_date, end_date, existing_dates, open_days):
+    """
+    返回需要重新取数的连续区间列表 [(start, end), ...]：
+    快照里没有的日期 + 区间末尾 open_days 天。
+    """
+    start_dt = datetime.strptime(start_date, "%Y-%m-%d")
+    end_dt = datetime.strptime(end_date, "%Y-%m-%d")
+    open_from = end_dt - timedelta(days=max(open_days, 0) - 1)
+
+    ranges = []
+    current_dt = start_dt
+    range_start = None
+    while current_dt <= end_dt:
+        day = current_dt.strftime("%Y-%m-%d")
+        need_fetch = day not in existing_dates or current_dt >= open_from
+        if need_fetch and range_start is None:
+            range_start = day
+        elif not need_fetch and range_start is not None:
+            ranges.append((range_start, (current_dt - timedelta(days=1)).strftime("%Y-%m-%d")))
+            range_start = None
+        current_dt += timedelta(days=1)
+    if range_start is not None:
+        ranges.append((range_start, end_date))
+    return ranges
+
+
+def days_in_ranges(ranges):
+    days = set()
+    for range_start, range_end in ranges:
+        current_dt = datetime.strptime(range_start, "%Y-%m-%d")
+        end_dt = datetime.strptime(range_end, "%Y-%m-%d")
+        while current_dt <= end_dt:
+            days.add(current_dt.strftime("%Y-%m-%d"))
+            current_dt += timedelta(days=1)
+    return days
+
+
+def snapshot_row_to_fetch_row(snapshot_row, cfg):
+    """把快照行还原成 fetch_func 的行结构（按 cfg 里的字段名/下标作 key），方便和新取的行一起聚合。"""
+    return {
+        cfg.get("variation_field", 0): snapshot_row["variation_id"],
+        cfg.get("date_field", 1): snapshot_row["event_date"],
+        cfg["value_field"]: snapshot_row["value"],
+        cfg["revenue_field"]: snapshot_row["revenue"],
+        cfg["order_field"]: snapshot_row["orders"],
+    }
+
+
+def fetch_with_snapshot(cfg, metric, experiment_name, start_date, end_date, engine):
+    """
+    在线趋势图用：快照里已有的日期直接复用，只对缺失 / open days 调 fetch_func，合并后返回 fetch_func 同结构的行。
+    快照不可用时退回全量 fetch。返回值只保证可迭代一遍（实时部分可能是流式生成器）。
+    """
+    fetch_func = cfg["fetch_func"]
+    if not metric or not supports_incremental(cfg):
+        return iter_fetch(fetch_func, experiment_name, start_date, end_date, engine)
+    try:
+        snapshot_rows = get_snapshot_rows(engine, experiment_name, metric, start_date, end_date)
+    except Exception as e:
+        print(f"[SNAPSHOT] {metric} 读取快照失败，退回全量查询: {e}")
+        return iter_fetch(fetch_func, experiment_name, start_date, end_date, engine)
+
+    existing_dates = {r["event_date"] for r in snapshot_rows}
+    fetch_ranges = plan_fetch_ranges(start_date, end_date, existing_dates, open_days_for(cfg))
+    refetched_days = days_in_ranges(fetch_ranges)
+
+    rows = [snapshot_row_to_fetch_row(r, cfg) for r in snapshot_rows if r["event_date"] not in refetched_days]
+    fetched = [
+        iter_fetch(fetch_func, experiment_name, range_start, range_end, engine)
+        for range_start, range_end in fetch_ranges
+    ]
+    print(f"[SNAPSHOT] {metric} 复用快照 {len(existing_dates - refetched_days)} 天，实时查询 {len(refetched_days)} 天")
+    return chain(rows, *fetched)
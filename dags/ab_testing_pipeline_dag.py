@@ -7,8 +7,11 @@ from airflow.operators.python import PythonOperator
 # 因为 backend 文件夹被完整挂载到了 /opt/airflow/backend，
 # 并且 Airflow 会自动将 /opt/airflow/ 加入 PYTHONPATH，
 # 所以可以直接从 backend 开始导入。
+from backend.airflow.refresh_assignments import main as assignment_main
 from backend.airflow.run_all_metrics import main as snapshot_main
 from backend.airflow.summary_cache import main as aggregate_main
+from backend.airflow.warm_cache import main as warm_main
+from backend.airflow.purge_cache import main as purge_main
 
 
 @dag(
@@ -30,6 +33,12 @@ def ab_testing_pipeline():
     This DAG runs the daily snapshot and aggregation tasks for A/B testing.
     """
 
+    # 物化分组表（建表 + 增量刷新）：后面生成快照的 fetcher 都读它
+    task_refresh_assignments = PythonOperator(
+        task_id='refresh_assignments',
+        python_callable=assignment_main,
+    )
+
     task_generate_snapshot = PythonOperator(
         task_id='generate_metric_snapshots',
         python_callable=snapshot_main,
@@ -40,7 +49,20 @@ def ab_testing_pipeline():
         python_callable=aggregate_main,
     )
 
-    task_generate_snapshot >> task_aggregate_and_cache
+    # 新数据落地、缓存 generation 已 bump：让 web 服务把运行中实验的缓存预先算好
+    task_warm_cache = PythonOperator(
+        task_id='warm_cache',
+        python_callable=warm_main,
+    )
+
+    # 删掉过期 / 长期没人看的缓存行，按字节预算淘汰最久没访问的
+    task_purge_cache = PythonOperator(
+        task_id='purge_cache',
+        python_callable=purge_main,
+    )
+
+    task_refresh_assignments >> task_generate_snapshot >> task_aggregate_and_cache >> task_warm_cache
+    task_aggregate_and_cache >> task_purge_cache
 
 
 # 实例化 DAG